@@ -1,6 +1,12 @@
 import os
 import pandas as pd
 
+from city_partitions import (content_fingerprint, is_partition_current, write_partition, read_partition_info,
+                             write_manifest, assemble_csv)
+from inventory_loader import load_inventories, workbook_hash, file_hash
+from run_log import log_stage, write_record
+from species_codes import code_cities, load_species_codes, translate_species_codes, unmatched_code_counts
+
 # All datasets have, in order, Botanical Name, DBH, DAUID, CTUID, and City.
 
 cities = ["Kelowna", "Maple Ridge", "New Westminster", "Vancouver", "Victoria", "Calgary", "Edmonton", "Lethbridge",
@@ -8,66 +14,68 @@ cities = ["Kelowna", "Maple Ridge", "New Westminster", "Vancouver", "Victoria",
           "Mississauga", "Niagara Falls", "Ottawa", "Peterborough", "St. Catharines", "Toronto", "Waterloo", "Welland",
           "Whitby", "Windsor", "Longueuil", "Montreal", "Quebec City", "Fredericton", "Moncton", "Halifax"]
 
-# Initialize an empty list to hold the data
-data_frames = []
-
 # Process each city file
 file_path_inventories = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Inventories'
-for city in cities:
-    file_name = fr'{file_path_inventories}\{city}.xlsx'
-
-    # Check if the file exists
-    if os.path.exists(file_name):
-        df = pd.read_excel(file_name)
-
-        # Append the DataFrame to the list
-        data_frames.append(df)
-    else:
-        print(f"{city} file does not exist.")
-
-if len(data_frames) <= 0:
-    raise ValueError("No cities XLSX files loaded... Ensure they have been placed in data/cities subdir.")
-
-# Concatenate all DataFrames
-master_df = pd.concat(data_frames, ignore_index=True)
-
-# Convert inches to cm in Vancouver
-master_df.loc[master_df['City'] == 'Vancouver', 'DBH'] *= 2.54
-
-## Species codes to scientific binomials
-# Load the data dictionaries
-file_path_species_codes = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Tree Codes'
-Halifax_dict = pd.read_csv(fr'{file_path_species_codes}\Halifax.csv')
-Mississauga_dict = pd.read_csv(fr'{file_path_species_codes}\Mississauga.csv')
-Moncton_dict = pd.read_csv(fr'{file_path_species_codes}\Moncton.csv')
-Ottawa_dict = pd.read_csv(fr'{file_path_species_codes}\Ottawa.csv')
-Toronto_dict = pd.read_csv(fr'{file_path_species_codes}\Toronto.csv')
-
-# Replace the species codes
-def replace_botanical_name(row):
-    if row['City'] == 'Halifax':
-        code_dict = Halifax_dict
-    elif row['City'] == 'Mississauga':
-        code_dict = Mississauga_dict
-    elif row['City'] == 'Moncton':
-        code_dict = Moncton_dict
-    elif row['City'] == 'Ottawa':
-        code_dict = Ottawa_dict
-    elif row['City'] == 'Toronto':
-        code_dict = Toronto_dict
-    else:
-        return row['Botanical Name']  # If city doesn't match, return the original Botanical Name
-
-    # Try to match the code and return the corresponding botanical name
-    match = code_dict[code_dict['Code'] == row['Botanical Name']]
-    if not match.empty:
-        return match['Botanical Name'].values[0]
-    else:
-        return row['Botanical Name']  # If no match is found, keep the original value
-
-master_df['Botanical Name'] = master_df.apply(replace_botanical_name, axis=1) # Apply the function to the DataFrame
-
-# Save the master DataFrame to a CSV file
-master_df.to_csv(r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Master Dataset.csv', index=False)
-
-print("Merged CSV file created successfully.")
+
+# The process pool re-imports this script in each worker, so the pipeline only runs from the main process
+if __name__ == '__main__':
+    # Load the workbooks in parallel; unchanged cities are read from the Parquet cache
+    data_frames, load_times_df = load_inventories(file_path_inventories, cities)
+
+    # Report how long each city took to load, slowest first
+    pd.set_option('display.max_columns', None)
+    print("Inventory load times per city:")
+    print(load_times_df)
+    load_times_df.to_csv(r'(1) Inventory Load Times.csv', index=False)
+    # Log every city's load to the run log
+    for timing in load_times_df.to_dict('records'):
+        write_record({'stage': 'load', 'city': timing['City'], 'rows_in': None, 'rows_out': timing['Rows'],
+                      'source': timing['Source'], 'status': 'ok', 'seconds': round(timing['Total Seconds'], 4)})
+
+    if len(data_frames) <= 0:
+        raise ValueError("No cities XLSX files loaded... Ensure they have been placed in data/cities subdir.")
+
+    ## Merge each city into its own partition
+    # A city is only merged again when its workbook or its code dictionary changed
+    file_path_species_codes = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Tree Codes'
+    file_path_partitions = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(1) Master Dataset Partitions'
+    codes_df = None
+
+    unmatched_reports = []
+    for city, city_df in data_frames.items():
+        code_file = os.path.join(file_path_species_codes, f'{city}.csv')
+        fingerprint = content_fingerprint('merge', workbook_hash(file_path_inventories, city),
+                                          file_hash(code_file) if city in code_cities else None)
+
+        if not is_partition_current(file_path_partitions, city, fingerprint):
+            print(f"Merging {city}...")
+            with log_stage('merge', city, rows_in=city_df.shape[0]) as record:
+                ## Species codes to scientific binomials
+                # Load the data dictionaries into one (City, Code) table the first time a city needs them
+                if codes_df is None:
+                    codes_df = load_species_codes(file_path_species_codes)
+
+                # Replace the species codes in one join; values that are not codes keep their original Botanical Name
+                translated_names, unmatched_codes_df = translate_species_codes(city_df, codes_df)
+                record['unmatched_codes'] = unmatched_code_counts(city_df, codes_df).get(city, {})
+                city_df['Botanical Name'] = translated_names
+
+                write_partition(city_df, file_path_partitions, city, fingerprint,
+                                unmatched_codes=unmatched_codes_df.to_dict('records'))
+                record['rows_out'] = city_df.shape[0]
+
+        unmatched_reports.extend(read_partition_info(file_path_partitions, city)['unmatched_codes'])
+
+    # Record which cities make up the master dataset, in order
+    write_manifest(file_path_partitions, data_frames.keys())
+
+    # Report how many trees in each code-dictionary city did not match a code
+    unmatched_codes_df = pd.DataFrame(unmatched_reports, columns=['City', 'Trees', 'Unmatched Trees', 'Unmatched Codes'])
+    unmatched_codes_df = unmatched_codes_df.sort_values('Trees', ascending=False, ignore_index=True)
+    print("Unmatched species codes per city:")
+    print(unmatched_codes_df)
+
+    # Re-assemble the master dataset from the city partitions and save it to a CSV file
+    assemble_csv(file_path_partitions, data_frames.keys(), r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Master Dataset.csv')
+
+    print("Merged CSV file created successfully.")
@@ -1,127 +1,205 @@
+import os
+
 import pandas as pd
-import re
 
-# Load the merged CSV file
-merged_df = pd.read_csv(r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(1) Master Dataset.csv', low_memory=False)
+from analysis_dataset import AnalysisDatasetWriter, assemble_analysis_dataset
+from city_partitions import (content_fingerprint, frame_hash, is_partition_current, PartitionWriter, read_partition,
+                             read_partition_info, write_partition_info, read_manifest, write_manifest, assemble_csv,
+                             partition_paths, manifest_name)
+from cleaning import data_dict_df, to_master_dtypes, clean_master_chunk, add_chunk_counts
+from dbh_quality import dbh_quality_settings, quality_columns, city_dbh_quality
+from inventory_loader import file_hash
+from name_normalizer import compile_find_and_replace
+from run_log import log_stage
+from taxonomy import load_taxonomy_table, attach_taxonomy, reference_fingerprint
+from wcvp_index import read_nativity_index
+
+# Set to a number of trees (e.g. 1_000_000) to stream each city in chunks of that size, so memory use stays the same
+# however many trees a city has. None cleans each city at once. Both give the same output.
+chunk_size = None
+
+# Boundary files used to place geocoded trees (inventories with Longitude and Latitude columns) in their census areas,
+# e.g. {'DAUID': da_file, 'CTUID': da_file, 'Downtown': downtown_file}. Blank DAUID and CTUID values are filled from
+# the polygons holding the trees, and the Downtown column flags trees inside the downtown polygons. None keeps the
+# DAUID and CTUID values the inventories report.
+# Placing trees needs the optional geopandas, shapely (2.0 or later) and pyproj packages, which are only imported when
+# boundary files are set.
+census_boundary_files = None
+
+# DBH units of cities whose unit the DBH quality check infers wrongly, e.g. {'Halifax': 'cm'}; every other city's unit
+# is inferred from its DBH values (see dbh_quality.py)
+dbh_unit_overrides = {}
+
+# Load the reference datasets
 species_clean_df = pd.read_csv(r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Find and Replace.csv', low_memory=False)
-
-## Clean the Botanical Name column
-initial_count = merged_df.shape[0]
-
-# Deal with blank (missing) species ID, then make all species names lowercase and trim spaces
-merged_df['Botanical Name'] = merged_df['Botanical Name'].replace('', pd.NA).fillna('missing')
-merged_df['Botanical Name'] = merged_df['Botanical Name'].str.lower().str.strip()
-merged_df['Botanical Name'] = merged_df['Botanical Name'].replace('', pd.NA).fillna('missing')
-
-# Standardize cultivars and species
-merged_df['Botanical Name'] = merged_df['Botanical Name'].str.replace(" x ", " ", regex=False)
-merged_df['Botanical Name'] = merged_df['Botanical Name'].str.replace("'", "", regex=False)
-
-# Use find and replace to deal with spelling mistakes in inventory datasets
-for index, row in species_clean_df.iterrows():
-    find = row['Find']
-    replace = row['Replace']
-
-    # Ensure word boundaries are respected in the replacement to avoid partial replacements
-    pattern = r'\b' + re.escape(find) + r'\b'
-
-    merged_df['Botanical Name'] = merged_df['Botanical Name'].str.replace(pattern, replace, regex=True)
-
-# Remove any non-living trees
-filtered_df = merged_df[~merged_df["Botanical Name"].isin(["dead", "stump", "stump spp.", "stump for", "shrub", "shrubs", "vine", "vines", "hedge", "vacant"])]
-
-# Add spp. to genus-only identification
-def add_spp_if_only_genus(name):
-    if isinstance(name, str) and len(name.strip().split()) == 1:  # Trim spaces and check if there's only one word
-        return name.strip() + " spp."  # Trim spaces and add spp.
-    return name.strip()  # Trim spaces in any case
-filtered_df.loc[:, 'Botanical Name'] = filtered_df['Botanical Name'].apply(add_spp_if_only_genus) # Apply the function to the 'Botanical Name' column
-final_count = filtered_df.shape[0]
-
-# Remove any incorrect letters
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("Ã—", "", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("Ã", "", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("_x000d_", "", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("â€˜", "", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("â€™", "", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace(" '", " ", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace(" x ", " ", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("'", "", regex=False)
-
-# Spot check functions
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("pinus missing", "pinus spp.", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("stump spp.", "missing", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("malus sp.", "malus spp.", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("..", ".", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("magnolia missing", "magnolia spp.", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("missing.", "missing", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("missing spp.", "missing", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("spp. spp.", "missing", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("malus missing", "malus spp.", regex=False)
-filtered_df['Botanical Name'] = filtered_df['Botanical Name'].str.replace("pyrus missing", "pyrus spp.", regex=False)
-
-## Clean the DBH column
-filtered_df.loc[:, "DBH"] = pd.to_numeric(filtered_df["DBH"], errors='coerce')
-filtered_df.loc[filtered_df["DBH"] > 350, "DBH"] = 0
-filtered_df.loc[filtered_df["DBH"] == 0, "DBH"] = pd.NA
-num_rows_with_dbh_0 = filtered_df[filtered_df["DBH"] == 0].shape[0]
-print(f"Number of rows with DBH of 0: {num_rows_with_dbh_0}")
-
-# Calculate basal area
-filtered_df.loc[:, 'Basal Area'] = 0.00007854 * (filtered_df['DBH'] ** 2)
-
-# Remove rows where both DAUID and CTUID are missing
-filtered_df = filtered_df[~(filtered_df["DAUID"].isna() & filtered_df["CTUID"].isna())]
-
-# Count the number of rows after removing rows with missing DAUID and CTUID
-final_count_after_missing_removal = filtered_df.shape[0]
-
-# Find and count unique values of DAUID where CTUID is blank
-blank_ctuid_df = filtered_df[filtered_df["CTUID"].isna()]
-unique_dauid_with_blank_ctuid = blank_ctuid_df["DAUID"].unique()
-num_instances_blank_ctuid = blank_ctuid_df.shape[0]
-
+location_index_df = pd.read_csv(r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Location Index.csv', low_memory=False)
+nativity_index = read_nativity_index(r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Tree Nativity and Families\Nativity Index.arrow')
+family_index = pd.read_csv(r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Families Index.csv', low_memory=False)
+find_and_replace = pd.read_csv(r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Find and Replace 2.csv', low_memory=False)
+
+# Compile the find and replace rules used to deal with spelling mistakes in inventory datasets
+find_and_replace_rules = compile_find_and_replace(species_clean_df)
+
+# Rules as the run log names them, by their row number in Find and Replace.csv
+find_and_replace_labels = {str(number): f'{find} -> {replace}' for number, (find, replace)
+                           in enumerate(zip(species_clean_df['Find'], species_clean_df['Replace']))}
+
+## Clean each city into its own partition
+# A city is only cleaned again when its merged partition, its DBH unit or fence, Find and Replace.csv, the CTUID
+# back-fill table or the census boundary files changed
+file_path_merged_partitions = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(1) Master Dataset Partitions'
+file_path_filtered_partitions = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(2) Filtered Master Dataset Partitions'
+file_path_analysis_partitions = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(2) Analysis Partitions'
+file_path_filtered_csv = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(2) Filtered Master Dataset.csv'
+file_path_analysis_dataset = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(2) Filtered Master Dataset.parquet'
+cities = read_manifest(file_path_merged_partitions)
+
+# Cities the outputs were last assembled from, so they are only re-assembled when a city or the city list changed
+previous_cities = None
+if os.path.exists(os.path.join(file_path_filtered_partitions, manifest_name)):
+    previous_cities = read_manifest(file_path_filtered_partitions)
+changed_cities = []
+
+cleaning_inputs = [file_hash(r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Find and Replace.csv'), frame_hash(data_dict_df),
+                   dbh_quality_settings]
+census_layers = None
+if census_boundary_files is not None:
+    from spatial_join import read_census_layers, assign_census_areas
+    cleaning_inputs += [(layer, file_hash(file_name)) for layer, file_name in sorted(census_boundary_files.items())]
+
+counts = {}
+dbh_quality_rows = []
+for city in cities:
+    # A city's DBH unit and outlier fence come from the DBH column of its own merged partition, so no table of every
+    # city's trees is built and they only change with its merged partition or an override. They are stored with the
+    # cleaned partition, so the DBH of an unchanged city is not read again
+    merged_fingerprint = read_partition_info(file_path_merged_partitions, city)['fingerprint']
+    dbh_quality_key = content_fingerprint('dbh quality', merged_fingerprint, dbh_quality_settings,
+                                          dbh_unit_overrides.get(city))
+    filtered_info = read_partition_info(file_path_filtered_partitions, city)
+    if filtered_info is not None and filtered_info.get('dbh_quality_key') == dbh_quality_key:
+        dbh_quality_row = filtered_info['dbh_quality']
+    else:
+        city_dbh = pd.read_parquet(partition_paths(file_path_merged_partitions, city)[0], columns=['DBH'])['DBH']
+        dbh_quality_row = city_dbh_quality(city_dbh, city, dbh_unit_overrides.get(city))
+        del city_dbh
+    dbh_quality_rows.append(dbh_quality_row)
+    dbh_quality = pd.DataFrame([dbh_quality_row], columns=quality_columns)
+    fingerprint = content_fingerprint('clean', merged_fingerprint, *cleaning_inputs,
+                                      dbh_quality[['Unit', 'Factor', 'Upper Fence (cm)']].to_dict('records'))
+
+    if not is_partition_current(file_path_filtered_partitions, city, fingerprint):
+        print(f"Cleaning {city}...")
+        changed_cities.append(city)
+        # Each cleaned block is appended to the city's partition as it is produced
+        with log_stage('clean', city) as record, PartitionWriter(file_path_filtered_partitions, city) as partition_writer:
+            city_counts = {}
+            for merged_df in read_partition(file_path_merged_partitions, city, chunk_size):
+                # Place geocoded trees in their census areas before trees without a DAUID and CTUID are removed
+                if census_boundary_files is not None:
+                    if census_layers is None:
+                        census_layers = read_census_layers(census_boundary_files)
+                    merged_df, spatial_counts = assign_census_areas(merged_df, census_layers)
+                    add_chunk_counts(city_counts, spatial_counts)
+
+                # Clean the Botanical Name and DBH columns, calculate basal area and fill missing CTUID values
+                filtered_df, chunk_counts = clean_master_chunk(to_master_dtypes(merged_df), find_and_replace_rules,
+                                                                dbh_quality, inventory=city)
+                partition_writer.write(filtered_df)
+                add_chunk_counts(city_counts, chunk_counts)
+
+            # Rows in and out, the rows each filter dropped and the trees each Find and Replace rule changed
+            record['rows_in'] = city_counts['initial_count']
+            record['rows_out'] = partition_writer.rows
+            record['dropped'] = {
+                'non-living names': city_counts['initial_count'] - city_counts['final_count'],
+                'missing DAUID and CTUID': city_counts['final_count'] - city_counts['final_count_after_missing_removal']
+            }
+            rule_hits = sorted(city_counts['find_and_replace_hits'].items(), key=lambda hit: -hit[1])
+            record['find_and_replace_hits'] = {find_and_replace_labels[rule]: hits for rule, hits in rule_hits}
+            # The unit the city's DBH was read in and the DBH values converted or set to missing
+            record['dbh'] = {'unit': dbh_quality['Unit'].iloc[0],
+                             'converted': city_counts['num_dbh_converted'],
+                             'above fence': city_counts['num_dbh_above_fence'],
+                             'not positive': city_counts['num_dbh_not_positive']}
+
+            partition_writer.finish(fingerprint, counts=city_counts, dbh_quality_key=dbh_quality_key,
+                                    dbh_quality=dbh_quality_row)
+
+    add_chunk_counts(counts, read_partition_info(file_path_filtered_partitions, city)['counts'])
+
+## Attach the location and taxonomy columns to each city into its own analysis partition
+# A city's analysis partition is only rebuilt when its cleaned partition, Location Index.csv or the taxonomy reference
+# tables changed
+analysis_inputs = [frame_hash(location_index_df), reference_fingerprint(find_and_replace, family_index, nativity_index)]
+analysis_fingerprints = {city: content_fingerprint('analysis', read_partition_info(file_path_filtered_partitions, city)['fingerprint'],
+                                                   *analysis_inputs) for city in cities}
+analysis_cities = [city for city in cities if not is_partition_current(file_path_analysis_partitions, city,
+                                                                      analysis_fingerprints[city], csv=False)]
+
+if analysis_cities:
+    # The taxonomy lookup table is extended once with the names of every city being rebuilt
+    name_df = pd.concat([pd.read_parquet(partition_paths(file_path_filtered_partitions, city)[0], columns=['Botanical Name'])
+                         .drop_duplicates().assign(City=city) for city in analysis_cities], ignore_index=True)
+    taxonomy_table = load_taxonomy_table(name_df.merge(location_index_df, how='left', on='City'), r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(4) Taxonomy Lookup.parquet',
+                                         find_and_replace, family_index, nativity_index)
+    del name_df
+    os.makedirs(file_path_analysis_partitions, exist_ok=True)
+
+for city in analysis_cities:
+    analysis_partition = partition_paths(file_path_analysis_partitions, city)[0]
+    with log_stage('taxonomy', city, rows_in=0, rows_out=0, trees_without_family=0) as record:
+        with AnalysisDatasetWriter(analysis_partition + '.tmp') as analysis_writer:
+            for filtered_df in read_partition(file_path_filtered_partitions, city, chunk_size):
+                analysis_df = filtered_df.merge(location_index_df, how='left', on='City')
+                analysis_df = attach_taxonomy(analysis_df, taxonomy_table, drop_excluded=False)
+                analysis_writer.write(analysis_df)
+
+                record['rows_in'] += filtered_df.shape[0]
+                record['rows_out'] += analysis_df.shape[0]
+                record['trees_without_family'] += int(analysis_df['Family'].isna().sum())
+        os.replace(analysis_partition + '.tmp', analysis_partition)
+        write_partition_info(file_path_analysis_partitions, city, analysis_fingerprints[city])
+
+## Re-assemble the outputs from the city partitions
+dbh_quality_df = pd.DataFrame(dbh_quality_rows, columns=quality_columns)
+dbh_quality_df.to_csv(r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(2) DBH Quality.csv', index=False)
+
+# The outputs are kept when no city was cleaned or rebuilt and the city list is the same
+if (changed_cities or analysis_cities or cities != previous_cities
+        or not (os.path.exists(file_path_filtered_csv) and os.path.exists(file_path_analysis_dataset))):
+    # The manifest of the cleaned partitions tells later readers (query_service.py) which cities the outputs hold
+    write_manifest(file_path_filtered_partitions, cities)
+
+    # Save the updated DataFrame to the master CSV file
+    assemble_csv(file_path_filtered_partitions, cities, file_path_filtered_csv)
+
+    # Save the analysis-ready dataset with the location and taxonomy columns attached
+    assemble_analysis_dataset([partition_paths(file_path_analysis_partitions, city)[0] for city in cities],
+                              file_path_analysis_dataset)
+else:
+    print("No city changed; the Filtered Master Dataset files are current.")
+
+print("DBH unit and outlier fence of each city:")
+print(dbh_quality_df.to_string(index=False))
+print(f"Number of DBH values converted to cm: {counts['num_dbh_converted']}")
+print(f"Number of DBH values above their city's fence set to missing: {counts['num_dbh_above_fence']}")
+print(f"Number of DBH values of 0 or less set to missing: {counts['num_dbh_not_positive']}")
+print(f"Number of rows with DBH of 0: {counts['num_rows_with_dbh_0']}")
 print("Unique DAUID values where CTUID is blank:")
-print(unique_dauid_with_blank_ctuid)
-print(f"Number of instances where CTUID is blank: {num_instances_blank_ctuid}")
-
-# Fill missing CTUID values
-data_dict = {
-    'DAUID': [59150883, 59150891, 59153562, 59170272, 35240431, 35100286, 35201466, 35204675, 35204821, 35205067,
-              35370553, 24580007, 24662985, 24662707, 24662951, 24662821, 24662885, 24660984, 24663395, 24230066,
-              13100304, 13070131, 12090576, 59154073],
-    'CTUID': [9330045.01, 9330025, 9330059.08, 9350001, 5370204, 5210100.01, 5350003, 5350210.04, 5350012.01, 5350200.01,
-              5590043.02, 4620886.03, 4620288, 4620276, 4620585.01, 4620290.05, 4620290.09, 4620322.03, 4620390, 4210310,
-              3200009, 3050006, 2050112, 9330202.01],
-    'City': ['Vancouver', 'Vancouver', 'Vancouver', 'Victoria', 'Burlington', 'Kingston', 'Toronto', 'Toronto', 'Toronto', 'Toronto',
-             'Windsor', 'Longueuil', 'Montreal', 'Montreal', 'Montreal', 'Montreal', 'Montreal', 'Montreal', 'Montreal', 'Quebec City',
-             'Fredericton', 'Moncton', 'Halifax', 'New Westminster']
-}
-
-data_dict_df = pd.DataFrame(data_dict)
-
-# Merge the filtered DataFrame with the data dictionary DataFrame based on "DAUID"
-filtered_df = filtered_df.merge(data_dict_df, on='DAUID', how='left', suffixes=('', '_dict'))
-
-# Fill missing CTUID and City values from the dictionary
-filtered_df['CTUID'] = filtered_df['CTUID'].combine_first(filtered_df['CTUID_dict'])
-filtered_df['City'] = filtered_df['City'].combine_first(filtered_df['City_dict'])
-
-# Drop the extra columns from the dictionary
-filtered_df = filtered_df.drop(columns=['CTUID_dict', 'City_dict'])
+print(counts['unique_dauid_with_blank_ctuid'])
+print(f"Number of instances where CTUID is blank: {counts['num_instances_blank_ctuid']}")
 print("CTUID and City columns updated based on DAUID.")
 
-# Count the number of instances of DAUID with blank CTUID after filling
-blank_ctuid_df_after_filling = filtered_df[filtered_df["CTUID"].isna()]
-num_instances_blank_ctuid_after_filling = blank_ctuid_df_after_filling.shape[0]
-
-# Save the updated DataFrame to the master CSV file
-filtered_df.to_csv(r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(2) Filtered Master Dataset.csv', index=False)
-
 # Print the counts
-print(f"Number of trees where CTUID is blank after filling: {num_instances_blank_ctuid_after_filling}")
-print(f"Number of trees after removing trees with missing DAUID and CTUID: {final_count_after_missing_removal}")
-print(f"Number of out-of-city trees removed: {final_count - final_count_after_missing_removal}")
-print(f"Number of dead trees, stumps, missing, etc. removed: {initial_count - final_count}")
+print(f"Number of trees where CTUID is blank after filling: {counts['num_instances_blank_ctuid_after_filling']}")
+if census_boundary_files is not None:
+    print(f"Number of geocoded trees: {counts['num_trees_geocoded']}")
+    print(f"Number of DAUID values filled from coordinates: {counts['num_dauid_from_coordinates']}")
+    print(f"Number of CTUID values filled from coordinates: {counts['num_ctuid_from_coordinates']}")
+    print(f"Number of geocoded trees outside the census areas: {counts['num_trees_outside_census_areas']}")
+print(f"Number of trees after removing trees with missing DAUID and CTUID: {counts['final_count_after_missing_removal']}")
+print(f"Number of out-of-city trees removed: {counts['final_count'] - counts['final_count_after_missing_removal']}")
+print(f"Number of dead trees, stumps, missing, etc. removed: {counts['initial_count'] - counts['final_count']}")
 
 print("Filtered Master Dataset file created successfully.")
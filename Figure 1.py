@@ -1,11 +1,11 @@
-import importlib
-import os
-import sys
-
-import matplotlib.pyplot as plt
 import numpy as np
 from scipy.ndimage import gaussian_filter1d
 
+from figures import figure_job, export_or_show
+
+# Folder Figure 1 is saved to with the Agg backend, so it renders unattended; None shows it on screen instead
+figure_dir = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Figure 1'
+
 
 def generate_youthful_curve(x, c=-0.02, starting_amplitude=1, b=-3.55):
     y = c + (starting_amplitude * np.exp(b * (x / 80)))
@@ -81,8 +81,8 @@ def normalize_to_key_points(x, y, key_points):
     return y_normalized
 
 
-def plot_tree_population_curves():
-    fig, ax = plt.subplots()
+def plot_tree_population_curves(fig):
+    ax = fig.subplots()
 
     x = np.linspace(0, 80, 300)
     key_points = [10, 30, 50, 70]
@@ -126,19 +126,10 @@ def plot_tree_population_curves():
 
     ax.legend()
 
-    plt.tight_layout()
-    plt.show()
+    fig.tight_layout()
 
 
 if __name__ == '__main__':
-    importlib.import_module(os.path.splitext(os.path.basename(__file__))[0])
-
-    script_path = os.path.basename(__file__)
-    script_name = os.path.splitext(script_path)[0]
-
-    while True:
-        if script_name in sys.modules:
-            importlib.reload(sys.modules[script_name])
-
-        # Call the plotting function from the reloaded module
-        sys.modules[script_name].plot_tree_population_curves()
+    # Only drawn again when the curves' code changed; the curves are drawn from this script's own file
+    export_or_show([figure_job('Figure 1.png', (__file__, 'plot_tree_population_curves'), figsize=(6.4, 4.8))],
+                   figure_dir)
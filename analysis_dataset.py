@@ -0,0 +1,146 @@
+# Typed, compressed Parquet copy of the filtered master dataset for the analysis scripts.
+# Master Cleaning writes it once with the location and taxonomy columns attached, so the analysis scripts no longer
+# re-infer types from the CSV, re-merge Location Index.csv or re-coerce DBH, and can read only the columns they use.
+# Rows are sorted by City (within each chunk when written in chunks), so filtering on City skips row groups.
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Repeated strings are stored once per value
+categorical_columns = ['City', 'Botanical Name', 'Species', 'Genus', 'Family', 'Ecozone', 'City Size', 'Province',
+                       'Nativity']
+
+# DAUID is a whole-number census code; CTUID keeps float64 because census tract codes carry two decimals
+# (e.g. 5350210.04)
+integer_columns = ['DAUID']
+float32_columns = ['DBH', 'Basal Area']
+
+
+# Cast the analysis columns that are present to their compact types
+def to_analysis_dtypes(df):
+    df = df.copy()
+    for column in categorical_columns:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    for column in integer_columns:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce').round().astype('Int64')
+    for column in float32_columns:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype('float32')
+    if 'CTUID' in df.columns:
+        df['CTUID'] = pd.to_numeric(df['CTUID'], errors='coerce')
+    return df
+
+
+# Write the analysis-ready dataset, one row group per block of trees sorted by City
+def write_analysis_dataset(df, file_name, row_group_size=250_000):
+    df = to_analysis_dtypes(df)
+    df = df.sort_values('City', kind='stable', ignore_index=True)
+    df.to_parquet(file_name, index=False, compression='zstd', row_group_size=row_group_size)
+
+
+# Arrow schema of the analysis columns, so every chunk of a streamed write stores the same column types
+def analysis_schema(df):
+    fields = []
+    for column, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            field_type = pa.dictionary(pa.int32(), pa.string())
+        elif column in integer_columns:
+            field_type = pa.int64()
+        elif pd.api.types.is_bool_dtype(dtype):
+            field_type = pa.bool_()
+        elif isinstance(dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(dtype):
+            field_type = pa.from_numpy_dtype(dtype.numpy_dtype)  # Nullable integers such as the Native Mask
+        elif pd.api.types.is_numeric_dtype(dtype):
+            field_type = pa.from_numpy_dtype(dtype)
+        else:
+            field_type = pa.string()
+        fields.append(pa.field(column, field_type))
+    return pa.schema(fields)
+
+
+# Append cleaned chunks to the analysis-ready dataset one at a time
+# Each chunk is sorted by City; chunks keep the order in which they are written
+class AnalysisDatasetWriter:
+    def __init__(self, file_name, row_group_size=250_000):
+        self.file_name = file_name
+        self.row_group_size = row_group_size
+        self.schema = None
+        self.writer = None
+
+    def write(self, df):
+        df = to_analysis_dtypes(df)
+        df = df.sort_values('City', kind='stable', ignore_index=True)
+
+        # The first chunk fixes the columns and their types
+        if self.writer is None:
+            self.schema = analysis_schema(df)
+            self.writer = pq.ParquetWriter(self.file_name, self.schema, compression='zstd')
+
+        table = pa.Table.from_pandas(df[self.schema.names], schema=self.schema, preserve_index=False)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Re-assemble the analysis-ready dataset from files written by AnalysisDatasetWriter (e.g. one per city), in the given
+# order, one row group at a time. Every file is cast to the column types of the first, as a streamed write fixes them
+# with its first chunk
+def assemble_analysis_dataset(part_files, file_name, row_group_size=250_000):
+    writer = None
+    try:
+        for part_file in part_files:
+            parquet_file = pq.ParquetFile(part_file)
+            for row_group in range(parquet_file.num_row_groups):
+                table = parquet_file.read_row_group(row_group)
+                if writer is None:
+                    writer = pq.ParquetWriter(file_name, table.schema, compression='zstd')
+                table = table.select(writer.schema.names).cast(writer.schema)
+                writer.write_table(table, row_group_size=row_group_size)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# Read the requested columns, optionally keeping or excluding a list of cities
+# Optional columns (e.g. the Downtown flag, only there when Master Cleaning placed trees by their coordinates) are read
+# too when the dataset has them
+def read_analysis_dataset(file_name, columns=None, cities=None, exclude_cities=None, optional_columns=None):
+    if columns is not None and optional_columns is not None:
+        names = pq.read_schema(file_name).names
+        columns = list(columns) + [column for column in optional_columns if column in names and column not in columns]
+
+    filters = []
+    if cities is not None:
+        filters.append(('City', 'in', list(cities)))
+    if exclude_cities is not None:
+        filters.append(('City', 'not in', list(exclude_cities)))
+
+    df = pd.read_parquet(file_name, columns=columns, filters=filters or None)
+
+    # Drop categories of filtered-out values so groupby does not report empty groups
+    for column in df.columns[df.dtypes == 'category']:
+        df[column] = df[column].cat.remove_unused_categories()
+    return df
+
+
+# Downtown flag (1 or 0) of every tree: the Downtown column, where Master Cleaning placed the tree in or out of the
+# downtown polygons from its coordinates, and otherwise whether its DA is listed as downtown in Downtown Areas.csv
+def downtown_flags(df, downtown_df):
+    downtown_dauids = downtown_df.loc[downtown_df['DOWNTOWN'] == 'Downtown', 'DAUID']
+    flags = df['DAUID'].isin(downtown_dauids).to_numpy(dtype=np.int8)
+    if 'Downtown' in df.columns:
+        placed = pd.to_numeric(df['Downtown'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        flags = np.where(np.isnan(placed), flags, placed).astype(np.int8)
+    return flags
@@ -0,0 +1,169 @@
+# Benchmark of the pipeline's hot paths on synthetic inventories of increasing size.
+# Each stage is timed on its own, then run a second time under tracemalloc to record its peak memory (tracemalloc
+# works on every platform and sees the NumPy and pandas buffers). Results are appended to Benchmark Results.csv with
+# the commit they were measured on, and every stage is compared to its best earlier time at the same size so
+# regressions in the hot paths show up.
+
+import datetime
+import os
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from cleaning import to_master_dtypes, clean_master_chunk
+from dbh_quality import dbh_quality_table
+from dbh_fitting import bins, labels, fit_distributions
+from diversity import diversity_indices
+from hypothesis_tests import mann_whitney_tests
+from name_normalizer import compile_find_and_replace
+from species_codes import code_cities, translate_species_codes
+from synthetic_inventories import generate_dataset
+from taxonomy import build_taxonomy_table, attach_taxonomy
+
+# Numbers of trees to benchmark; 10_000_000 covers the full range but needs about 16 GB of memory
+tree_counts = [10_000, 100_000, 1_000_000]
+seed = 0
+
+# Stages slower than this multiple of their best earlier time are reported as regressions, unless the difference is
+# below timer noise
+regression_threshold = 1.25
+noise_seconds = 0.05
+
+results_file = r'Benchmark Results.csv'
+
+
+## Stages, each taking the output of the previous one
+# Concatenate the city inventories
+def merge_stage(inventories):
+    return pd.concat(inventories.values(), ignore_index=True)
+
+
+# Replace the species codes of the code-dictionary cities
+def code_translation_stage(master_df, codes_df):
+    master_df = master_df.copy()
+    master_df['Botanical Name'] = translate_species_codes(master_df, codes_df)[0]
+    return master_df
+
+
+# Clean names and DBH (in each city's inferred unit), calculate basal area and fill missing CTUID values
+def cleaning_stage(master_df, find_and_replace_df):
+    return clean_master_chunk(to_master_dtypes(master_df), compile_find_and_replace(find_and_replace_df),
+                              dbh_quality_table(master_df[['City', 'DBH']]))[0]
+
+
+# Resolve Species, Genus, Family and Nativity and attach them to the trees
+def taxonomy_stage(filtered_df, reference_tables):
+    df = filtered_df.merge(reference_tables['location_index'], how='left', on='City')
+    taxonomy_table = build_taxonomy_table(df[['Botanical Name', 'Province']], reference_tables['find_and_replace_2'],
+                                          reference_tables['family_index'], reference_tables['introduced_trees_index'])
+    return attach_taxonomy(df, taxonomy_table)
+
+
+# Shannon (and the other diversity indices) per city and per DA
+def shannon_stage(taxonomy_df):
+    return pd.concat([diversity_indices(taxonomy_df, 'City'), diversity_indices(taxonomy_df, 'DAUID')])
+
+
+# Bin DBH per city and fit the Type 1, 2 and 3 distributions
+def jsd_fitting_stage(filtered_df):
+    df = filtered_df.dropna(subset=['DBH'])
+    binned = pd.cut(df['DBH'], bins=bins, labels=labels, right=False)
+    grouped = df.groupby(['City', binned], observed=False).size().unstack(fill_value=0)
+    grouped = grouped[grouped.sum(axis=1) > 0]
+    return fit_distributions(grouped.div(grouped.sum(axis=1), axis=0))
+
+
+# Mann-Whitney U test of downtown against non-downtown DBH in every city
+def mann_whitney_stage(filtered_df, downtown_df):
+    df = filtered_df.dropna(subset=['DBH']).merge(downtown_df, how='left', on='DAUID')
+    df['DOWNTOWN'] = np.where(df['DOWNTOWN'] == 'Downtown', 1, 0)
+    return mann_whitney_tests(df, 'DBH', 'DOWNTOWN', 'City', groups=[0, 1])
+
+
+# Run a stage once for its wall time and once under tracemalloc for its peak memory
+def measure(function, *args):
+    start = time.perf_counter()
+    output = function(*args)
+    seconds = time.perf_counter() - start
+    del output
+
+    tracemalloc.start()
+    output = function(*args)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return output, seconds, peak_bytes / 2 ** 20
+
+
+# Short hash of the checked-out commit, so results can be traced back to the code that produced them
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+# Benchmark every stage at one size; returns one row per stage
+def run_benchmark(n_trees):
+    inventories, reference_tables = generate_dataset(n_trees, seed=seed)
+    codes_df = pd.concat([reference_tables['species_codes'].assign(City=city) for city in code_cities],
+                         ignore_index=True)[['City', 'Code', 'Botanical Name']]
+
+    stages = [
+        ('Merge', merge_stage, lambda outputs: (inventories,)),
+        ('Code Translation', code_translation_stage, lambda outputs: (outputs['Merge'], codes_df)),
+        ('Cleaning', cleaning_stage, lambda outputs: (outputs['Code Translation'],
+                                                      reference_tables['find_and_replace'])),
+        ('Taxonomy', taxonomy_stage, lambda outputs: (outputs['Cleaning'], reference_tables)),
+        ('Shannon', shannon_stage, lambda outputs: (outputs['Taxonomy'],)),
+        ('JSD Fitting', jsd_fitting_stage, lambda outputs: (outputs['Cleaning'],)),
+        ('Mann-Whitney', mann_whitney_stage, lambda outputs: (outputs['Cleaning'],
+                                                             reference_tables['downtown_areas'])),
+    ]
+
+    outputs = {}
+    rows = []
+    for stage, function, arguments in stages:
+        args = arguments(outputs)
+        rows_in = sum(len(df) for df in args[0].values()) if isinstance(args[0], dict) else len(args[0])
+        outputs[stage], seconds, peak_memory = measure(function, *args)
+        rows.append({'Trees': n_trees, 'Stage': stage, 'Rows In': rows_in, 'Rows Out': len(outputs[stage]),
+                     'Seconds': seconds, 'Peak Memory (MB)': peak_memory})
+        print(f"{n_trees:>12,} trees  {stage:<17} {seconds:9.3f} s  {peak_memory:9.1f} MB")
+    return rows
+
+
+# Stages whose time is more than regression_threshold times their best earlier time at the same size
+def find_regressions(results_df, previous_df):
+    if previous_df.empty:
+        return pd.DataFrame()
+    best = previous_df.groupby(['Trees', 'Stage'])['Seconds'].min().rename('Best Seconds').reset_index()
+    compared = results_df.merge(best, how='inner', on=['Trees', 'Stage'])
+    compared['Slowdown'] = compared['Seconds'] / compared['Best Seconds']
+    slower = compared['Seconds'] - compared['Best Seconds'] > noise_seconds
+    return compared[(compared['Slowdown'] > regression_threshold) & slower]
+
+
+if __name__ == '__main__':
+    results = []
+    for n_trees in tree_counts:
+        results.extend(run_benchmark(n_trees))
+
+    results_df = pd.DataFrame(results)
+    results_df.insert(0, 'Commit', current_commit())
+    results_df.insert(0, 'Timestamp', datetime.datetime.now().isoformat(timespec='seconds'))
+
+    # Compare with earlier runs, then append this run to the stored results
+    previous_df = pd.read_csv(results_file) if os.path.exists(results_file) else pd.DataFrame()
+    regressions_df = find_regressions(results_df, previous_df)
+    pd.concat([previous_df, results_df], ignore_index=True).to_csv(results_file, index=False)
+
+    pd.set_option('display.max_columns', None)
+    if regressions_df.empty:
+        print("No stage is slower than its best earlier run.")
+    else:
+        print(f"Stages more than {regression_threshold}x slower than their best earlier run:")
+        print(regressions_df[['Trees', 'Stage', 'Seconds', 'Best Seconds', 'Slowdown']])
@@ -0,0 +1,179 @@
+# Per-city partitions of the merged and filtered master datasets.
+# Each city is stored as its own Parquet file, next to a fingerprint of the inputs it was built from: a SHA-256 over the
+# workbook, the code dictionary, Find and Replace.csv and the CTUID back-fill table, as far as the stage uses them.
+# A stage only rebuilds the cities whose fingerprint changed and re-assembles the full dataset from the partitions, so
+# fixing one city's workbook no longer reprocesses all 32 cities.
+
+import csv
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from inventory_loader import stringify_mixed_columns
+
+# Bump when the merge or cleaning steps change so every partition is rebuilt
+partition_version = 2
+
+manifest_name = 'manifest.json'
+
+
+# Combine the fingerprints of a partition's inputs (file hashes, upstream fingerprints, ...) into one content hash
+def content_fingerprint(*parts):
+    sha256 = hashlib.sha256(str(partition_version).encode())
+    for part in parts:
+        sha256.update(b'\0' + str(part).encode())
+    return sha256.hexdigest()
+
+
+# Content hash of a reference table held in memory, e.g. the CTUID back-fill table
+def frame_hash(df):
+    sha256 = hashlib.sha256(','.join(map(str, df.columns)).encode())
+    sha256.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return sha256.hexdigest()
+
+
+# Paths of the Parquet file, the fingerprint file and the CSV copy of a city's partition
+def partition_paths(partition_dir, city):
+    return tuple(os.path.join(partition_dir, f'{city}.{extension}') for extension in ['parquet', 'json', 'csv'])
+
+
+# Fingerprint and stage details stored with a partition, or None if the city has no partition yet
+# Partitions without a CSV copy (csv=False) only need their Parquet and fingerprint files
+def read_partition_info(partition_dir, city, csv=True):
+    partition_file, info_file, csv_file = partition_paths(partition_dir, city)
+    if not (os.path.exists(partition_file) and os.path.exists(info_file) and (os.path.exists(csv_file) or not csv)):
+        return None
+    with open(info_file) as f:
+        return json.load(f)
+
+
+# Check whether a city's partition was built from the same inputs
+def is_partition_current(partition_dir, city, fingerprint, csv=True):
+    info = read_partition_info(partition_dir, city, csv)
+    return info is not None and info.get('fingerprint') == fingerprint
+
+
+# Record the fingerprint and any stage details (counts, reports) of a partition that was just written
+def write_partition_info(partition_dir, city, fingerprint, **details):
+    with open(partition_paths(partition_dir, city)[1], 'w') as f:
+        # NumPy counts are stored as plain numbers
+        json.dump({'fingerprint': fingerprint, **details}, f, default=lambda value: value.item())
+
+
+# Write a city's partition one block of trees at a time, so a city is never held in memory whole
+# Each block is appended to the Parquet file (as a row group) and to the CSV copy, which is formatted once here so
+# re-assembling the CSV output only concatenates files. Both are written under temporary names and only replace the
+# old partition, with the fingerprint and any stage details (counts, reports) kept alongside it, when finish is called;
+# a write that stops early leaves no partition that looks current
+class PartitionWriter:
+    def __init__(self, partition_dir, city):
+        os.makedirs(partition_dir, exist_ok=True)
+        self.partition_dir, self.city = partition_dir, city
+        self.paths = partition_paths(partition_dir, city)
+        self.schema = None
+        self.writer = None
+        self.csv_file = None
+        self.rows = 0
+
+    def write(self, df):
+        df = stringify_mixed_columns(df)
+
+        # The first block fixes the columns and their types; columns it holds no values of are stored as text
+        if self.writer is None:
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            self.schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                     for field in schema], metadata=schema.metadata)
+            self.writer = pq.ParquetWriter(self.paths[0] + '.tmp', self.schema)
+            self.csv_file = open(self.paths[2] + '.tmp', 'w', newline='', encoding='utf-8')
+            df[self.schema.names].head(0).to_csv(self.csv_file, index=False)
+
+        df = df[self.schema.names]
+        self.writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+        df.to_csv(self.csv_file, index=False, header=False)
+        self.rows += df.shape[0]
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.csv_file.close()
+            self.writer = None
+
+    # Replace the old partition with the blocks written and record its fingerprint
+    def finish(self, fingerprint, **details):
+        partition_file, info_file, csv_file = self.paths
+        self.close()
+        if os.path.exists(info_file):
+            os.remove(info_file)
+        os.replace(partition_file + '.tmp', partition_file)
+        os.replace(csv_file + '.tmp', csv_file)
+        write_partition_info(self.partition_dir, self.city, fingerprint, **details)
+
+    def __enter__(self):
+        return self
+
+    # Temporary files of an unfinished write are removed
+    def __exit__(self, *exc_info):
+        self.close()
+        for file_name in [self.paths[0] + '.tmp', self.paths[2] + '.tmp']:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+
+# Write a city's partition from one table of its trees
+def write_partition(df, partition_dir, city, fingerprint, **details):
+    with PartitionWriter(partition_dir, city) as writer:
+        writer.write(df)
+        writer.finish(fingerprint, **details)
+
+
+# Read a city's partition whole (chunk_size None) or as an iterator of chunks with at most chunk_size trees
+def read_partition(partition_dir, city, chunk_size=None):
+    partition_file = partition_paths(partition_dir, city)[0]
+    if chunk_size is None:
+        return iter([pd.read_parquet(partition_file)])
+    return (batch.to_pandas() for batch in pq.ParquetFile(partition_file).iter_batches(batch_size=chunk_size))
+
+
+# The manifest lists the partitioned cities in dataset order, so later stages assemble the cities in the same order
+def write_manifest(partition_dir, cities):
+    os.makedirs(partition_dir, exist_ok=True)
+    with open(os.path.join(partition_dir, manifest_name), 'w') as f:
+        json.dump({'cities': list(cities)}, f)
+
+
+def read_manifest(partition_dir):
+    with open(os.path.join(partition_dir, manifest_name)) as f:
+        return json.load(f)['cities']
+
+
+# Columns of a partition's CSV copy, from its header
+def csv_columns(csv_file):
+    with open(csv_file, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f), [])
+
+
+# Re-assemble the CSV copies of the listed cities' partitions into one CSV file under one header
+# The header holds every partition's columns in order of first appearance. Partitions with exactly these columns are
+# copied as they are; the others (a city whose inventory lacks or adds a column) are re-aligned to them block by block,
+# with blank values for the columns they lack
+def assemble_csv(partition_dir, cities, file_name, chunk_size=250_000):
+    csv_files = [partition_paths(partition_dir, city)[2] for city in cities]
+    city_columns = [csv_columns(csv_file) for csv_file in csv_files]
+    columns = list(dict.fromkeys(column for names in city_columns for column in names))
+
+    with open(file_name, 'w', newline='', encoding='utf-8') as output:
+        pd.DataFrame(columns=columns).to_csv(output, index=False)
+        for csv_file, names in zip(csv_files, city_columns):
+            if names == columns:
+                output.flush()
+                with open(csv_file, 'rb') as f:
+                    f.readline()
+                    shutil.copyfileobj(f, output.buffer)
+                continue
+            for chunk in pd.read_csv(csv_file, dtype=str, keep_default_na=False, chunksize=chunk_size):
+                chunk.reindex(columns=columns, fill_value='').to_csv(output, index=False, header=False)
@@ -0,0 +1,119 @@
+# Cleaning steps of Master Cleaning, applied to one block of trees at a time.
+# Every step only looks at the trees in the block (name fixes, DBH filtering, basal area, CTUID back-fill), so the
+# master dataset can be cleaned in bounded chunks and the cleaned chunks appended to the output in order.
+
+import numpy as np
+import pandas as pd
+
+from dbh_quality import apply_dbh_quality
+from name_normalizer import (standardize_name, apply_find_and_replace, find_and_replace_hits, finalize_name, map_unique,
+                             non_living_names)
+
+# Column types of the merged master dataset, fixed so every chunk is cleaned the same way
+# DBH is kept as is and converted with to_numeric, so entries like '12-15' become missing instead of failing
+master_dtypes = {'Botanical Name': object, 'DBH': object, 'DAUID': float, 'CTUID': float, 'City': object}
+
+# Fill missing CTUID values
+data_dict = {
+    'DAUID': [59150883, 59150891, 59153562, 59170272, 35240431, 35100286, 35201466, 35204675, 35204821, 35205067,
+              35370553, 24580007, 24662985, 24662707, 24662951, 24662821, 24662885, 24660984, 24663395, 24230066,
+              13100304, 13070131, 12090576, 59154073],
+    'CTUID': [9330045.01, 9330025, 9330059.08, 9350001, 5370204, 5210100.01, 5350003, 5350210.04, 5350012.01, 5350200.01,
+              5590043.02, 4620886.03, 4620288, 4620276, 4620585.01, 4620290.05, 4620290.09, 4620322.03, 4620390, 4210310,
+              3200009, 3050006, 2050112, 9330202.01],
+    'City': ['Vancouver', 'Vancouver', 'Vancouver', 'Victoria', 'Burlington', 'Kingston', 'Toronto', 'Toronto', 'Toronto', 'Toronto',
+             'Windsor', 'Longueuil', 'Montreal', 'Montreal', 'Montreal', 'Montreal', 'Montreal', 'Montreal', 'Montreal', 'Quebec City',
+             'Fredericton', 'Moncton', 'Halifax', 'New Westminster']
+}
+
+data_dict_df = pd.DataFrame(data_dict)
+
+
+# Give a block of merged trees the column types of the merged master dataset
+def to_master_dtypes(merged_df):
+    return merged_df.astype({column: dtype for column, dtype in master_dtypes.items() if column in merged_df.columns})
+
+
+# Clean one block of trees; returns the cleaned trees and the counts reported by Master Cleaning
+# dbh_quality is the DBH quality table (dbh_quality.dbh_quality_table) giving each city's unit and outlier fence; the
+# trees are looked up by their City, or all by the inventory they came from when it is given
+def clean_master_chunk(merged_df, find_and_replace_rules, dbh_quality=None, inventory=None):
+    ## Clean the Botanical Name column
+    initial_count = merged_df.shape[0]
+
+    # Deal with blank (missing) species ID, make all species names lowercase, trim spaces, standardize cultivars and
+    # species, then apply the find and replace rules (each distinct name is only cleaned once), counting the trees
+    # each rule changed
+    standardized_names = map_unique(merged_df['Botanical Name'], standardize_name)
+    rule_hits = find_and_replace_hits(standardized_names, find_and_replace_rules)
+    merged_df['Botanical Name'] = map_unique(standardized_names,
+                                             lambda name: apply_find_and_replace(name, find_and_replace_rules))
+
+    # Remove any non-living trees
+    filtered_df = merged_df[~merged_df["Botanical Name"].isin(non_living_names)].copy()
+    final_count = filtered_df.shape[0]
+
+    # Add spp. to genus-only identification, remove any incorrect letters and apply the spot check fixes
+    filtered_df['Botanical Name'] = map_unique(filtered_df['Botanical Name'], finalize_name)
+
+    ## Clean the DBH column
+    # Convert the city's unit to cm and set outliers and values of 0 or less to missing
+    inventories = filtered_df["City"] if inventory is None else inventory
+    filtered_df["DBH"], dbh_counts = apply_dbh_quality(filtered_df["DBH"], inventories, dbh_quality)
+    num_rows_with_dbh_0 = filtered_df[filtered_df["DBH"] == 0].shape[0]
+
+    # Calculate basal area
+    filtered_df['Basal Area'] = 0.00007854 * (filtered_df['DBH'] ** 2)
+
+    # Remove rows where both DAUID and CTUID are missing
+    filtered_df = filtered_df[~(filtered_df["DAUID"].isna() & filtered_df["CTUID"].isna())]
+
+    # Count the number of rows after removing rows with missing DAUID and CTUID
+    final_count_after_missing_removal = filtered_df.shape[0]
+
+    # Find and count unique values of DAUID where CTUID is blank
+    blank_ctuid_df = filtered_df[filtered_df["CTUID"].isna()]
+    unique_dauid_with_blank_ctuid = blank_ctuid_df["DAUID"].unique()
+    num_instances_blank_ctuid = blank_ctuid_df.shape[0]
+
+    # Merge the filtered DataFrame with the data dictionary DataFrame based on "DAUID"
+    filtered_df = filtered_df.merge(data_dict_df, on='DAUID', how='left', suffixes=('', '_dict'))
+
+    # Fill missing CTUID and City values from the dictionary
+    filtered_df['CTUID'] = filtered_df['CTUID'].combine_first(filtered_df['CTUID_dict'])
+    filtered_df['City'] = filtered_df['City'].combine_first(filtered_df['City_dict'])
+
+    # Drop the extra columns from the dictionary
+    filtered_df = filtered_df.drop(columns=['CTUID_dict', 'City_dict'])
+
+    # Count the number of instances of DAUID with blank CTUID after filling
+    num_instances_blank_ctuid_after_filling = filtered_df[filtered_df["CTUID"].isna()].shape[0]
+
+    counts = {
+        'initial_count': initial_count,
+        'final_count': final_count,
+        'num_rows_with_dbh_0': num_rows_with_dbh_0,
+        'final_count_after_missing_removal': final_count_after_missing_removal,
+        'unique_dauid_with_blank_ctuid': list(unique_dauid_with_blank_ctuid),
+        'num_instances_blank_ctuid': num_instances_blank_ctuid,
+        'num_instances_blank_ctuid_after_filling': num_instances_blank_ctuid_after_filling,
+        'find_and_replace_hits': rule_hits,
+        **dbh_counts
+    }
+    return filtered_df, counts
+
+
+# Add the counts of one chunk to the running totals
+def add_chunk_counts(total_counts, counts):
+    for key, value in counts.items():
+        if key == 'unique_dauid_with_blank_ctuid':
+            # pd.unique keeps the order of first appearance in one hashed pass and counts missing DAUIDs once
+            seen = np.asarray(total_counts.get(key, []), dtype=float)
+            total_counts[key] = pd.unique(np.concatenate([seen, np.asarray(value, dtype=float)])).tolist()
+        elif isinstance(value, dict):
+            totals = total_counts.setdefault(key, {})
+            for rule, hits in value.items():
+                totals[rule] = totals.get(rule, 0) + hits
+        else:
+            total_counts[key] = total_counts.get(key, 0) + value
+    return total_counts
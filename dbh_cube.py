@@ -0,0 +1,163 @@
+# DBH histogram cube of the filtered master dataset for the structural diversity analyses.
+# Trees are counted once per (City, DAUID, CTUID, Downtown, DBH cell), so binned proportions, structural diversity
+# indices, medians and skewness of any grouping come from the cube without reading the tree rows again.
+# Each 1 cm step has two cells: one for DBH exactly on the whole centimetre and one for the open interval above it, so
+# bins with whole-centimetre edges are exact whether they are closed on the left (pd.cut right=False) or on the right
+# (the default right=True). Every cell also keeps the sums of DBH, DBH^2 and DBH^3 of its trees, which give exact
+# means, standard deviations and skewness of any rollup; medians are interpolated within the open cells.
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from analysis_dataset import read_analysis_dataset, downtown_flags
+from city_partitions import content_fingerprint
+from inventory_loader import file_hash
+
+# Bumped whenever the cube layout changes, so stored cubes are rebuilt
+cube_version = 1
+
+# Width of a DBH step in cm; bin edges must be multiples of it
+cube_resolution = 1.0
+
+cube_keys = ['City', 'DAUID', 'CTUID', 'Downtown']
+
+
+# Cell of every DBH value: 2k for DBH exactly k steps, 2k + 1 for DBH strictly between k and k + 1 steps
+def dbh_cells(dbh, resolution=cube_resolution):
+    steps = np.asarray(dbh, dtype=float) / resolution
+    whole_steps = np.floor(steps)
+    return (2 * whole_steps + (steps != whole_steps)).astype(np.int64)
+
+
+# Count the trees of every (City, DAUID, CTUID, Downtown, cell), with Downtown from the trees' Downtown column where
+# they were placed by their coordinates, and otherwise 1 for the DAUIDs listed as downtown in Downtown Areas.csv and 0
+# elsewhere (analysis_dataset.downtown_flags); trees without a DAUID or CTUID are kept in their city
+def build_dbh_cube(df, downtown_df, resolution=cube_resolution):
+    df = df.dropna(subset=['DBH'])
+    dbh = df['DBH'].to_numpy(dtype=float)
+
+    trees = pd.DataFrame({
+        'City': df['City'].astype(str).to_numpy(),
+        'DAUID': df['DAUID'].to_numpy(dtype=float),
+        'CTUID': df['CTUID'].to_numpy(dtype=float),
+        'Downtown': downtown_flags(df, downtown_df),
+        'DBH Cell': dbh_cells(dbh, resolution),
+        'Trees': 1,
+        'DBH Sum': dbh,
+        'DBH Squares': dbh ** 2,
+        'DBH Cubes': dbh ** 3
+    })
+    cube = trees.groupby(cube_keys + ['DBH Cell'], dropna=False, sort=False).sum().reset_index()
+
+    # Cities keep the order they have in the dataset
+    cube['City'] = pd.Categorical(cube['City'], categories=pd.unique(cube['City']))
+    return cube.sort_values(cube_keys + ['DBH Cell'], ignore_index=True)
+
+
+# Load the stored cube, rebuilding it when the analysis dataset or Downtown Areas.csv changed
+def load_dbh_cube(analysis_file, downtown_file, cube_file, resolution=cube_resolution):
+    fingerprint_file = os.path.splitext(cube_file)[0] + '.json'
+    fingerprint = content_fingerprint('dbh cube', cube_version, resolution, file_hash(analysis_file),
+                                      file_hash(downtown_file))
+
+    if os.path.exists(cube_file) and os.path.exists(fingerprint_file):
+        with open(fingerprint_file) as f:
+            if json.load(f).get('fingerprint') == fingerprint:
+                return pd.read_parquet(cube_file)
+
+    df = read_analysis_dataset(analysis_file, columns=['City', 'DAUID', 'CTUID', 'DBH'], optional_columns=['Downtown'])
+    cube = build_dbh_cube(df, pd.read_csv(downtown_file, low_memory=False), resolution)
+    cube.to_parquet(cube_file, index=False)
+    with open(fingerprint_file, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'resolution': resolution}, f)
+    return cube
+
+
+# Cube rows of the given cities, or of all cities but the excluded ones
+def select_cities(cube, cities=None, exclude_cities=None):
+    keep = np.ones(len(cube), dtype=bool)
+    if cities is not None:
+        keep &= cube['City'].isin(cities).to_numpy()
+    if exclude_cities is not None:
+        keep &= ~cube['City'].isin(exclude_cities).to_numpy()
+    cube = cube[keep].copy()
+    cube['City'] = cube['City'].cat.remove_unused_categories()
+    return cube
+
+
+# Sum the cube over everything but the group keys, keeping the DBH cells
+def rollup(cube, group_keys):
+    return cube.groupby(list(group_keys) + ['DBH Cell'], observed=True, dropna=False)[
+        ['Trees', 'DBH Sum', 'DBH Squares', 'DBH Cubes']].sum().reset_index()
+
+
+# Trees per bin in each group as a (group x bin) table, as pd.cut(DBH, bins, right=right) and a count per group gave
+# Edges must be multiples of the cube resolution (or infinite); trees outside the bins are not counted
+def bin_counts(cube, group_keys, bins, labels=None, right=True, resolution=cube_resolution):
+    cells = cube['DBH Cell'].to_numpy()
+    edges = np.asarray(bins, dtype=float) / resolution
+    lower_step = (cells // 2).astype(float)
+    on_step = cells % 2 == 0
+
+    # A value on a step belongs to the bin its value falls in; an open cell (k, k + 1) lies inside one bin, which
+    # is the bin of k for left-closed bins and of k + 1 for right-closed bins
+    if right:
+        bin_index = np.searchsorted(edges, np.where(on_step, lower_step, lower_step + 1), side='left') - 1
+    else:
+        bin_index = np.searchsorted(edges, lower_step, side='right') - 1
+    outside = (bin_index < 0) | (bin_index >= len(edges) - 1)
+
+    if labels is None:
+        labels = pd.IntervalIndex.from_breaks(bins, closed='right' if right else 'left')
+    binned = pd.DataFrame({key: cube[key].to_numpy() for key in group_keys})
+    binned['DBH_bin'] = pd.Categorical.from_codes(np.where(outside, -1, bin_index), categories=labels)
+    binned['Trees'] = cube['Trees'].to_numpy()
+
+    # Groups whose trees all fall outside the bins keep a row of zeros
+    groups = binned.groupby(list(group_keys), observed=True, dropna=False, sort=False).size().index
+    counts = binned[~outside].groupby(list(group_keys) + ['DBH_bin'], observed=False, dropna=False, sort=False)['Trees']
+    return counts.sum().unstack(fill_value=0).reindex(groups, fill_value=0)
+
+
+# Number of trees, mean, standard deviation (ddof=1, as pandas std) and skewness (biased, as scipy.stats.skew) of DBH
+# in each group, from the DBH sums of the cube
+def dbh_moments(cube, group_keys):
+    sums = cube.groupby(list(group_keys), observed=True, dropna=False)[
+        ['Trees', 'DBH Sum', 'DBH Squares', 'DBH Cubes']].sum()
+    n = sums['Trees'].astype(float)
+    mean = sums['DBH Sum'] / n
+    second = sums['DBH Squares'] / n - mean ** 2
+    third = sums['DBH Cubes'] / n - 3 * mean * sums['DBH Squares'] / n + 2 * mean ** 3
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(second * n / (n - 1))
+        skewness = third / second ** 1.5
+    return pd.DataFrame({'Trees': sums['Trees'], 'mean': mean, 'std': std, 'skewness': skewness}).reset_index()
+
+
+# Median DBH of each group: exact when the middle trees sit on a whole step, otherwise interpolated by spreading the
+# trees of the open cell evenly across it
+def dbh_median(cube, group_keys, resolution=cube_resolution):
+    cells = rollup(cube, group_keys)
+    group_codes = cells.groupby(list(group_keys), observed=True, dropna=False, sort=False).ngroup().to_numpy()
+    counts = cells['Trees'].to_numpy()
+    cumulative = np.cumsum(counts)
+    group_ends = cumulative[np.r_[np.flatnonzero(np.diff(group_codes)), len(counts) - 1]]
+    group_starts = np.r_[0, group_ends[:-1]]
+    n = group_ends - group_starts
+
+    # Value of the tree at a 0-based rank within its group
+    def value_at(ranks):
+        positions = group_starts + ranks
+        rows = np.searchsorted(cumulative, positions, side='right')
+        within = positions - (cumulative[rows] - counts[rows])
+        lower = (cells['DBH Cell'].to_numpy()[rows] // 2).astype(float)
+        on_step = cells['DBH Cell'].to_numpy()[rows] % 2 == 0
+        return np.where(on_step, lower, lower + (within + 0.5) / counts[rows]) * resolution
+
+    medians = (value_at((n - 1) // 2) + value_at(n // 2)) / 2
+    groups = cells.drop_duplicates(subset=list(group_keys))[list(group_keys)].reset_index(drop=True)
+    groups['median'] = medians
+    return groups
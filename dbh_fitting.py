@@ -0,0 +1,152 @@
+# This code is based on the work of Morgenroth et al. (2020) (DOI: 10.3390/f11020135)
+# Fits the Type 1 (exponential decay), Type 2 (Gaussian) and Type 3 (equal) DBH distributions to the binned DBH
+# proportions of many cities or areas at once. The parameter grids are evaluated as one NumPy broadcast over
+# (group, parameter, bin), and the best grid point of each group is then refined with a batched golden-section search.
+# Groups are fitted in blocks of fit_block_size, so fitting every DAUID keeps the broadcast temporaries (about 80 KB per
+# group for the Type 1 grid) to a few tens of MB.
+
+import numpy as np
+import pandas as pd
+
+# Binning Information
+bins = [0, 20, 40, 60, float('inf')]
+bin_midpoints = [10, 30, 50, 70]
+labels = ['0-20', '20-40', '40-60', '60+']
+Type_3 = [0.25, 0.25, 0.25, 0.25]  # Equal Distribution
+
+# Parameter grids searched by the original optimize_type_1 and optimize_type_2 functions
+a_values = np.linspace(0.1, 5.0, 50)
+b_values = np.linspace(0.01, 1.0, 50)
+std_dev_values = np.linspace(5, 50, 50)
+
+# Number of groups fitted in one broadcast
+fit_block_size = 256
+
+
+# Jensen-Shannon divergence along the last axis, broadcasting over all leading axes
+def calculate_js_divergence(P, Q):
+    P = np.asarray(P, dtype=float)
+    Q = np.asarray(Q, dtype=float)
+    # Add a small epsilon to avoid log(0)
+    epsilon = 1e-10
+    P = P + epsilon
+    Q = Q + epsilon
+    P = P / np.sum(P, axis=-1, keepdims=True)
+    Q = Q / np.sum(Q, axis=-1, keepdims=True)
+    M = 0.5 * (P + Q)
+    return 0.5 * np.sum(P * np.log(P / M), axis=-1) + 0.5 * np.sum(Q * np.log(Q / M), axis=-1)
+
+
+# Define Type 1 (Exponential Decay) and Type 2 (Gaussian) functions
+def exponential_decay(x, a, b):
+    return a * np.exp(-b * x)
+
+
+def gaussian(x, std_dev):
+    return (1 / (std_dev * np.sqrt(2 * np.pi))) * np.exp(-0.5 * ((x - 30) / std_dev) ** 2)
+
+
+# Normalized Type 1 and Type 2 proportions at the bin midpoints for arrays of parameters
+def type_1_proportions(a, b):
+    x = np.asarray(bin_midpoints, dtype=float)
+    predicted = exponential_decay(x, np.asarray(a, dtype=float)[..., None], np.asarray(b, dtype=float)[..., None])
+    return predicted / np.sum(predicted, axis=-1, keepdims=True)
+
+
+def type_2_proportions(std_dev):
+    x = np.asarray(bin_midpoints, dtype=float)
+    predicted = gaussian(x, np.asarray(std_dev, dtype=float)[..., None])
+    return predicted / np.sum(predicted, axis=-1, keepdims=True)
+
+
+# Minimize a divergence over one parameter for every group at once with golden-section search
+# lower, upper and start hold one value per group; the result is never worse than the start
+def refine_parameter(divergence, lower, upper, start, iterations=60):
+    inverse_phi = (np.sqrt(5) - 1) / 2
+    lower = np.array(lower, dtype=float)
+    upper = np.array(upper, dtype=float)
+    x1 = upper - inverse_phi * (upper - lower)
+    x2 = lower + inverse_phi * (upper - lower)
+    f1 = divergence(x1)
+    f2 = divergence(x2)
+
+    for _ in range(iterations):
+        left = f1 < f2
+        upper = np.where(left, x2, upper)
+        lower = np.where(left, lower, x1)
+        x2_new = np.where(left, x1, lower + inverse_phi * (upper - lower))
+        x1_new = np.where(left, upper - inverse_phi * (upper - lower), x2)
+        x1, x2 = x1_new, x2_new
+        f1 = divergence(x1)
+        f2 = divergence(x2)
+
+    refined = (lower + upper) / 2
+    refined_divergence = divergence(refined)
+    start = np.asarray(start, dtype=float)
+    start_divergence = divergence(start)
+    better = refined_divergence < start_divergence
+    return np.where(better, refined, start), np.where(better, refined_divergence, start_divergence)
+
+
+# Neighbouring grid values around the best grid index, used as the refinement bracket
+def grid_bracket(grid, best_index):
+    return grid[np.maximum(best_index - 1, 0)], grid[np.minimum(best_index + 1, len(grid) - 1)]
+
+
+# Fit the three distribution types to one block of groups (one row per group, one column per bin)
+def fit_distribution_block(actual, refine=True):
+    n_groups = actual.shape[0]
+
+    ## Type 1 (Exponential Decay): the whole (group, a, b, bin) grid in one broadcast
+    type_1_grid = type_1_proportions(a_values[:, None], b_values[None, :])  # (a, b, bin)
+    type_1_divergence = calculate_js_divergence(actual[:, None, None, :], type_1_grid[None, :, :, :])
+    type_1_divergence = type_1_divergence.reshape(n_groups, len(a_values) * len(b_values))
+    best_index = type_1_divergence.argmin(axis=1)  # First minimum, as in the nested loops
+    best_a_index, best_b_index = np.unravel_index(best_index, (len(a_values), len(b_values)))
+    best_a = a_values[best_a_index]
+    best_b = b_values[best_b_index]
+    type_1_js_divergence = type_1_divergence[np.arange(n_groups), best_index]
+
+    ## Type 2 (Gaussian): the whole (group, std_dev, bin) grid in one broadcast
+    type_2_grid = type_2_proportions(std_dev_values)  # (std_dev, bin)
+    type_2_divergence = calculate_js_divergence(actual[:, None, :], type_2_grid[None, :, :])
+    best_std_index = type_2_divergence.argmin(axis=1)
+    best_std_dev = std_dev_values[best_std_index]
+    type_2_js_divergence = type_2_divergence[np.arange(n_groups), best_std_index]
+
+    if refine and n_groups > 0:
+        # a cancels out once the curve is normalized, so only b is refined for Type 1
+        lower, upper = grid_bracket(b_values, best_b_index)
+        best_b, type_1_js_divergence = refine_parameter(
+            lambda b: calculate_js_divergence(actual, type_1_proportions(best_a, b)), lower, upper, best_b)
+
+        lower, upper = grid_bracket(std_dev_values, best_std_index)
+        best_std_dev, type_2_js_divergence = refine_parameter(
+            lambda std_dev: calculate_js_divergence(actual, type_2_proportions(std_dev)), lower, upper, best_std_dev)
+
+    ## Type 3 (Equal Distribution)
+    type_3_js_divergence = calculate_js_divergence(actual, np.asarray(Type_3)[None, :])
+
+    # Determine the best fit type (the first type wins ties)
+    js_divergences = np.column_stack([type_1_js_divergence, type_2_js_divergence, type_3_js_divergence])
+    best_fit = np.array(['Type 1', 'Type 2', 'Type 3'])[js_divergences.argmin(axis=1)]
+
+    return {
+        'JS Divergence Type 1': type_1_js_divergence,
+        'Type 1 Best a': best_a,
+        'Type 1 Best b': best_b,
+        'JS Divergence Type 2': type_2_js_divergence,
+        'Type 2 Best std_dev': best_std_dev,
+        'JS Divergence Type 3': type_3_js_divergence,
+        'Best_Fit': best_fit
+    }
+
+
+# Fit the three distribution types to every row of a proportions table (one row per group, one column per bin)
+# A table without rows gives an empty result with the same columns
+def fit_distributions(proportions, refine=True):
+    actual = proportions.to_numpy(dtype=float)
+    starts = range(0, max(actual.shape[0], 1), fit_block_size)
+    blocks = [fit_distribution_block(actual[start:start + fit_block_size], refine) for start in starts]
+    return pd.DataFrame({column: np.concatenate([block[column] for block in blocks]) for column in blocks[0]},
+                        index=proportions.index)
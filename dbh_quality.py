@@ -0,0 +1,111 @@
+# DBH quality checks of Master Cleaning, with the same rule for every city instead of per-city conversions.
+# Every inventory's unit is inferred from its median and 95th percentile DBH: the units (cm, inches or mm) whose
+# conversion puts both in the ranges street-tree inventories have in cm are plausible, so a new municipality exporting
+# inches or millimetres is converted without a hand-written rule. The q95 ranges of cm and inches overlap (35 to 78.7),
+# but the medians mostly do not: a cm inventory with a median above 15.7 cm would have an implausible median above 40 cm
+# in inches. Cities still fitting both (inventories of small trees) are kept in cm, the unit of all but one inventory,
+# and cities matching no unit are kept in cm too; the Unit Basis column of the table records which case each city is.
+# Outliers are then found per city with a robust fence on the log of DBH (DBH is close to lognormal): values more than
+# fence_mads scaled median absolute deviations above the city's median, or above max_dbh, are set to missing. A city
+# whose MAD is 0 (more than half its trees share one value, as in class-coded inventories) is only capped at max_dbh.
+# Small values are kept, since newly planted trees are a real part of every inventory.
+# Each city's statistics only depend on its own trees, so they are computed one city at a time.
+
+import numpy as np
+import pandas as pd
+
+# Bumped whenever the checks change, so every city is cleaned again
+dbh_quality_version = 3
+
+# Factor converting each unit to cm
+dbh_units = {'cm': 1.0, 'in': 2.54, 'mm': 0.1}
+
+# Ranges of the 95th percentile and median DBH, in cm, of the inventories recorded in cm
+plausible_q95 = (35, 200)
+plausible_median = (5, 40)
+
+# Cities with fewer trees with a DBH are kept in cm
+min_trees = 100
+
+# Width of the outlier fence in scaled MADs of log DBH, and the largest DBH kept in any city, in cm
+fence_mads = 3.5
+max_dbh = 350
+
+# Settings the cleaned partitions depend on
+dbh_quality_settings = (dbh_quality_version, tuple(dbh_units.items()), plausible_q95, plausible_median, min_trees,
+                        fence_mads, max_dbh)
+
+# Columns of the DBH quality table
+quality_columns = ['City', 'Trees', 'Raw Median', 'Raw Q95', 'Unit', 'Unit Basis', 'Plausible Units', 'Factor',
+                   'Median (cm)', 'Upper Fence (cm)']
+
+
+# Unit, conversion factor and upper fence (in cm) of one city from the DBH values of its trees
+# The unit can be set by hand (override) for a city the quantiles get wrong
+def city_dbh_quality(dbh, city, override=None):
+    dbh = pd.to_numeric(pd.Series(dbh), errors='coerce').to_numpy(dtype=float)
+    dbh = dbh[dbh > 0]
+    raw_median, raw_q95 = np.quantile(dbh, [0.5, 0.95]) if len(dbh) > 0 else (np.nan, np.nan)
+
+    # Units putting both quantiles in the ranges of the cm inventories
+    factors = np.array(list(dbh_units.values()))
+    plausible = ((raw_q95 * factors >= plausible_q95[0]) & (raw_q95 * factors <= plausible_q95[1])
+                 & (raw_median * factors >= plausible_median[0]) & (raw_median * factors <= plausible_median[1])
+                 & (len(dbh) >= min_trees))
+    plausible_units = [unit for unit, fits in zip(dbh_units, plausible) if fits]
+    if override is not None:
+        unit, basis = override, 'override'
+    elif len(plausible_units) == 1:
+        unit, basis = plausible_units[0], 'inferred'
+    elif len(plausible_units) > 1:
+        unit, basis = 'cm', 'ambiguous, cm assumed'
+    else:
+        unit, basis = 'cm', 'no plausible unit, cm assumed'
+    factor = dbh_units[unit]
+
+    # Fence from the median and MAD of log DBH in cm
+    median, fence = np.nan, max_dbh
+    if len(dbh) > 0:
+        log_dbh = np.log(dbh * factor)
+        median = np.median(log_dbh)
+        mad = np.median(np.abs(log_dbh - median)) * 1.4826
+        if mad > 0:
+            fence = min(np.exp(median + fence_mads * mad), max_dbh)
+
+    return {'City': city, 'Trees': len(dbh), 'Raw Median': raw_median, 'Raw Q95': raw_q95, 'Unit': unit,
+            'Unit Basis': basis, 'Plausible Units': '/'.join(plausible_units), 'Factor': factor,
+            'Median (cm)': np.exp(median), 'Upper Fence (cm)': fence}
+
+
+# Unit, conversion factor and upper fence of every city in a table of the City and DBH of trees
+# Units can be set by hand for cities the quantiles get wrong, e.g. overrides={'Halifax': 'cm'}
+def dbh_quality_table(dbh_df, overrides=None):
+    overrides = overrides or {}
+    return pd.DataFrame([city_dbh_quality(city_df['DBH'], city, overrides.get(city))
+                         for city, city_df in dbh_df.groupby('City', sort=False)],
+                        columns=quality_columns)
+
+
+# Convert a block of DBH values to cm and set the outliers and values of 0 or less to missing, with the unit and fence
+# of the inventory (city) each tree came from: a column of cities or one city for the whole block. Cities missing from
+# the quality table (or no table) are kept in cm and only capped at max_dbh
+# Returns the DBH values and the number of trees converted and set to missing
+def apply_dbh_quality(dbh, inventories, quality_table=None):
+    dbh = pd.to_numeric(dbh, errors='coerce')
+    factor, fence = 1.0, max_dbh
+    if quality_table is not None:
+        quality = quality_table.set_index('City')
+        inventories = pd.Series(inventories, index=dbh.index)
+        factor = inventories.map(quality['Factor']).astype(float).fillna(1.0)
+        fence = inventories.map(quality['Upper Fence (cm)']).astype(float).fillna(max_dbh)
+
+    converted = dbh.notna() & (np.asarray(factor) != 1.0)
+    dbh = dbh * factor
+    above_fence = dbh > fence
+    not_positive = dbh <= 0
+    counts = {
+        'num_dbh_converted': int(converted.sum()),
+        'num_dbh_above_fence': int(above_fence.sum()),
+        'num_dbh_not_positive': int(not_positive.sum())
+    }
+    return dbh.mask(above_fence | not_positive), counts
@@ -0,0 +1,59 @@
+# This code is based on the work of Ma et al. (2020) (DOI: 10.1016/j.ufug.2020.126826)
+# Diversity indices for any grouping of trees (City, DAUID, CTUID, Ecozone, City Size, Downtown, ...).
+# Every index is computed from one (group, taxon) count table per taxonomic level, without a Python callback per group.
+
+import numpy as np
+import pandas as pd
+
+from tree_store import is_tree_store, group_counts
+
+taxon_levels = ['Species', 'Genus', 'Family']
+
+
+# Number of trees of each taxon in each group; trees without a taxon are not counted, as in value_counts
+# df is a tree table or a tree store (see tree_store.py)
+def taxon_counts(df, group_keys, taxon_column):
+    if is_tree_store(df):
+        return group_counts(df, group_keys + [taxon_column])
+    return df.dropna(subset=[taxon_column]).groupby(group_keys + [taxon_column], observed=True).size()
+
+
+# Shannon, Simpson, richness and evenness from a (group, taxon) count table
+def indices_from_counts(counts, group_keys):
+    totals = counts.groupby(level=group_keys, observed=True).transform('sum')
+    proportions = counts / totals
+
+    shannon = (-proportions * np.log(proportions)).groupby(level=group_keys, observed=True).sum()
+    simpson = 1 - (proportions ** 2).groupby(level=group_keys, observed=True).sum()
+    richness = counts.groupby(level=group_keys, observed=True).size()
+
+    # Pielou's evenness is undefined when a group holds a single taxon
+    with np.errstate(divide='ignore', invalid='ignore'):
+        evenness = shannon / np.log(richness.where(richness > 1))
+
+    return pd.DataFrame({'Shannon': shannon, 'Simpson': simpson, 'Richness': richness, 'Evenness': evenness})
+
+
+# Compute the diversity indices of every taxonomic level for each group in one pass per level
+# Columns are named '<Index>_<Level>', e.g. Shannon_Species or Richness_Family
+def diversity_indices(df, group_keys, taxon_columns=None):
+    if isinstance(group_keys, str):
+        group_keys = [group_keys]
+    if taxon_columns is None:
+        taxon_columns = taxon_levels
+
+    # Groups whose trees all lack a taxon keep a Shannon index of 0, as the value_counts version returned
+    if is_tree_store(df):
+        groups = group_counts(df, group_keys).index
+    else:
+        groups = df.groupby(group_keys, observed=True).size().index
+
+    results = []
+    for taxon_column in taxon_columns:
+        indices = indices_from_counts(taxon_counts(df, group_keys, taxon_column), group_keys)
+        indices = indices.reindex(groups)
+        indices[['Shannon', 'Simpson', 'Richness']] = indices[['Shannon', 'Simpson', 'Richness']].fillna(0)
+        indices['Richness'] = indices['Richness'].astype(int)
+        results.append(indices.add_suffix(f'_{taxon_column}'))
+
+    return pd.concat(results, axis=1).reset_index()
@@ -0,0 +1,207 @@
+# Figures of the structural analyses and Figure 1, drawn the same way on screen and in batch export.
+# A figure is a job: the file it is saved as, the drawing function (module and name, so worker processes can import
+# it; a script's functions are named by the script's file) and the data it draws. The drawing functions only draw on the Figure they are given, so exported figures are
+# rendered on plain Agg figures without pyplot or a display, and the jobs are spread over a process pool.
+# Each figure folder keeps the fingerprint of every figure (its drawing module, function, size and data) in
+# Figures.json; a figure whose fingerprint has not changed and whose file still exists is not drawn again.
+
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import matplotlib.lines as mlines
+from matplotlib.figure import Figure
+
+from city_partitions import content_fingerprint
+from inventory_loader import file_hash
+
+# Bumped whenever the rendering changes, so every figure is drawn again
+figure_version = 1
+
+figure_index_name = 'Figures.json'
+figure_dpi = 150
+
+
+## Drawing functions
+# Actual DBH class proportions of a city against its best-fit distribution
+def draw_city_fit(fig, city, bin_midpoints, city_data, best_fit_proportions, best_fit_type):
+    ax = fig.subplots()
+    ax.plot(bin_midpoints, city_data, label=f"{city} Actual", marker='o', color='blue')
+    ax.plot(bin_midpoints, best_fit_proportions, label=f"Best Fit ({best_fit_type})", marker='o', linestyle='--',
+            color='red')
+    ax.set_title(f"{city}: Actual vs Best-Fit Distribution")
+    ax.set_xlabel("DBH Bin Midpoints")
+    ax.set_ylabel("Proportion")
+    ax.legend()
+    ax.grid(True)
+
+
+# Average Type 1 and Type 2 fits of all cities against the Type 3 distribution
+def draw_distribution_comparison(fig, bin_midpoints, exp_decay_line, Type_2_gaussian_line, Type_3):
+    ax = fig.subplots()
+    ax.plot(bin_midpoints, exp_decay_line, label="Type 1", marker='o')
+    ax.plot(bin_midpoints, Type_2_gaussian_line, label="Type 2", marker='o')
+    ax.plot(bin_midpoints, Type_3, label="Type 3", marker='o')
+    ax.set_title("Comparison of Distributions (Type 1, Type 2, Type 3)")
+    ax.set_xlabel("DBH Bin Midpoints")
+    ax.set_ylabel("Proportion")
+    ax.legend()
+    ax.grid(True)
+
+
+# Percentage of every city's trees in the Richards DBH classes against the Richards rule and the line of best fit
+def draw_richards_comparison(fig, richards_midpoints, richards_values, proportions_df):
+    ax = fig.subplots()
+
+    # Richards data points and line function
+    x = np.linspace(0, 100, 1000)
+    y = -0.5 * x + 45  # Hypothetical line function for Richards
+    ax.plot(richards_midpoints, richards_values, 'bs-', label='Richards Data')
+    ax.plot(x, y, 'b-', label='Line: y = -0.5x + 45')
+
+    # Plot the proportions of every city (only markers, no lines)
+    for city, proportions in proportions_df.iterrows():
+        ax.plot(richards_midpoints, proportions, 'o', markersize=4, markerfacecolor='k', markeredgewidth=0,
+                label=f'{city} Data')
+
+    # Create a line of best fit
+    x_fit = np.linspace(0, 100, 1000)
+    y_fit = -0.7119 * x_fit + 53.351  # Hypothetical line of best fit (use appropriate values for your data)
+    ax.plot(x_fit, y_fit, 'k-', label='Line of Best Fit')
+
+    # Add vertical dashed lines at 20 cm, 40 cm, and 60 cm
+    for dbh in [20, 40, 60]:
+        ax.axvline(x=dbh, color='gray', linestyle='--')
+
+    # Adjust the space above the plot for the labels
+    fig.subplots_adjust(top=0.85)
+
+    # Add text labels for "Young", "Semi-Mature", "Mature", and "Old" using normalized x-coordinates (relative to the axes)
+    for position, label in zip([0.125, 0.375, 0.625, 0.875], ['Young', 'Semi-Mature', 'Mature', 'Old']):
+        ax.text(position, 1.05, label, horizontalalignment='center', transform=ax.transAxes)
+
+    # Legend
+    inventory_data_handle = mlines.Line2D([], [], color='k', marker='o', linestyle='None', markersize=8,
+                                          label='Inventory Data')
+    best_fit_handle = mlines.Line2D([], [], color='k', linestyle='-', markersize=8, label='Line of Best Fit')
+    richards_handle = mlines.Line2D([], [], color='b', marker='s', linestyle='-', markersize=8, label='Richards')
+    ax.legend(handles=[inventory_data_handle, best_fit_handle, richards_handle])
+
+    # Customize plot
+    ax.set_xlim(0, 80)
+    ax.set_ylim(0, 70)
+    ax.set_xlabel('DBH (cm)')
+    ax.set_ylabel('Proportion of Trees (%)')
+    ax.grid(False)
+
+
+## Jobs
+# Drawing modules loaded from their files in this process, by file
+drawing_modules = {}
+
+
+# File of a drawing module: a script's .py file (e.g. its __file__) as it is, otherwise the file of the imported module
+# Resolved once, when the job is made, so neither the fingerprint nor the workers depend on the working directory
+def drawing_module_file(module):
+    if module.endswith('.py'):
+        return os.path.abspath(module)
+    return importlib.import_module(module).__file__
+
+
+# Drawing function of a job; scripts are loaded from their file under their own name, so their __main__ block does
+# not run again
+def drawing_function(job):
+    module, function_name = job['draw']
+    if not module.endswith('.py'):
+        return getattr(importlib.import_module(module), function_name)
+
+    module_file = job['module_file']
+    if module_file not in drawing_modules:
+        spec = importlib.util.spec_from_file_location(f'figure_script_{len(drawing_modules)}', module_file)
+        drawing_modules[module_file] = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(drawing_modules[module_file])
+    return getattr(drawing_modules[module_file], function_name)
+
+
+# A figure to save as file_name, drawn by module.function(fig, *args); module is a module name or a script's .py file
+def figure_job(file_name, draw, *args, figsize=(8, 6)):
+    return {'file': file_name, 'draw': draw, 'module_file': drawing_module_file(draw[0]), 'args': args,
+            'figsize': figsize}
+
+
+# Fingerprint of a figure: its drawing module's source, drawing function, size and data
+def figure_fingerprint(job):
+    function_name = job['draw'][1]
+    data_hash = hashlib.sha256(pickle.dumps(job['args'], protocol=4)).hexdigest()
+    return content_fingerprint('figure', figure_version, file_hash(job['module_file']), function_name, job['figsize'],
+                               figure_dpi, data_hash)
+
+
+# Draw one figure on an Agg figure and save it; returns the seconds it took
+def render_figure(job, figure_dir):
+    start = time.perf_counter()
+    fig = Figure(figsize=job['figsize'])
+    drawing_function(job)(fig, *job['args'])
+    fig.savefig(os.path.join(figure_dir, job['file']), dpi=figure_dpi)
+    return time.perf_counter() - start
+
+
+# Save the figures whose data or drawing code changed (every figure when force is True) to figure_dir
+# Returns one row per figure: Rendered or Unchanged, with its drawing time
+# Scripts rendering more than one figure with more than one worker need an if __name__ == '__main__' guard
+def render_figures(jobs, figure_dir, max_workers=None, force=False):
+    os.makedirs(figure_dir, exist_ok=True)
+    index_file = os.path.join(figure_dir, figure_index_name)
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+
+    fingerprints = {job['file']: figure_fingerprint(job) for job in jobs}
+    pending = [job for job in jobs if force or index.get(job['file']) != fingerprints[job['file']]
+               or not os.path.exists(os.path.join(figure_dir, job['file']))]
+
+    if max_workers == 1 or len(pending) <= 1:
+        seconds = [render_figure(job, figure_dir) for job in pending]
+    else:
+        workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            seconds = list(executor.map(render_figure, pending, [figure_dir] * len(pending),
+                                        chunksize=max(1, len(pending) // (4 * workers))))
+
+    # Figures of earlier runs that are no longer drawn keep their entries, so switching subsets does not redraw them
+    index.update({job['file']: fingerprints[job['file']] for job in pending})
+    with open(index_file, 'w') as f:
+        json.dump(index, f, indent=1)
+
+    rendered = dict(zip([job['file'] for job in pending], seconds))
+    return pd.DataFrame({'Figure': [job['file'] for job in jobs],
+                         'Status': ['Rendered' if job['file'] in rendered else 'Unchanged' for job in jobs],
+                         'Seconds': [rendered.get(job['file']) for job in jobs]})
+
+
+# Show the figures on screen one at a time, as the scripts did before they could export them
+def show_figures(jobs):
+    import matplotlib.pyplot as plt
+
+    for job in jobs:
+        fig = plt.figure(figsize=job['figsize'])
+        drawing_function(job)(fig, *job['args'])
+        plt.show()
+
+
+# Save the figures to figure_dir, or show them when figure_dir is None, and report what was saved
+def export_or_show(jobs, figure_dir, max_workers=None, force=False):
+    if figure_dir is None:
+        show_figures(jobs)
+        return None
+    summary_df = render_figures(jobs, figure_dir, max_workers, force)
+    print(f"\nFigures in {figure_dir}:")
+    print(summary_df.to_string(index=False))
+    return summary_df
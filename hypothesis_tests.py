@@ -0,0 +1,218 @@
+# Rank tests of a value (DBH, a Shannon index, ...) between groups of trees or areas, run for every stratum (City, ...)
+# at once. The values are sorted once, with the stratum as the first sort key, and every rank statistic is a sum of
+# those ranks per (stratum, group), so no stratum is sliced out of the frame. Results are one tidy table with a row per
+# (test, stratum), to which multiple-comparison corrections and permutation p-values can be added.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2, mannwhitneyu, norm
+
+# Correction used by add_adjusted_p_values when none is given
+default_correction = 'holm'
+
+
+# Average ranks (1-based, ties share their mean rank) of the values within each stratum, from one sort of all values
+# Also returns sum(t^3 - t) over the tie runs of each stratum, for the tie corrections
+def stratified_ranks(values, strata, n_strata):
+    order = np.lexsort((values, strata))
+    sorted_values = values[order]
+    sorted_strata = strata[order]
+
+    # Runs of equal values in a stratum, and the position of every value within its stratum
+    new_stratum = np.r_[True, sorted_strata[1:] != sorted_strata[:-1]]
+    new_run = new_stratum | np.r_[True, sorted_values[1:] != sorted_values[:-1]]
+    run_starts = np.flatnonzero(new_run)
+    run_lengths = np.diff(np.r_[run_starts, len(values)])
+    stratum_starts = np.flatnonzero(new_stratum)
+    positions = np.arange(len(values)) - stratum_starts[np.cumsum(new_stratum) - 1]
+
+    run_ranks = positions[run_starts] + (run_lengths + 1) / 2
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(run_ranks, run_lengths)
+
+    tie_terms = np.bincount(sorted_strata[run_starts], weights=run_lengths.astype(float) ** 3 - run_lengths,
+                            minlength=n_strata)
+    return ranks, tie_terms
+
+
+# Integer codes of the strata and groups of a frame, dropping rows without a value, stratum or group
+def encode_tests(df, value_column, group_column, stratum_column, groups=None):
+    df = df.dropna(subset=[value_column, group_column] + ([stratum_column] if stratum_column else []))
+    if stratum_column:
+        strata, stratum_names = pd.factorize(df[stratum_column])
+    else:
+        strata, stratum_names = np.zeros(len(df), dtype=np.intp), pd.Index(['All'])
+    if groups is None:
+        group_codes, groups = pd.factorize(df[group_column], sort=True)
+    else:
+        group_codes = pd.Index(groups).get_indexer(df[group_column])
+        keep = group_codes >= 0
+        df, strata, group_codes = df[keep], strata[keep], group_codes[keep]
+    return df[value_column].to_numpy(dtype=float), strata, np.asarray(stratum_names), group_codes, list(groups)
+
+
+# Number of values and rank sum of every (stratum, group) as (strata x groups) arrays
+def rank_sums(ranks, strata, group_codes, n_strata, n_groups):
+    cells = strata * n_groups + group_codes
+    counts = np.bincount(cells, minlength=n_strata * n_groups).reshape(n_strata, n_groups)
+    sums = np.bincount(cells, weights=ranks, minlength=n_strata * n_groups).reshape(n_strata, n_groups)
+    return counts, sums
+
+
+# Two-sided Mann-Whitney U test of the first group against the second in every stratum, as
+# scipy.stats.mannwhitneyu(first, second, alternative='two-sided') gives it: U is the statistic of the first group and
+# the p-value is asymptotic with tie and continuity corrections, or exact for small strata without ties
+# Strata in which a group is empty get an empty statistic and p-value
+def mann_whitney_tests(df, value_column, group_column, stratum_column, groups):
+    values, strata, stratum_names, group_codes, groups = encode_tests(df, value_column, group_column,
+                                                                       stratum_column, groups)
+    ranks, tie_terms = stratified_ranks(values, strata, len(stratum_names))
+    counts, sums = rank_sums(ranks, strata, group_codes, len(stratum_names), 2)
+
+    n1, n2 = counts[:, 0].astype(float), counts[:, 1].astype(float)
+    n = n1 + n2
+    u1 = sums[:, 0] - n1 * (n1 + 1) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_terms / (n * (n - 1))))
+        z = (np.maximum(u1, n1 * n2 - u1) - n1 * n2 / 2 - 0.5) / sigma
+    p_values = np.clip(2 * norm.sf(z), 0, 1)
+
+    # scipy's exact distribution for strata with eight or fewer values in a group and no ties
+    empty = (n1 == 0) | (n2 == 0)
+    exact = ~empty & ((n1 <= 8) | (n2 <= 8)) & (tie_terms == 0)
+    for stratum in np.flatnonzero(exact):
+        in_stratum = strata == stratum
+        p_values[stratum] = mannwhitneyu(values[in_stratum & (group_codes == 0)],
+                                         values[in_stratum & (group_codes == 1)], alternative='two-sided').pvalue
+
+    return pd.DataFrame({
+        stratum_column or 'Stratum': stratum_names,
+        'Test': 'Mann-Whitney U',
+        'Value': value_column,
+        'Grouping': group_column,
+        'Groups': f'{groups[0]} vs {groups[1]}',
+        'N': n.astype(int),
+        'Statistic': np.where(empty, np.nan, u1),
+        'p-value': np.where(empty, np.nan, p_values)
+    })
+
+
+# Kruskal-Wallis H test across the groups in every stratum (one test over all rows when stratum_column is None), as
+# scipy.stats.kruskal gives it; strata with fewer than two non-empty groups get an empty statistic and p-value
+def kruskal_tests(df, value_column, group_column, stratum_column=None, groups=None):
+    values, strata, stratum_names, group_codes, groups = encode_tests(df, value_column, group_column,
+                                                                       stratum_column, groups)
+    ranks, tie_terms = stratified_ranks(values, strata, len(stratum_names))
+    counts, sums = rank_sums(ranks, strata, group_codes, len(stratum_names), len(groups))
+
+    n = counts.sum(axis=1).astype(float)
+    n_groups = (counts > 0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h = 12 / (n * (n + 1)) * np.where(counts > 0, sums ** 2 / counts, 0).sum(axis=1) - 3 * (n + 1)
+        h = h / (1 - tie_terms / (n ** 3 - n))
+    testable = n_groups >= 2
+
+    return pd.DataFrame({
+        stratum_column or 'Stratum': stratum_names,
+        'Test': 'Kruskal-Wallis H',
+        'Value': value_column,
+        'Grouping': group_column,
+        'Groups': n_groups,
+        'N': n.astype(int),
+        'Statistic': np.where(testable, h, np.nan),
+        'p-value': np.where(testable, chi2.sf(h, np.maximum(n_groups - 1, 1)), np.nan)
+    })
+
+
+# Family-wise ('bonferroni', 'holm') or false discovery rate ('fdr_bh') adjusted p-values; empty p-values stay empty
+def adjust_p_values(p_values, method=default_correction):
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(len(p_values), np.nan)
+    tested = ~np.isnan(p_values)
+    p = p_values[tested]
+    m = len(p)
+    if m == 0:
+        return adjusted
+
+    order = np.argsort(p, kind='stable')
+    if method == 'bonferroni':
+        result = p * m
+    elif method == 'holm':
+        stepped = np.maximum.accumulate(p[order] * (m - np.arange(m)))
+        result = np.empty(m)
+        result[order] = stepped
+    elif method == 'fdr_bh':
+        stepped = np.minimum.accumulate((p[order] * m / np.arange(1, m + 1))[::-1])[::-1]
+        result = np.empty(m)
+        result[order] = stepped
+    else:
+        raise ValueError(f"Unknown correction method: {method}")
+
+    adjusted[tested] = np.minimum(result, 1)
+    return adjusted
+
+
+# Add the adjusted p-values of a results table, correcting over all of its tests (or within each family_column value)
+def add_adjusted_p_values(results_df, method=default_correction, family_column=None):
+    results_df = results_df.copy()
+    if family_column is None:
+        results_df['Adjusted p-value'] = adjust_p_values(results_df['p-value'], method)
+    else:
+        results_df['Adjusted p-value'] = results_df.groupby(family_column)['p-value'].transform(
+            lambda p_values: adjust_p_values(p_values, method))
+    results_df['Correction'] = method
+    return results_df
+
+
+# Permutation p-value of one stratum: the share of label shuffles giving a statistic at least as extreme as the
+# observed one (Mann-Whitney: |U - n1 n2 / 2|, Kruskal-Wallis: H), counting the observed labelling as one shuffle
+# The ranks do not change when labels are shuffled, so each shuffle only sums ranks per group
+def permutation_p_value(ranks, group_codes, n_groups, test, n_permutations, seed):
+    rng = np.random.default_rng(seed)
+    counts = np.bincount(group_codes, minlength=n_groups)
+
+    def statistic(codes):
+        sums = np.bincount(codes, weights=ranks, minlength=n_groups)
+        if test == 'Mann-Whitney U':
+            return abs(sums[0] - counts[0] * (counts[0] + 1) / 2 - counts[0] * counts[1] / 2)
+        return (sums[counts > 0] ** 2 / counts[counts > 0]).sum()
+
+    observed = statistic(group_codes)
+    extreme = sum(statistic(rng.permutation(group_codes)) >= observed - 1e-9 for _ in range(n_permutations))
+    return (extreme + 1) / (n_permutations + 1)
+
+
+# Add permutation p-values to a results table from mann_whitney_tests or kruskal_tests, with labels shuffled within
+# each stratum and the strata spread over a process pool
+# Each stratum draws from its own seed spawned from seed, so results do not depend on the number of workers
+# Scripts calling this with more than one worker need an if __name__ == '__main__' guard (the workers import them)
+def add_permutation_p_values(results_df, df, value_column, group_column, stratum_column=None, groups=None,
+                             n_permutations=999, seed=0, max_workers=None):
+    test = results_df['Test'].iloc[0]
+    if test == 'Mann-Whitney U' and groups is None:
+        raise ValueError("The Mann-Whitney permutation test needs the two groups")
+    values, strata, stratum_names, group_codes, groups = encode_tests(df, value_column, group_column,
+                                                                       stratum_column, groups)
+    ranks = stratified_ranks(values, strata, len(stratum_names))[0]
+
+    testable = results_df['Statistic'].notna().to_numpy()
+    tasks = [stratum for stratum in range(len(stratum_names)) if testable[stratum]]
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    arguments = [[ranks[strata == stratum] for stratum in tasks], [group_codes[strata == stratum] for stratum in tasks],
+                 [len(groups)] * len(tasks), [test] * len(tasks), [n_permutations] * len(tasks), seeds]
+
+    if max_workers == 1:
+        p_values = list(map(permutation_p_value, *arguments))
+    else:
+        workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            p_values = list(executor.map(permutation_p_value, *arguments,
+                                         chunksize=max(1, len(tasks) // (4 * workers))))
+
+    results_df = results_df.copy()
+    results_df['Permutation p-value'] = np.nan
+    results_df.loc[results_df.index[tasks], 'Permutation p-value'] = p_values
+    return results_df
@@ -0,0 +1,151 @@
+# Loads the city inventory workbooks in parallel and caches each parsed city as a Parquet file.
+# A cached city is reused as long as its workbook has the same modification time and size, or failing that the same
+# SHA-256 hash, so only edited workbooks are parsed again by openpyxl.
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+
+# Hash the workbook contents in blocks so large files are never read into memory at once
+def file_hash(file_name, block_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+# Describe the current state of a workbook so it can be compared to the cached state
+def file_fingerprint(file_name, with_hash=True):
+    stat = os.stat(file_name)
+    fingerprint = {'mtime': stat.st_mtime, 'size': stat.st_size}
+    if with_hash:
+        fingerprint['sha256'] = file_hash(file_name)
+    return fingerprint
+
+
+# Paths of the cached Parquet file and its fingerprint file for a city
+def cache_paths(cache_dir, city):
+    return os.path.join(cache_dir, f'{city}.parquet'), os.path.join(cache_dir, f'{city}.json')
+
+
+# Check whether the cached copy of a workbook is still valid
+def is_cache_valid(file_name, cache_dir, city):
+    cache_file, fingerprint_file = cache_paths(cache_dir, city)
+    if not (os.path.exists(cache_file) and os.path.exists(fingerprint_file)):
+        return False
+
+    with open(fingerprint_file) as f:
+        cached = json.load(f)
+
+    # Unchanged modification time and size means the workbook was not touched
+    current = file_fingerprint(file_name, with_hash=False)
+    if current['mtime'] == cached.get('mtime') and current['size'] == cached.get('size'):
+        return True
+
+    # The workbook was touched (e.g. copied or re-saved), so fall back to comparing contents
+    current['sha256'] = file_hash(file_name)
+    if current['sha256'] != cached.get('sha256'):
+        return False
+
+    # Same contents: record the new modification time so the hash is skipped next time
+    with open(fingerprint_file, 'w') as f:
+        json.dump(current, f)
+    return True
+
+
+# Parquet needs one type per column, so columns mixing numbers and text are stored as text
+def stringify_mixed_columns(df):
+    for column in df.columns[df.dtypes == object]:
+        non_null = df[column].dropna()
+        if not non_null.map(lambda value: isinstance(value, str)).all():
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+
+# SHA-256 of a city's workbook, taken from its cache fingerprint when the workbook has been loaded before
+def workbook_hash(file_path_inventories, city, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(file_path_inventories, '.cache')
+    fingerprint_file = cache_paths(cache_dir, city)[1]
+    if os.path.exists(fingerprint_file):
+        with open(fingerprint_file) as f:
+            sha256 = json.load(f).get('sha256')
+        if sha256 is not None:
+            return sha256
+    return file_hash(os.path.join(file_path_inventories, f'{city}.xlsx'))
+
+
+# Parse one workbook and write it to the cache (runs in a worker process)
+def parse_and_cache(file_name, cache_dir, city):
+    start = time.perf_counter()
+    df = stringify_mixed_columns(pd.read_excel(file_name))
+
+    cache_file, fingerprint_file = cache_paths(cache_dir, city)
+    df.to_parquet(cache_file, index=False)
+    with open(fingerprint_file, 'w') as f:
+        json.dump(file_fingerprint(file_name), f)
+
+    return time.perf_counter() - start
+
+
+# Load every city workbook that exists, parsing changed workbooks across a process pool
+# Returns the city DataFrames keyed by city (in the order of the city list) and a per-city timing report
+def load_inventories(file_path_inventories, cities, cache_dir=None, max_workers=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(file_path_inventories, '.cache')
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Split the cities into cache hits and workbooks that need to be parsed
+    available_cities = []
+    cities_to_parse = []
+    for city in cities:
+        file_name = os.path.join(file_path_inventories, f'{city}.xlsx')
+
+        # Check if the file exists
+        if not os.path.exists(file_name):
+            print(f"{city} file does not exist.")
+            continue
+
+        available_cities.append(city)
+        if not is_cache_valid(file_name, cache_dir, city):
+            cities_to_parse.append(city)
+
+    # Parse the changed workbooks in parallel
+    parse_seconds = {}
+    if cities_to_parse:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {city: executor.submit(parse_and_cache, os.path.join(file_path_inventories, f'{city}.xlsx'),
+                                             cache_dir, city)
+                       for city in cities_to_parse}
+            for city, future in futures.items():
+                parse_seconds[city] = future.result()
+
+    # Read every city back from the cache, keeping the order of the city list
+    data_frames = {}
+    timings = []
+    for city in available_cities:
+        start = time.perf_counter()
+        df = pd.read_parquet(cache_paths(cache_dir, city)[0])
+        read_seconds = time.perf_counter() - start
+        data_frames[city] = df
+
+        timings.append({
+            'City': city,
+            'Source': 'parsed' if city in parse_seconds else 'cache',
+            'Rows': df.shape[0],
+            'Parse Seconds': parse_seconds.get(city, 0.0),
+            'Cache Read Seconds': read_seconds,
+            'Total Seconds': parse_seconds.get(city, 0.0) + read_seconds
+        })
+
+    timing_df = pd.DataFrame(timings, columns=['City', 'Source', 'Rows', 'Parse Seconds', 'Cache Read Seconds',
+                                               'Total Seconds'])
+    timing_df = timing_df.sort_values('Total Seconds', ascending=False, ignore_index=True)
+
+    return data_frames, timing_df
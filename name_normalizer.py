@@ -0,0 +1,115 @@
+# Botanical name normalization used by Master Cleaning.
+# Every step only depends on the name itself, so names are cleaned once per distinct value and mapped back onto the
+# trees. The Find and Replace rules are compiled once and applied in file order, exactly as the column-wide
+# str.replace passes did.
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# Names that are not living trees
+non_living_names = ["dead", "stump", "stump spp.", "stump for", "shrub", "shrubs", "vine", "vines", "hedge", "vacant"]
+
+# Encoding junk left over from the inventory exports, removed in this order
+encoding_fixes = [
+    ("Ã—", ""),
+    ("Ã", ""),
+    ("_x000d_", ""),
+    ("â€˜", ""),
+    ("â€™", ""),
+    (" '", " "),
+    (" x ", " "),
+    ("'", "")
+]
+
+# Spot check fixes, applied in this order after the encoding fixes
+spot_fixes = [
+    ("pinus missing", "pinus spp."),
+    ("stump spp.", "missing"),
+    ("malus sp.", "malus spp."),
+    ("..", "."),
+    ("magnolia missing", "magnolia spp."),
+    ("missing.", "missing"),
+    ("missing spp.", "missing"),
+    ("spp. spp.", "missing"),
+    ("malus missing", "malus spp."),
+    ("pyrus missing", "pyrus spp.")
+]
+
+
+# Compile the Find and Replace table into an ordered list of (pattern, replacement) rules
+# The combined pattern is used to skip names that no rule can change
+def compile_find_and_replace(species_clean_df):
+    rules = []
+    for find, replace in zip(species_clean_df['Find'], species_clean_df['Replace']):
+        # Ensure word boundaries are respected in the replacement to avoid partial replacements
+        pattern = r'\b' + re.escape(find) + r'\b'
+        rules.append((re.compile(pattern), replace))
+
+    combined = re.compile('|'.join(f'(?:{pattern.pattern})' for pattern, _ in rules)) if rules else None
+    return rules, combined
+
+
+# Deal with blank (missing) names, make names lowercase, trim spaces and standardize cultivars and species
+def standardize_name(name):
+    if not isinstance(name, str):
+        return 'missing'
+    name = name.lower().strip()
+    if name == '':
+        return 'missing'
+    return name.replace(" x ", " ").replace("'", "")
+
+
+# Apply the Find and Replace rules in order
+def apply_find_and_replace(name, compiled_rules):
+    rules, combined = compiled_rules
+
+    # If no rule matches the original name, no rule can match after earlier rules either
+    if combined is None or combined.search(name) is None:
+        return name
+
+    for pattern, replace in rules:
+        name = pattern.sub(replace, name)
+    return name
+
+
+# Trees changed by each Find and Replace rule (applied in order to the standardized names), keyed by the rule's row
+# number in the table as a string, so the counts add up the same after a JSON round trip; rules that changed nothing
+# are left out
+def find_and_replace_hits(names, compiled_rules):
+    rules, combined = compiled_rules
+    codes, uniques = pd.factorize(names, use_na_sentinel=False)
+    trees = np.bincount(codes, minlength=len(uniques))
+
+    hits = {}
+    for name, count in zip(uniques, trees):
+        if combined is None or combined.search(name) is None:
+            continue
+        for number, (pattern, replace) in enumerate(rules):
+            replaced = pattern.sub(replace, name)
+            if replaced != name:
+                hits[str(number)] = hits.get(str(number), 0) + int(count)
+                name = replaced
+    return hits
+
+
+# Add spp. to genus-only identification, then remove incorrect letters and apply the spot check fixes
+def finalize_name(name):
+    if len(name.strip().split()) == 1:
+        name = name.strip() + " spp."
+    else:
+        name = name.strip()
+
+    for find, replace in encoding_fixes:
+        name = name.replace(find, replace)
+    for find, replace in spot_fixes:
+        name = name.replace(find, replace)
+    return name
+
+
+# Apply a name function once per distinct value and map the results back onto the column
+def map_unique(names, function):
+    codes, uniques = pd.factorize(names, use_na_sentinel=False)
+    cleaned = [function(name) for name in uniques]
+    return pd.Series(pd.Index(cleaned, dtype=object).take(codes), index=names.index, name=names.name)
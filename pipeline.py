@@ -0,0 +1,314 @@
+# Runs the numbered scripts as one pipeline: every stage declares the files and folders it reads and writes (relative
+# to a data root), and the stages form a DAG in which a stage depends on the stages writing its inputs.
+# A stage is skipped when its fingerprint (the stage's script, the project modules it imports and the contents of its
+# inputs) matches the one recorded after its last run and its outputs still exist, so a refresh only re-runs what
+# changed and everything downstream of it. Stages whose inputs are ready run concurrently in a process pool, e.g. the
+# structural and taxonomic comparisons once the filtered master dataset exists. Every stage is timed in the run log.
+# The scripts keep their hard-coded paths; the runner points every path under the original data root to data_root
+# and runs each script from data_root, so the outputs written to the working directory land there too.
+
+import ast
+import importlib
+import json
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+from city_partitions import content_fingerprint
+from inventory_loader import file_hash
+from run_log import run_log_file, log_stage, write_record, start_run
+
+# Folder the scripts' hard-coded paths point to
+original_data_root = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets'
+
+# Folder the pipeline reads and writes; the original root by default
+data_root = original_data_root
+
+# Stages to run with everything upstream of them (None runs all stages); force re-runs them even when cached
+selected_stages = None
+force = False
+
+# Processes running stages at once (None uses every core)
+max_workers = None
+
+# Stage records (fingerprint, outputs, run time) kept inside the data root
+record_dir_name = '.pipeline'
+
+# Folder of the scripts and the project modules they import
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Stages in dependency order. Inputs and outputs are relative to the data root; a folder stands for every file in it
+# (hidden files such as the inventory cache are ignored). Script stages run a numbered script; function stages call
+# module.function(*inputs, *outputs). The figure folders are outputs too, so a full run also exports every figure.
+non_inventory = 'Non-Inventory Datasets'
+nativity = os.path.join(non_inventory, 'Tree Nativity and Families')
+analysis_dataset = '(2) Filtered Master Dataset.parquet'
+taxonomy_references = [analysis_dataset, os.path.join(nativity, 'Nativity Index.arrow'),
+                       os.path.join(non_inventory, 'Families Index.csv'), os.path.join(non_inventory, 'Location Index.csv'),
+                       os.path.join(non_inventory, 'Downtown Areas.csv'),
+                       os.path.join(non_inventory, 'Find and Replace 2.csv'), '(4) Taxonomy Lookup.parquet']
+stages = [
+    {'name': '(A) Add Family and Distribution Data', 'script': '(A) Add Family and Distribution Data.py',
+     'inputs': [os.path.join(nativity, 'Names.csv'), os.path.join(nativity, 'Distribution.csv')],
+     'outputs': [os.path.join(nativity, 'Pivoted Family and Distribution Data.csv'),
+                 os.path.join(nativity, 'Nativity Index.arrow')]},
+    {'name': '(B) Find Species Synonyms', 'script': '(B) Find Species Synonyms',
+     'inputs': [os.path.join(non_inventory, 'Possible Synonyms.csv'), os.path.join(non_inventory, 'Species Synonyms.csv')],
+     'outputs': ['(B) Synonym Candidates.csv', '(B) Suggested Find and Replace.csv', 'synonyms in inventories.csv',
+                 '(B) Species Synonyms.csv']},
+    {'name': '(1) Check and Merge Inventories', 'script': '(1) Check and Merge Inventories.py',
+     'inputs': ['Inventories', os.path.join(non_inventory, 'Tree Codes')],
+     'outputs': ['(1) Master Dataset Partitions', 'Master Dataset.csv', '(1) Inventory Load Times.csv']},
+    {'name': '(2) Master Cleaning', 'script': '(2) Master Cleaning.py',
+     'inputs': ['(1) Master Dataset Partitions', os.path.join(non_inventory, 'Find and Replace.csv'),
+                os.path.join(non_inventory, 'Location Index.csv'), os.path.join(nativity, 'Nativity Index.arrow'),
+                os.path.join(non_inventory, 'Families Index.csv'), os.path.join(non_inventory, 'Find and Replace 2.csv')],
+     'outputs': ['(2) Filtered Master Dataset Partitions', '(2) Analysis Partitions', '(2) Filtered Master Dataset.csv',
+                 analysis_dataset, '(4) Taxonomy Lookup.parquet', '(2) DBH Quality.csv']},
+    # Built once here, so the structural scripts sharing it do not race to write it
+    {'name': '(2) DBH Cube', 'function': ('dbh_cube', 'load_dbh_cube'),
+     'inputs': [analysis_dataset, os.path.join(non_inventory, 'Downtown Areas.csv')],
+     'outputs': ['(2) DBH Cube.parquet']},
+    {'name': '(3) Structural Diversity - City Size and Ecozone Comparison',
+     'script': '(3) Structural Diversity - City Size and Ecozone Comparison',
+     'inputs': [os.path.join(non_inventory, 'Location Index.csv'), analysis_dataset],
+     'outputs': ['(SPSS) Ecozone and City Size Comparison - DBH.csv',
+                 '(3) Ecozone and City Size Comparison - Kruskal-Wallis Test Results.csv']},
+    {'name': '(3) Structural Diversity - City-Level', 'script': '(3) Structural Diversity - City-Level',
+     'inputs': [analysis_dataset, os.path.join(non_inventory, 'Downtown Areas.csv'), '(2) DBH Cube.parquet'],
+     'outputs': ['(3) Structural Diversity Index Intervals.csv', 'optimized_js_divergence_df.csv',
+                 '(3) City-Level Figures']},
+    {'name': '(3) Structural Diversity - Downtown Comparison', 'script': '(3) Structural Diversity - Downtown Comparison',
+     'inputs': [analysis_dataset, os.path.join(non_inventory, 'Downtown Areas.csv'), '(2) DBH Cube.parquet'],
+     'outputs': ['(3) Downtown Comparison - Grouped Statistics.csv',
+                 '(3) Downtown Comparison - Mann-Whitney U Test Results.csv',
+                 '(3) Downtown Comparison - Optimized JSD.csv']},
+    {'name': '(3) Structural Diversity - National-level', 'script': '(3) Structural Diversity - National-level',
+     'inputs': [analysis_dataset, os.path.join(non_inventory, 'Downtown Areas.csv'), '(2) DBH Cube.parquet'],
+     'outputs': ['city_dbh_proportions.csv', '(3) National-level Figures']},
+    {'name': 'Figure 1', 'script': 'Figure 1.py', 'inputs': [], 'outputs': ['Figure 1']},
+    {'name': '(4) Taxonomic Diversity - City Size Comparison', 'script': '(4) Taxonomic Diversity - City Size Comparison',
+     'inputs': taxonomy_references, 'outputs': ['(4) Taxonomic Diversity - City Size Comparison.csv']},
+    {'name': '(4) Taxonomic Diversity - Downtown Comparison', 'script': '(4) Taxonomic Diversity - Downtown Comparison',
+     'inputs': taxonomy_references,
+     'outputs': ['(4) Taxonomic Diversity - Downtown Comparison.csv',
+                 '(4) Taxonomic Diversity - Downtown Comparison - Mann-Whitney U Test Results.csv']},
+    {'name': '(4) Taxonomic Diversity - Ecozonal Comparison', 'script': '(4) Taxonomic Diversity - Ecozonal Comparison',
+     'inputs': taxonomy_references, 'outputs': ['(4) Taxonomic Diversity - Ecozonal Comparison.csv']},
+    {'name': '(4) Taxonomic Diversity - National Level', 'script': '(4) Taxonomic Diversity - National Level.py',
+     'inputs': taxonomy_references, 'outputs': ['(4) Species Diversity Intervals.csv']},
+]
+
+
+# Stages each stage waits for: the stages writing one of its inputs (or a file inside an input folder)
+def stage_dependencies(stages):
+    writers = {os.path.normpath(output): stage['name'] for stage in stages for output in stage['outputs']}
+    dependencies = {}
+    for stage in stages:
+        upstream = set()
+        for path in map(os.path.normpath, stage['inputs']):
+            upstream.update(writer for output, writer in writers.items()
+                            if path == output or path.startswith(output + os.sep) or output.startswith(path + os.sep))
+        upstream.discard(stage['name'])
+        dependencies[stage['name']] = upstream
+    return dependencies
+
+
+# The selected stages and every stage upstream of them
+def upstream_closure(names, dependencies):
+    needed, pending = set(), list(names)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(dependencies[name])
+    return needed
+
+
+# Source of a script with every raw string literal under the original data root (the scripts' paths are all raw
+# strings) pointed to data_root, using the path separator of this platform
+def script_source(script_file, data_root):
+    with open(script_file, encoding='utf-8') as f:
+        source = f.read()
+    if data_root == original_data_root:
+        return source
+
+    def move(match):
+        relative = [part for part in match.group(2).split('\\') if part]
+        return f"{match.group(1)}'{os.path.join(data_root, *relative)}'"
+
+    pattern = r"([rR][fF]?|[fF][rR])'" + re.escape(original_data_root) + r"([^']*)'"
+    return re.sub(pattern, move, source)
+
+
+# Project modules a script or module imports, followed through the modules they import in turn
+def project_modules(source, seen=None):
+    seen = set() if seen is None else seen
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            module_file = os.path.join(script_dir, name.split('.')[0] + '.py')
+            if module_file not in seen and os.path.exists(module_file):
+                seen.add(module_file)
+                with open(module_file, encoding='utf-8') as f:
+                    project_modules(f.read(), seen)
+    return seen
+
+
+# Content hash of an input file, or of every (non-hidden) file in an input folder with its relative path
+def path_hash(path):
+    if not os.path.isdir(path):
+        return file_hash(path) if os.path.exists(path) else None
+    hashes = []
+    for folder, folder_names, file_names in os.walk(path):
+        folder_names[:] = sorted(name for name in folder_names if not name.startswith('.'))
+        for name in sorted(file_names):
+            if not name.startswith('.'):
+                hashes.append((os.path.relpath(os.path.join(folder, name), path), file_hash(os.path.join(folder, name))))
+    return content_fingerprint(*hashes)
+
+
+def input_hash(path, data_root, input_hashes):
+    if path not in input_hashes:
+        input_hashes[path] = path_hash(os.path.join(data_root, path))
+    return input_hashes[path]
+
+
+# Fingerprint of a stage from its code and the contents of its inputs, taken once every upstream stage has finished
+# input_hashes keeps the hashes already taken in this run, as several stages share the same large inputs
+def stage_fingerprint(stage, data_root, input_hashes):
+    if 'script' in stage:
+        code_file = os.path.join(script_dir, stage['script'])
+        with open(code_file, encoding='utf-8') as f:
+            code = f.read()
+    else:
+        code_file = os.path.join(script_dir, stage['function'][0] + '.py')
+        code = f'import {stage["function"][0]}'
+    code_files = sorted({code_file} | project_modules(code))
+    return content_fingerprint('pipeline stage', stage['name'], *[file_hash(file_name) for file_name in code_files],
+                               *[(path, input_hash(path, data_root, input_hashes)) for path in stage['inputs']])
+
+
+def record_file(data_root, stage):
+    return os.path.join(data_root, record_dir_name, stage['name'] + '.json')
+
+
+# Whether a stage's last recorded run used the same fingerprint and its outputs are all still there
+def is_stage_current(stage, data_root, fingerprint):
+    if not os.path.exists(record_file(data_root, stage)):
+        return False
+    with open(record_file(data_root, stage)) as f:
+        record = json.load(f)
+    return (record.get('fingerprint') == fingerprint
+            and all(os.path.exists(os.path.join(data_root, output)) for output in stage['outputs']))
+
+
+# Run one stage from the data root and log it to the run log; returns its run time, or the traceback when it fails
+# Scripts run as __main__ with the Agg backend, so plt.show() returns at once instead of waiting for windows
+def run_stage(stage, data_root):
+    start = time.perf_counter()
+    working_dir = os.getcwd()
+    try:
+        os.chdir(data_root)
+        with log_stage(stage['name']):
+            if 'script' in stage:
+                import matplotlib
+                matplotlib.use('Agg')
+                script_file = os.path.join(script_dir, stage['script'])
+                code = compile(script_source(script_file, data_root), script_file, 'exec')
+                exec(code, {'__name__': '__main__', '__file__': script_file})
+            else:
+                module_name, function_name = stage['function']
+                function = getattr(importlib.import_module(module_name), function_name)
+                function(*[os.path.join(data_root, path) for path in stage['inputs'] + stage['outputs']])
+        return {'seconds': time.perf_counter() - start, 'error': None}
+    except Exception:
+        return {'seconds': time.perf_counter() - start, 'error': traceback.format_exc()}
+    finally:
+        os.chdir(working_dir)
+
+
+# Run the stages in dependency order, skipping current stages and running ready ones concurrently
+# Returns one row per stage: Ran, Cached, Failed or Skipped (a stage upstream of it failed), with its run time
+# Every stage run (and every cached stage) is also recorded in the run log of the data root
+def run_pipeline(stages, data_root=data_root, selected=None, force=False, max_workers=None):
+    dependencies = stage_dependencies(stages)
+    names = [stage['name'] for stage in stages]
+    needed = upstream_closure(selected if selected is not None else names, dependencies)
+    by_name = {stage['name']: stage for stage in stages}
+    forced = set(selected if selected is not None else names) if force else set()
+    os.makedirs(os.path.join(data_root, record_dir_name), exist_ok=True)
+    start_run()
+
+    status, seconds, fingerprints, input_hashes = {}, {}, {}, {}
+    pending = [name for name in names if name in needed]
+    running = {}
+
+    # Start every pending stage whose upstream stages are done; stages found current are marked cached at once
+    def start_ready(executor):
+        started = True
+        while started:
+            started = False
+            for name in list(pending):
+                upstream = dependencies[name] & needed
+                if any(status.get(dependency) in ('Failed', 'Skipped') for dependency in upstream):
+                    status[name] = 'Skipped'
+                elif all(status.get(dependency) in ('Ran', 'Cached') for dependency in upstream):
+                    fingerprints[name] = stage_fingerprint(by_name[name], data_root, input_hashes)
+                    if name not in forced and is_stage_current(by_name[name], data_root, fingerprints[name]):
+                        status[name] = 'Cached'
+                        write_record({'stage': name, 'status': 'cached'}, os.path.join(data_root, run_log_file))
+                    elif executor is None:
+                        finish(name, run_stage(by_name[name], data_root))
+                    else:
+                        running[executor.submit(run_stage, by_name[name], data_root)] = name
+                        print(f"Started {name}", flush=True)
+                else:
+                    continue
+                pending.remove(name)
+                started = True
+
+    def finish(name, result):
+        seconds[name] = result['seconds']
+        if result['error'] is None:
+            status[name] = 'Ran'
+            with open(record_file(data_root, by_name[name]), 'w') as f:
+                json.dump({'fingerprint': fingerprints[name], 'outputs': by_name[name]['outputs'],
+                           'seconds': result['seconds']}, f)
+            print(f"Finished {name} in {result['seconds']:.1f} s", flush=True)
+        else:
+            status[name] = 'Failed'
+            print(f"{name} failed:\n{result['error']}", flush=True)
+
+    if max_workers == 1:
+        start_ready(None)
+    else:
+        # Each stage gets a fresh process, so the peak memory in its run log record is its own
+        with ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=1) as executor:
+            start_ready(executor)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(running.pop(future), future.result())
+                start_ready(executor)
+
+    return pd.DataFrame({'Stage': [name for name in names if name in needed],
+                         'Status': [status[name] for name in names if name in needed],
+                         'Seconds': [seconds.get(name) for name in names if name in needed]})
+
+
+# The stage processes import this module, so the pipeline only runs from the main process
+if __name__ == '__main__':
+    pd.set_option('display.max_colwidth', None)
+    pd.set_option('display.width', 200)
+    summary_df = run_pipeline(stages, data_root, selected_stages, force, max_workers)
+    print(summary_df)
@@ -0,0 +1,70 @@
+# Taxon-by-city tree counts, used by the (4) Taxonomic Diversity reports.
+# The counts of each taxonomic level are built once as a sparse (taxon x city) matrix, so questions about any set of
+# cities (an ecozone, a city size class, the whole country) are column selections and row sums of the matrix instead
+# of new scans of the tree table.
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from diversity import taxon_levels, taxon_counts
+from tree_store import is_tree_store, unique_values
+
+
+# Sparse taxon x city count matrix of every taxonomic level, all sharing the same (sorted) city axis
+# Each level is a dict with the 'counts' matrix and the 'taxa' and 'cities' labelling its rows and columns
+# df is a tree table or a tree store (see tree_store.py)
+def build_prevalence_matrices(df, taxon_columns=None):
+    if taxon_columns is None:
+        taxon_columns = taxon_levels
+    city_values = unique_values(df, 'City') if is_tree_store(df) else df['City'].dropna().unique()
+    cities = pd.Index(sorted(city_values), name='City')
+
+    matrices = {}
+    for taxon_column in taxon_columns:
+        counts = taxon_counts(df, ['City'], taxon_column)
+        taxon_values = counts.index.get_level_values(taxon_column)
+        taxa = pd.Index(sorted(taxon_values.unique()), name=taxon_column)
+        rows = taxa.get_indexer(taxon_values)
+        columns = cities.get_indexer(counts.index.get_level_values('City'))
+        matrices[taxon_column] = {
+            'counts': sparse.csr_matrix((counts.to_numpy(), (rows, columns)), shape=(len(taxa), len(cities))),
+            'taxa': taxa,
+            'cities': cities
+        }
+    return matrices
+
+
+# Columns of the given cities (all cities when None); cities without trees are ignored
+def subset_counts(matrix, cities=None):
+    if cities is None:
+        return matrix['counts']
+    columns = matrix['cities'].get_indexer(pd.unique(pd.Series(list(cities))))
+    return matrix['counts'][:, columns[columns >= 0]]
+
+
+# Number of trees of each taxon in the given cities
+def taxon_totals(matrix, cities=None):
+    totals = np.asarray(subset_counts(matrix, cities).sum(axis=1)).ravel()
+    return pd.Series(totals, index=matrix['taxa'], name='count')
+
+
+# Number of taxa with at least one tree in the given cities, as nunique on their trees gave
+def taxon_richness(matrix, cities=None):
+    return int((taxon_totals(matrix, cities) > 0).sum())
+
+
+# Percentage share of the k most common taxa in the given cities, as value_counts(normalize=True) * 100 gave
+def top_taxa_shares(matrix, cities=None, k=10):
+    totals = taxon_totals(matrix, cities)
+    totals = totals[totals > 0].sort_values(ascending=False, kind='stable')
+    return (totals / totals.sum() * 100).round(2).head(k).rename('proportion')
+
+
+# Number of the given cities in which each taxon has at least min_count trees
+def cities_with_min_count(matrix, taxa, cities=None, min_count=100):
+    counts = subset_counts(matrix, cities).copy()
+    counts.data = (counts.data >= min_count).astype(np.int64)
+    prevalence = np.asarray(counts.sum(axis=1)).ravel()
+    rows = matrix['taxa'].get_indexer(taxa)
+    return {taxon: prevalence[row] if row >= 0 else 0 for taxon, row in zip(taxa, rows)}
@@ -0,0 +1,291 @@
+# Local query service over the analysis-ready dataset. The trees are rolled up once into materialized tables, which
+# every question is then answered from instead of re-reading the dataset:
+# - tree counts per (City, Species, Genus, Family, Nativity), and the same per (City, Downtown) and per
+#   (City, DAUID, Downtown), so a question is answered from the coarsest rollup holding its filters and groups
+# - the DBH cube of dbh_cube.py, for the structural questions
+# Province, Ecozone and City Size are attributes of a city, so filtering or grouping by them selects cities.
+# The rollups are stored next to the dataset with the fingerprint of every city's cleaned partition; a refresh only
+# rebuilds the cities whose partition changed (or all cities when a reference table changed).
+# Run this file to serve the queries over HTTP, e.g. http://localhost:8765/taxon_shares?level=Genus&Ecozone=Mixedwood%20Plains
+# or http://localhost:8765/native_shares?City=Calgary&Downtown=1; /refresh re-reads the changed cities.
+
+import json
+import os
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+from analysis_dataset import read_analysis_dataset, downtown_flags
+from city_partitions import content_fingerprint, read_manifest, read_partition_info
+from dbh_cube import build_dbh_cube, bin_counts, dbh_moments, dbh_median
+from dbh_fitting import bins, labels
+from diversity import taxon_levels, indices_from_counts
+from inventory_loader import file_hash
+
+# Bumped whenever the rollup layout changes, so stored rollups are rebuilt
+rollup_version = 1
+
+# Group keys of each taxon rollup, from the coarsest to the finest
+rollup_keys = {'City': ['City'], 'Downtown': ['City', 'Downtown'], 'DAUID': ['City', 'DAUID', 'Downtown']}
+taxon_columns = ['Species', 'Genus', 'Family', 'Nativity']
+city_attributes = ['Province', 'Ecozone', 'City Size']
+
+# Columns of the analysis dataset the rollups are built from
+rollup_columns = ['Botanical Name', 'City', 'DAUID', 'CTUID', 'DBH', 'Excluded'] + taxon_columns + city_attributes
+
+# Where the service reads the dataset and keeps its rollups, and the address it listens on
+analysis_file = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(2) Filtered Master Dataset.parquet'
+partition_dir = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(2) Filtered Master Dataset Partitions'
+downtown_file = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Downtown Areas.csv'
+reference_files = [r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Location Index.csv',
+                   r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Find and Replace 2.csv',
+                   r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Families Index.csv',
+                   r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\Non-Inventory Datasets\Tree Nativity and Families\Nativity Index.arrow']
+rollup_dir = r'C:\Users\alexj\Documents\Research\Canadian Urban Forest Inventories - Structure and Diversity\Python Scripts and Datasets\(2) Query Rollups'
+host, port = 'localhost', 8765
+
+
+## Rollups
+# Taxon rollups and DBH cube of a set of trees, with the trees flagged Downtown by their Downtown column when they were
+# placed by their coordinates, and otherwise by the Downtown Areas.csv DAs of their city
+# Trees are counted as in the (4) reports: trees without a living name ('missing' or excluded) are left out
+def build_rollups(df, downtown_df):
+    trees = df[~df['Excluded'].astype(bool).to_numpy() & (df['Botanical Name'] != 'missing').to_numpy()]
+    trees = trees.assign(Downtown=downtown_flags(trees, downtown_df))
+
+    rollups = {name: trees.groupby(keys + taxon_columns, observed=True, dropna=False).size().rename('Trees').reset_index()
+               for name, keys in rollup_keys.items()}
+    rollups['DBH'] = build_dbh_cube(df, downtown_df)
+    rollups['Cities'] = df[['City'] + city_attributes].drop_duplicates(subset='City').astype(str)
+    return rollups
+
+
+# Store the text columns of a rollup as categories again after cities were added or replaced
+def as_categories(rollup):
+    for column in rollup.columns:
+        if rollup[column].dtype == object or isinstance(rollup[column].dtype, pd.CategoricalDtype):
+            rollup[column] = rollup[column].astype(str).replace('nan', np.nan).astype('category')
+    return rollup
+
+
+# Fingerprint of each city's cleaned partition, and of the reference tables every city's rollups depend on
+def current_fingerprints(partition_dir, downtown_file, reference_files):
+    cities = read_manifest(partition_dir)
+    city_fingerprints = {city: read_partition_info(partition_dir, city)['fingerprint'] for city in cities}
+    reference = content_fingerprint('query rollups', rollup_version, file_hash(downtown_file),
+                                    *[file_hash(file_name) for file_name in reference_files])
+    return city_fingerprints, reference
+
+
+# Open the stored rollups (an empty store when there are none) and bring them up to date
+def open_rollups(analysis_file, partition_dir, downtown_file, reference_files, rollup_dir):
+    store = {'files': (analysis_file, partition_dir, downtown_file, reference_files, rollup_dir), 'rollups': None,
+             'fingerprints': {}, 'reference': None}
+    info_file = os.path.join(rollup_dir, 'Rollups.json')
+    if os.path.exists(info_file):
+        with open(info_file) as f:
+            info = json.load(f)
+        store['rollups'] = {name: as_categories(pd.read_parquet(os.path.join(rollup_dir, f'{name}.parquet')))
+                            for name in info['rollups']}
+        store['fingerprints'], store['reference'] = info['fingerprints'], info['reference']
+    refresh_rollups(store)
+    return store
+
+
+# Rebuild the rollups of the cities whose cleaned partition changed (every city when a reference table changed), drop
+# the cities no longer in the dataset and save the rollups; returns the rebuilt cities
+def refresh_rollups(store):
+    analysis_file, partition_dir, downtown_file, reference_files, rollup_dir = store['files']
+    city_fingerprints, reference = current_fingerprints(partition_dir, downtown_file, reference_files)
+    if reference != store['reference'] or store['rollups'] is None:
+        changed, kept = list(city_fingerprints), []
+    else:
+        changed = [city for city, fingerprint in city_fingerprints.items()
+                   if store['fingerprints'].get(city) != fingerprint]
+        kept = [city for city in city_fingerprints if city not in changed]
+    if not changed and len(kept) == len(store['fingerprints']):
+        return []
+
+    rollups = {name: rollup[rollup['City'].isin(kept)].astype({'City': str})
+               for name, rollup in (store['rollups'] or {}).items()}
+    if changed:
+        df = read_analysis_dataset(analysis_file, columns=rollup_columns, cities=changed, optional_columns=['Downtown'])
+        rebuilt = build_rollups(df, pd.read_csv(downtown_file, low_memory=False))
+        for name, rollup in rebuilt.items():
+            rollups[name] = pd.concat([rollups[name], rollup.astype({'City': str})], ignore_index=True) if kept \
+                else rollup
+    rollups = {name: as_categories(rollup) for name, rollup in rollups.items()}
+
+    os.makedirs(rollup_dir, exist_ok=True)
+    for name, rollup in rollups.items():
+        rollup.to_parquet(os.path.join(rollup_dir, f'{name}.parquet'), index=False)
+    with open(os.path.join(rollup_dir, 'Rollups.json'), 'w') as f:
+        json.dump({'version': rollup_version, 'reference': reference, 'fingerprints': city_fingerprints,
+                   'rollups': list(rollups)}, f)
+
+    store.update(rollups=rollups, fingerprints=city_fingerprints, reference=reference)
+    return changed
+
+
+## Queries
+# Rows of a rollup matching the filters, e.g. {'Ecozone': 'Mixedwood Plains', 'Downtown': 1}, each a value or a list
+# of values; with the city attributes of the groups (by) joined on
+def select_rows(store, rollup_name, filters, by=()):
+    rollup = store['rollups'][rollup_name]
+    cities = store['rollups']['Cities'].set_index('City')
+    keep = np.ones(len(rollup), dtype=bool)
+    for column, value in filters.items():
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        if column in city_attributes:
+            keep &= rollup['City'].isin(cities.index[cities[column].isin(values)]).to_numpy()
+        elif column in rollup.columns:
+            keep &= rollup[column].isin(values).to_numpy()
+        else:
+            raise ValueError(f"Unknown filter: {column}")
+
+    rows = rollup[keep]
+    for column in by:
+        if column in city_attributes:
+            rows = rows.assign(**{column: rows['City'].map(cities[column]).astype('category')})
+    return rows
+
+
+# Coarsest taxon rollup holding every filter and group column
+def taxon_rollup(filters, by):
+    columns = (set(filters) | set(by)) - set(city_attributes) - set(taxon_columns)
+    for name, keys in rollup_keys.items():
+        if columns <= set(keys):
+            return name
+    raise ValueError(f"No rollup holds {sorted(columns)}")
+
+
+def as_list(by):
+    return [] if by is None else [by] if isinstance(by, str) else list(by)
+
+
+# Percentage share of the k most common taxa of a level, within each group (or all selected trees), as
+# prevalence.top_taxa_shares gives it
+def taxon_shares(store, level='Species', k=10, by=None, **filters):
+    by = as_list(by)
+    rows = select_rows(store, taxon_rollup(filters, by), filters, by)
+    counts = rows.dropna(subset=[level]).groupby(by + [level], observed=True)['Trees'].sum()
+    counts = counts.sort_values(ascending=False, kind='stable')
+    if by:
+        shares = counts / counts.groupby(level=by, observed=True).transform('sum') * 100
+        shares = shares.groupby(level=by, observed=True, group_keys=False).head(k).sort_index(level=by, sort_remaining=False)
+    else:
+        shares = (counts / counts.sum() * 100).head(k)
+    return shares.round(2).rename('proportion').reset_index()
+
+
+# Number of taxa of each level within each group (or all selected trees)
+def taxon_richness(store, by=None, **filters):
+    by = as_list(by)
+    rows = select_rows(store, taxon_rollup(filters, by), filters, by)
+    richness = {level: rows.dropna(subset=[level]).groupby(by, observed=True)[level].nunique() if by
+                else rows[level].nunique() for level in taxon_levels}
+    return pd.DataFrame(richness).reset_index() if by else pd.DataFrame([richness])
+
+
+# Number of the selected cities in which each taxon has at least min_count trees, as prevalence.cities_with_min_count
+def cities_with_min_count(store, level, taxa, min_count=100, **filters):
+    rows = select_rows(store, taxon_rollup(filters, []), filters)
+    counts = rows.groupby(['City', level], observed=True)['Trees'].sum()
+    prevalent = counts[counts >= min_count].groupby(level=level, observed=True).size()
+    return pd.DataFrame({level: list(taxa), 'Cities': prevalent.reindex(list(taxa), fill_value=0).to_numpy()})
+
+
+# Percentage of native trees within each group (or all selected trees); species missing from the distribution data
+# ('M') count as introduced, as in the (4) reports
+def native_shares(store, by=None, **filters):
+    by = as_list(by)
+    rows = select_rows(store, taxon_rollup(filters, by), filters, by).dropna(subset=['Nativity'])
+    native = rows['Trees'].where(rows['Nativity'] == 'N', 0)
+    totals = rows.assign(Native=native).groupby(by, observed=True)[['Native', 'Trees']].sum() if by \
+        else pd.DataFrame({'Native': [native.sum()], 'Trees': [rows['Trees'].sum()]})
+    totals['Native (%)'] = (totals['Native'] / totals['Trees'] * 100).round(2)
+    return totals.reset_index() if by else totals
+
+
+# Shannon, Simpson, richness and evenness of every taxonomic level for each group, as diversity.diversity_indices
+def diversity(store, by='City', **filters):
+    by = as_list(by)
+    rows = select_rows(store, taxon_rollup(filters, by), filters, by)
+    results = []
+    for level in taxon_levels:
+        counts = rows.dropna(subset=[level]).groupby(by + [level], observed=True)['Trees'].sum()
+        results.append(indices_from_counts(counts[counts > 0], by).add_suffix(f'_{level}'))
+    return pd.concat(results, axis=1).reset_index()
+
+
+# Percentage of trees in each DBH class (dbh_fitting bins, closed on the left) within each group
+def dbh_proportions(store, by='City', **filters):
+    by = as_list(by)
+    cube = select_rows(store, 'DBH', filters, by)
+    counts = bin_counts(cube, by, bins, labels=labels, right=False)
+    return (counts.div(counts.sum(axis=1), axis=0) * 100).round(2).reset_index()
+
+
+# Number of trees, mean, standard deviation, skewness and median DBH within each group
+def dbh_summary(store, by='City', **filters):
+    by = as_list(by)
+    cube = select_rows(store, 'DBH', filters, by)
+    return dbh_moments(cube, by).merge(dbh_median(cube, by), on=by)
+
+
+queries = {
+    'taxon_shares': taxon_shares,
+    'taxon_richness': taxon_richness,
+    'cities_with_min_count': cities_with_min_count,
+    'native_shares': native_shares,
+    'diversity': diversity,
+    'dbh_proportions': dbh_proportions,
+    'dbh_summary': dbh_summary
+}
+
+
+## HTTP service
+# Query parameters as keyword arguments: comma-separated values become lists, whole numbers become ints
+def parse_parameters(query_string):
+    def convert(value):
+        return int(value) if value.lstrip('-').isdigit() else value
+
+    parameters = {}
+    for name, values in parse_qs(query_string).items():
+        values = [convert(part) for value in values for part in value.split(',')]
+        parameters[name] = values if len(values) > 1 or name in ('taxa', 'by') else values[0]
+    return parameters
+
+
+# Answer GET /<query>?<parameters> with the result table as JSON records, and GET /refresh with the rebuilt cities
+def query_handler(store):
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            name = url.path.strip('/')
+            try:
+                if name == 'refresh':
+                    result = {'refreshed': refresh_rollups(store)}
+                elif name in queries:
+                    result = queries[name](store, **parse_parameters(url.query)).to_dict('records')
+                else:
+                    raise ValueError(f"Unknown query: {name}; use one of {', '.join(['refresh'] + list(queries))}")
+                status = 200
+            except (ValueError, KeyError, TypeError) as error:
+                result, status = {'error': str(error)}, 400
+
+            body = json.dumps(result, default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+    return QueryHandler
+
+
+if __name__ == '__main__':
+    store = open_rollups(analysis_file, partition_dir, downtown_file, reference_files, rollup_dir)
+    print(f"Serving queries on http://{host}:{port}/ ({', '.join(queries)}, refresh)")
+    HTTPServer((host, port), query_handler(store)).serve_forever()
@@ -0,0 +1,112 @@
+# Bootstrap and rarefaction intervals for diversity indices of groups of trees (City, DAUID, ...), from the trees per
+# category (taxon or DBH class) of each group.
+# Replicates are drawn as count vectors rather than by resampling tree rows: a bootstrap replicate is a multinomial draw
+# of the group's number of trees from its observed proportions, and a rarefied replicate is a multivariate
+# hypergeometric draw of a fixed number of trees without replacement. A replicate therefore costs one value per
+# category whatever the size of the inventory, and the groups are spread over a process pool.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from dbh_cube import bin_counts
+from dbh_fitting import bins
+
+# Replicates drawn at once, bounding the size of the (replicates x categories) arrays
+replicate_block = 1000
+
+
+# Trees per DBH class of the Structural Diversity Index in each group of a DBH cube (dbh_cube.py), using the classes of
+# calculate_shannon_wiener_city ((3) Structural Diversity - City-Level), as a (group, class) count series
+def dbh_class_counts(cube, group_keys):
+    if isinstance(group_keys, str):
+        group_keys = [group_keys]
+    return bin_counts(cube, group_keys, bins, labels=range(1, len(bins))).stack()
+
+
+# Shannon index of every row of a (replicates x categories) count array whose rows all hold n_trees trees
+# H = log(n) - sum(c log c) / n, with c log c looked up in a table instead of computed for every cell
+def shannon_rows(counts, n_trees):
+    tree_counts = np.arange(n_trees + 1)
+    count_log_counts = tree_counts * np.log(np.maximum(tree_counts, 1))
+    return np.log(n_trees) - count_log_counts[counts].sum(axis=1) / n_trees
+
+
+# Point estimates and percentile intervals of one group from its category counts
+# Rarefied values are left empty when the group has fewer trees than the rarefaction depth
+def resample_group(counts, n_replicates, depth, confidence, seed):
+    counts = counts[counts > 0]
+    n_trees = int(counts.sum())
+    row = {'Trees': n_trees, 'Richness': len(counts), 'Rarefaction Depth': depth}
+    if n_trees == 0:
+        return row
+    row['Shannon'] = shannon_rows(counts[np.newaxis, :], n_trees)[0]
+
+    rng = np.random.default_rng(seed)
+    rarefy = depth is not None and depth <= n_trees
+
+    # numpy's 'count' method draws tree by tree and 'marginals' category by category, so use whichever is shorter
+    hypergeometric_method = 'count' if depth is not None and depth < 4 * len(counts) else 'marginals'
+    shannon, rarefied_richness, rarefied_shannon = [], [], []
+    for start in range(0, n_replicates, replicate_block):
+        size = min(replicate_block, n_replicates - start)
+        shannon.append(shannon_rows(rng.multinomial(n_trees, counts / n_trees, size=size), n_trees))
+        if rarefy:
+            rarefied = rng.multivariate_hypergeometric(counts, depth, size=size, method=hypergeometric_method)
+            rarefied_richness.append((rarefied > 0).sum(axis=1))
+            rarefied_shannon.append(shannon_rows(rarefied, depth))
+
+    # Percentile intervals, e.g. the 2.5th and 97.5th percentiles for a confidence of 0.95
+    tails = [(1 - confidence) / 2, (1 + confidence) / 2]
+    row['Shannon Lower'], row['Shannon Upper'] = np.quantile(np.concatenate(shannon), tails)
+    if rarefy:
+        rarefied_richness = np.concatenate(rarefied_richness)
+        rarefied_shannon = np.concatenate(rarefied_shannon)
+        row['Rarefied Richness'] = rarefied_richness.mean()
+        row['Rarefied Richness Lower'], row['Rarefied Richness Upper'] = np.quantile(rarefied_richness, tails)
+        row['Rarefied Shannon'] = rarefied_shannon.mean()
+        row['Rarefied Shannon Lower'], row['Rarefied Shannon Upper'] = np.quantile(rarefied_shannon, tails)
+    return row
+
+
+# Bootstrap interval of the Shannon index and rarefied richness and Shannon (with intervals) of every group
+# counts is a (group, category) count series such as diversity.taxon_counts or dbh_class_counts return
+# depth is the number of trees groups are rarefied to, by default the size of the smallest group
+# Each group draws from its own seed spawned from seed, so results do not depend on the number of workers
+# Scripts calling this with more than one worker need an if __name__ == '__main__' guard (the workers import them)
+def resample_diversity(counts, group_keys, n_replicates=10_000, depth=None, confidence=0.95, seed=0,
+                       max_workers=None):
+    if isinstance(group_keys, str):
+        group_keys = [group_keys]
+
+    # Split the counts into one array per group
+    counts = counts[counts > 0]
+    groups = counts.index.droplevel(-1) if counts.index.nlevels > len(group_keys) else counts.index
+    codes, uniques = pd.factorize(groups)
+    order = np.argsort(codes, kind='stable')
+    group_counts = np.split(counts.to_numpy()[order], np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1])
+
+    if depth is None:
+        depth = int(min(group.sum() for group in group_counts))
+    seeds = np.random.SeedSequence(seed).spawn(len(group_counts))
+    arguments = [group_counts, [n_replicates] * len(group_counts), [depth] * len(group_counts),
+                 [confidence] * len(group_counts), seeds]
+
+    if max_workers == 1:
+        rows = list(map(resample_group, *arguments))
+    else:
+        workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            rows = list(executor.map(resample_group, *arguments,
+                                     chunksize=max(1, len(group_counts) // (4 * workers))))
+
+    columns = ['Trees', 'Richness', 'Shannon', 'Shannon Lower', 'Shannon Upper', 'Rarefaction Depth',
+               'Rarefied Richness', 'Rarefied Richness Lower', 'Rarefied Richness Upper', 'Rarefied Shannon',
+               'Rarefied Shannon Lower', 'Rarefied Shannon Upper']
+    if len(group_keys) > 1:
+        index = pd.MultiIndex.from_tuples(uniques, names=group_keys)
+    else:
+        index = pd.Index(uniques, name=group_keys[0])
+    return pd.DataFrame(rows, index=index, columns=columns).reset_index()
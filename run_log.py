@@ -0,0 +1,94 @@
+# Run log shared by the pipeline stages: each instrumented step (loading, merging or cleaning a city, resolving its
+# taxonomy, running an analysis script) appends one JSON line with its wall time, the peak memory of the process, the
+# rows it read and wrote, the rows each rule dropped and any hit counts it tracks. Records of one pipeline run share a
+# run id, so a production run can be read back as one table to find the slow city, step or rule.
+
+import datetime
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Run log written to the working directory (the data root when run by pipeline.py)
+run_log_file = r'Run Log.jsonl'
+
+
+# Id of a new run: when it started and the process that started it
+def new_run_id():
+    return datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + f'-{os.getpid()}'
+
+
+# Records written by the same run share this id; the environment variable passes it on to the processes a run starts
+run_id = os.environ.setdefault('PIPELINE_RUN_ID', new_run_id())
+
+
+# Give the records written from now on (in this process and the processes it starts) a new run id
+def start_run():
+    global run_id
+    run_id = os.environ['PIPELINE_RUN_ID'] = new_run_id()
+    return run_id
+
+
+# Peak resident memory of this process so far, in MB
+def peak_rss_mb():
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters),
+                                                 counters.cb)
+        return counters.PeakWorkingSetSize / 2 ** 20
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+# Append one record to the run log
+def write_record(record, log_file=run_log_file):
+    record = {'run': run_id, 'time': datetime.datetime.now().isoformat(timespec='seconds'), **record}
+    with open(log_file, 'a') as f:
+        # NumPy counts are stored as plain numbers
+        f.write(json.dumps(record, default=lambda value: value.item()) + '\n')
+
+
+# Time a step and log it when it ends, failed or not. The caller fills in what it knows about the step (rows_out,
+# dropped, hits, ...) on the yielded record
+# peak_rss_mb is the peak of the whole process up to the end of the step; a step run in its own process (as
+# pipeline.py runs the scripts) gets its own peak
+@contextmanager
+def log_stage(stage, city=None, rows_in=None, log_file=run_log_file, **details):
+    record = {'stage': stage, 'city': city, 'rows_in': rows_in, 'rows_out': None, **details}
+    start = time.perf_counter()
+    try:
+        yield record
+        record['status'] = 'ok'
+    except BaseException as error:
+        record['status'] = f'failed: {type(error).__name__}'
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        record['peak_rss_mb'] = round(peak_rss_mb(), 1)
+        write_record(record, log_file)
+
+
+# Read the run log as a table (only the latest run when latest is True), one row per record
+def read_run_log(log_file=run_log_file, latest=False):
+    with open(log_file) as f:
+        log_df = pd.DataFrame([json.loads(line) for line in f if line.strip()])
+    if latest and not log_df.empty:
+        log_df = log_df[log_df['run'] == log_df['run'].iloc[-1]].reset_index(drop=True)
+    return log_df
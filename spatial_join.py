@@ -0,0 +1,115 @@
+# Point-in-polygon placement of geocoded trees in their census dissemination area (DAUID), census tract (CTUID) and
+# downtown, used by Master Cleaning.
+# Each boundary layer is read once and indexed with a Shapely STRtree (a packed R-tree of the polygon bounding boxes).
+# All trees of a block are then placed in one bulk query per layer: the tree only tests the polygons whose boxes hold a
+# point, and the exact point-in-polygon checks run in Shapely's vectorized C code, so millions of trees take seconds.
+# geopandas, shapely (2.0 or later) and pyproj are optional dependencies: only this module needs them, and Master
+# Cleaning only imports it when census boundary files are set.
+
+import numpy as np
+import pandas as pd
+
+try:
+    import geopandas as gpd
+    import shapely
+    from pyproj import Transformer
+    from shapely import STRtree
+except ImportError as error:
+    raise ImportError("Placing trees in census areas needs the optional geopandas, shapely (2.0 or later) and pyproj "
+                      "packages: pip install geopandas shapely pyproj") from error
+
+# Coordinate columns of geocoded inventories and their reference system (longitude and latitude in WGS 84)
+coordinate_columns = ['Longitude', 'Latitude']
+coordinate_crs = 'EPSG:4326'
+
+
+# Read a boundary file (Shapefile, GeoPackage, GeoJSON, ...) and index its polygons, keeping the code columns
+# (DAUID, CTUID) its polygons give their trees
+def read_boundary_layer(file_name, id_columns=()):
+    boundaries = gpd.read_file(file_name)
+    boundaries = boundaries[boundaries.geometry.notna() & ~boundaries.geometry.is_empty].reset_index(drop=True)
+    return {
+        'tree': STRtree(boundaries.geometry.to_numpy()),
+        'ids': {column: pd.to_numeric(boundaries[column], errors='coerce').to_numpy() for column in id_columns},
+        'crs': boundaries.crs
+    }
+
+
+# Read the layers of the given boundary files, a dict of {'DAUID': file, 'CTUID': file, 'Downtown': file}
+# Any layer can be left out, and DAUID and CTUID can name the same file (dissemination area files carry the CTUID of
+# each DA), which is then read and indexed once
+def read_census_layers(boundary_files):
+    file_columns = {}
+    for layer, file_name in boundary_files.items():
+        file_columns.setdefault(file_name, []).extend([] if layer == 'Downtown' else [layer])
+
+    boundary_layers = {file_name: read_boundary_layer(file_name, columns) for file_name, columns in file_columns.items()}
+    return {layer: boundary_layers[file_name] for layer, file_name in boundary_files.items()}
+
+
+# Position of the polygon holding each point (-1 outside every polygon), from one bulk query of the layer's STRtree
+# Points on the border of two polygons go to the first one in the file, so the result does not depend on query order
+def locate_points(layer, points):
+    point_positions, polygon_positions = layer['tree'].query(points, predicate='intersects')
+    located = np.full(len(points), -1, dtype=np.int64)
+    order = np.lexsort((polygon_positions, point_positions))
+    point_positions, polygon_positions = point_positions[order], polygon_positions[order]
+    first = np.diff(point_positions, prepend=-1) != 0
+    located[point_positions[first]] = polygon_positions[first]
+    return located
+
+
+# Points of the trees with coordinates in the reference system of a layer; projected once per reference system
+def tree_points(x, y, crs, projected):
+    key = str(crs)
+    if key not in projected:
+        if crs is not None:
+            x, y = Transformer.from_crs(coordinate_crs, crs, always_xy=True).transform(x, y)
+        projected[key] = shapely.points(x, y)
+    return projected[key]
+
+
+# Place the geocoded trees of a block in the census layers, filling blank DAUID and CTUID values (codes the inventory
+# reports are kept) and adding a Downtown flag (1 inside a downtown polygon, 0 outside, empty without coordinates)
+# The coordinate columns are dropped afterwards, so every city keeps the same columns whether it was geocoded or not
+# Returns the block and the counts reported by Master Cleaning
+def assign_census_areas(df, layers):
+    df = df.copy()
+    counts = {'num_trees_geocoded': 0, 'num_dauid_from_coordinates': 0, 'num_ctuid_from_coordinates': 0,
+              'num_trees_outside_census_areas': 0}
+    if set(coordinate_columns).issubset(df.columns):
+        x = pd.to_numeric(df[coordinate_columns[0]], errors='coerce').to_numpy(dtype=float)
+        y = pd.to_numeric(df[coordinate_columns[1]], errors='coerce').to_numpy(dtype=float)
+    else:
+        x = y = np.full(len(df), np.nan)
+    geocoded = ~(np.isnan(x) | np.isnan(y))
+    counts['num_trees_geocoded'] = int(geocoded.sum())
+
+    # Layers read from the same file are only queried once
+    projected, located_by_layer = {}, {}
+
+    def locate_trees(layer):
+        if id(layer) not in located_by_layer:
+            points = tree_points(x[geocoded], y[geocoded], layer['crs'], projected)
+            located_by_layer[id(layer)] = locate_points(layer, points)
+        return located_by_layer[id(layer)]
+
+    outside = np.zeros(counts['num_trees_geocoded'], dtype=bool)
+    for column in ['DAUID', 'CTUID']:
+        if column not in layers:
+            continue
+        located = locate_trees(layers[column])
+        outside |= located < 0
+        codes = np.full(len(df), np.nan)
+        codes[geocoded] = np.where(located >= 0, layers[column]['ids'][column][np.maximum(located, 0)], np.nan)
+
+        blank = df[column].isna().to_numpy() & ~np.isnan(codes)
+        df.loc[blank, column] = codes[blank]
+        counts[f'num_{column.lower()}_from_coordinates'] = int(blank.sum())
+    counts['num_trees_outside_census_areas'] = int(outside.sum())
+
+    if 'Downtown' in layers:
+        downtown = np.full(len(df), np.nan)
+        downtown[geocoded] = locate_trees(layers['Downtown']) >= 0
+        df['Downtown'] = pd.array(downtown, dtype='Int8')
+    return df.drop(columns=coordinate_columns, errors='ignore'), counts
@@ -0,0 +1,75 @@
+# Translates municipal species codes into botanical names for every tree in one join.
+# Each city with a code dictionary has a CSV in the Tree Species Codes folder with a Code and a Botanical Name column.
+
+import os
+
+import pandas as pd
+
+code_cities = ['Halifax', 'Mississauga', 'Moncton', 'Ottawa', 'Toronto']
+
+
+# Load every code dictionary into one (City, Code) -> Botanical Name table
+def load_species_codes(file_path_species_codes, cities=None):
+    if cities is None:
+        cities = code_cities
+
+    code_tables = []
+    for city in cities:
+        code_dict = pd.read_csv(os.path.join(file_path_species_codes, f'{city}.csv'))
+
+        # Some dictionaries spell the header 'Botanical name'
+        code_dict.columns = code_dict.columns.str.strip()
+        code_dict = code_dict.rename(columns={column: 'Botanical Name' for column in code_dict.columns
+                                              if column.lower() == 'botanical name'})
+
+        code_dict = code_dict[['Code', 'Botanical Name']].copy()
+        code_dict.insert(0, 'City', city)
+        code_tables.append(code_dict)
+
+    codes_df = pd.concat(code_tables, ignore_index=True)
+
+    # A blank code never matches a tree, and the first entry wins when a code is listed twice
+    codes_df = codes_df.dropna(subset=['Code'])
+    codes_df = codes_df.drop_duplicates(subset=['City', 'Code'], keep='first', ignore_index=True)
+
+    return codes_df
+
+
+# Replace species codes with botanical names for the whole frame
+# Returns the translated Botanical Name column and a per-city report of codes that were not found
+def translate_species_codes(master_df, codes_df):
+    lookup = codes_df.rename(columns={'Code': 'Botanical Name', 'Botanical Name': 'Translated Name'})
+    lookup['Matched'] = True
+
+    # A left join on (City, code) keeps one row per tree in the original order
+    merged = master_df[['City', 'Botanical Name']].merge(lookup, how='left', on=['City', 'Botanical Name'])
+    matched = merged['Matched'].notna().to_numpy()
+
+    translated = master_df['Botanical Name'].copy()
+    translated[matched] = merged.loc[matched, 'Translated Name'].to_numpy()
+
+    # Count the trees in code-dictionary cities whose value was not a known code
+    in_code_city = master_df['City'].isin(codes_df['City'].unique()).to_numpy()
+    unmatched_df = master_df.loc[in_code_city & ~matched, ['City', 'Botanical Name']]
+    unmatched_report = unmatched_df.groupby('City').agg(**{
+        'Unmatched Trees': ('Botanical Name', 'size'),
+        'Unmatched Codes': ('Botanical Name', 'nunique')
+    })
+    trees_per_city = master_df.loc[in_code_city, 'City'].value_counts().rename('Trees')
+    unmatched_report = unmatched_report.reindex(trees_per_city.index, fill_value=0)
+    unmatched_report.insert(0, 'Trees', trees_per_city)
+    unmatched_report = unmatched_report.rename_axis('City').reset_index()
+
+    return translated, unmatched_report
+
+
+# Trees per value that matched no code in the code-dictionary cities, most common first, as {city: {value: trees}}
+# Only the top_n values of each city are kept, for the run log
+def unmatched_code_counts(master_df, codes_df, top_n=20):
+    codes = pd.MultiIndex.from_frame(codes_df[['City', 'Code']])
+    trees = master_df[['City', 'Botanical Name']]
+    in_code_city = trees['City'].isin(codes_df['City'].unique()).to_numpy()
+    matched = pd.MultiIndex.from_frame(trees).isin(codes)
+    unmatched = trees[in_code_city & ~matched].fillna({'Botanical Name': 'missing'})
+    return {city: city_values.value_counts().head(top_n).to_dict()
+            for city, city_values in unmatched.groupby('City', sort=False)['Botanical Name']}
@@ -0,0 +1,176 @@
+# Fuzzy matching of inventory names against the WCVP taxon names, used by (B) Find Species Synonyms.
+# Names are blocked by genus: a query is compared with the taxa of its own genus, and with the taxa of the genera
+# within a small edit distance of it when its own genus gives no close match (to catch misspelled genera). Inside a
+# block, a trigram index picks the names sharing the most trigrams with the query, and only those are scored by edit
+# distance. Trigram indexes are built per genus on first use, so matching a few hundred inventory names takes about a
+# second even against the full WCVP names list.
+
+from collections import Counter
+
+import pandas as pd
+
+# Names compared by edit distance after the trigram prefilter
+prefilter_size = 50
+
+# Edits allowed between a misspelled genus and the WCVP genera: one for short genera, two for genera longer than
+# long_genus_length, so swapped letters (qurecus for quercus, two edits) still find their genus
+genus_distances = (1, 2)
+long_genus_length = 5
+
+
+# Lowercase, trim, collapse spaces and drop hybrid markers so '×' and ' x ' spellings compare equal
+def normalize_taxon_name(name):
+    if not isinstance(name, str):
+        return ''
+    name = name.lower().replace('×', ' ').replace("'", '')
+    words = [word for word in name.split() if word != 'x']
+    return ' '.join(words)
+
+
+# Trigrams of a name, padded so short names and word starts still give trigrams
+def trigrams(name):
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Levenshtein distance, only filling the band of cells within max_distance of the diagonal and giving up once the
+# distance must exceed max_distance (returns max_distance + 1 in that case)
+def edit_distance(a, b, max_distance):
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    too_far = max_distance + 1
+    previous = [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        start = max(1, i - max_distance)
+        end = min(len(b), i + max_distance)
+        current = [too_far] * (len(b) + 1)
+        current[0] = i if i <= max_distance else too_far
+        char_a = a[i - 1]
+        for j in range(start, end + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != b[j - 1]))
+        if min(current[start - 1:end + 1]) > max_distance:
+            return too_far
+        previous = current
+    return min(previous[-1], too_far)
+
+
+# Map each trigram to the positions of the names containing it
+def build_trigram_index(names):
+    postings = {}
+    for position, name in enumerate(names):
+        for gram in trigrams(name):
+            postings.setdefault(gram, []).append(position)
+    return postings
+
+
+# Names within max_distance of the query as (distance, position) pairs, scoring only the best trigram candidates
+# One edit changes at most 3 trigrams, so a name sharing fewer than (query trigrams - 3 * max_distance) cannot match
+def nearest_names(query, names, postings, max_distance):
+    query_grams = trigrams(query)
+    shared = Counter()
+    for gram in query_grams:
+        shared.update(postings.get(gram, ()))
+
+    min_shared = len(query_grams) - 3 * max_distance
+    matches = []
+    for position, count in shared.most_common(prefilter_size):
+        if count < min_shared:
+            break
+        distance = edit_distance(query, names[position], max_distance)
+        if distance <= max_distance:
+            matches.append((distance, position))
+    return sorted(matches, key=lambda match: (match[0], names[match[1]]))
+
+
+# Index the WCVP names (taxon_name, plant_name_id, accepted_plant_name_id, taxon_status) by genus
+def build_synonym_index(synonym_df):
+    taxa = synonym_df[['taxon_name', 'plant_name_id', 'accepted_plant_name_id', 'taxon_status']].copy()
+    taxa['Name'] = taxa['taxon_name'].map(normalize_taxon_name)
+    taxa = taxa[taxa['Name'] != ''].drop_duplicates(subset=['Name', 'plant_name_id'], ignore_index=True)
+
+    # Accepted names point at themselves, so every candidate carries the id and name of its accepted taxon
+    accepted = taxa['taxon_status'] == 'Accepted'
+    taxa['accepted_plant_name_id'] = taxa['accepted_plant_name_id'].where(~accepted, taxa['plant_name_id'])
+    accepted_names = taxa[accepted].drop_duplicates(subset='plant_name_id').set_index('plant_name_id')['taxon_name']
+    taxa['Accepted Name'] = taxa['accepted_plant_name_id'].map(accepted_names)
+
+    genera = [name.split(' ', 1)[0] for name in taxa['Name']]
+    blocks = pd.Series(range(len(taxa))).groupby(genera).indices
+    genus_names = sorted(blocks)
+    return {'taxa': taxa, 'blocks': blocks, 'block_indexes': {}, 'genus_names': genus_names,
+            'genus_postings': build_trigram_index(genus_names)}
+
+
+# Names and trigram index of one genus block, built the first time the genus is queried
+def block_index(index, genus):
+    if genus not in index['block_indexes']:
+        names = index['taxa']['Name'].to_numpy()[index['blocks'][genus]].tolist()
+        index['block_indexes'][genus] = (names, build_trigram_index(names))
+    return index['block_indexes'][genus]
+
+
+# Candidates of one name within the given genus blocks as (distance, name, taxa row) tuples
+def block_candidates(index, query, genera, max_distance):
+    candidates = []
+    for genus in genera:
+        names, postings = block_index(index, genus)
+        for distance, position in nearest_names(query, names, postings, max_distance):
+            candidates.append((distance, names[position], index['blocks'][genus][position]))
+    return candidates
+
+
+# Top candidates for one name: the closest WCVP taxa of its genus, adding the genera within genus_distance edits when
+# its own genus gives nothing closer than one edit (a misspelled or unknown genus)
+# genus_distance None allows one edit for short genera and two for long ones (genus_distances)
+def find_candidates(index, name, top_n=5, max_distance=3, genus_distance=None):
+    query = normalize_taxon_name(name)
+    if query == '':
+        return []
+    genus = query.split(' ', 1)[0]
+    if genus_distance is None:
+        genus_distance = genus_distances[len(genus) > long_genus_length]
+
+    candidates = block_candidates(index, query, [genus], max_distance) if genus in index['blocks'] else []
+    if min(candidates, default=(max_distance + 1,))[0] > 1:
+        genera = [index['genus_names'][position] for _, position in
+                  nearest_names(genus, index['genus_names'], index['genus_postings'], genus_distance)]
+        candidates += block_candidates(index, query, [other for other in genera if other != genus], max_distance)
+    candidates.sort(key=lambda candidate: candidate[:2])
+    return candidates[:top_n]
+
+
+# Candidate table for a list of inventory names, one row per (name, candidate) ranked by edit distance
+# Names without any candidate within max_distance get one row with empty candidate columns
+def match_names(index, names, top_n=5, max_distance=3, genus_distance=None):
+    taxa_columns = ['taxon_name', 'taxon_status', 'plant_name_id', 'accepted_plant_name_id', 'Accepted Name']
+    rows = []
+    for name in pd.unique(pd.Series(names).dropna()):
+        candidates = find_candidates(index, name, top_n, max_distance, genus_distance)
+        if not candidates:
+            rows.append((name, None, None, -1))
+        for rank, (distance, _, row) in enumerate(candidates, 1):
+            rows.append((name, rank, distance, row))
+
+    # Look the candidate taxa up in one take, with -1 (no candidate) giving empty columns
+    candidates_df = pd.DataFrame(rows, columns=['Inventory Name', 'Rank', 'Distance', 'Row'])
+    found = candidates_df['Row'].to_numpy() >= 0
+    for column in taxa_columns:
+        values = index['taxa'][column].to_numpy()
+        candidates_df[column] = pd.Series(values.take(candidates_df['Row'].to_numpy())).where(found)
+    return candidates_df.drop(columns='Row')
+
+
+# Best candidate of each name when it is unambiguous: a single accepted taxon at the smallest distance
+def resolve_matches(candidates_df):
+    found = candidates_df.dropna(subset=['accepted_plant_name_id'])
+    best = found[found['Distance'] == found.groupby('Inventory Name')['Distance'].transform('min')]
+    unambiguous = best.groupby('Inventory Name')['accepted_plant_name_id'].transform('nunique') == 1
+    return best[unambiguous].drop_duplicates(subset='Inventory Name', ignore_index=True)
+
+
+# Find and Replace rules (as in Find and Replace.csv) that rewrite resolved names to their accepted name
+def suggest_find_and_replace(resolved_df):
+    rules = pd.DataFrame({'Find': resolved_df['Inventory Name'].map(normalize_taxon_name),
+                          'Replace': resolved_df['Accepted Name'].map(normalize_taxon_name),
+                          'Distance': resolved_df['Distance']})
+    return rules[rules['Find'] != rules['Replace']].reset_index(drop=True)
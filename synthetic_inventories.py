@@ -0,0 +1,302 @@
+# Synthetic city inventories and reference tables shaped like the real ones, for benchmarking the pipeline at any size.
+# Every city gets the Botanical Name, DBH, DAUID, CTUID and City columns with the same kinds of problems as the real
+# exports: mixed case, stray spaces, encoding junk, cultivar quotes, misspellings fixed by Find and Replace, dead trees
+# and stumps, species codes in the code-dictionary cities, DBH in inches in Vancouver, text DBH ranges, zero and
+# impossible DBH values, and trees outside the census areas. Everything is drawn from one seeded generator.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from species_codes import code_cities
+from taxonomy import province_columns
+
+# City, Province, Ecozone, City Size, relative number of trees
+synthetic_cities = [
+    ('Kelowna', 'British Columbia', 'Montane Cordillera', 'Medium', 0.6),
+    ('Maple Ridge', 'British Columbia', 'Pacific Maritime', 'Small', 0.5),
+    ('New Westminster', 'British Columbia', 'Pacific Maritime', 'Small', 0.4),
+    ('Vancouver', 'British Columbia', 'Pacific Maritime', 'Large', 5.5),
+    ('Victoria', 'British Columbia', 'Pacific Maritime', 'Medium', 0.8),
+    ('Calgary', 'Alberta', 'Prairies', 'Large', 5.0),
+    ('Edmonton', 'Alberta', 'Boreal Plains', 'Large', 5.0),
+    ('Lethbridge', 'Alberta', 'Prairies', 'Small', 0.8),
+    ('Strathcona County', 'Alberta', 'Boreal Plains', 'Small', 0.7),
+    ('Regina', 'Saskatchewan', 'Prairies', 'Medium', 3.1),
+    ('Winnipeg', 'Manitoba', 'Prairies', 'Large', 4.5),
+    ('Ajax', 'Ontario', 'Mixedwood Plains', 'Small', 1.4),
+    ('Burlington', 'Ontario', 'Mixedwood Plains', 'Medium', 2.5),
+    ('Guelph', 'Ontario', 'Mixedwood Plains', 'Medium', 1.7),
+    ('Kingston', 'Ontario', 'Mixedwood Plains', 'Medium', 0.9),
+    ('Kitchener', 'Ontario', 'Mixedwood Plains', 'Medium', 1.9),
+    ('Mississauga', 'Ontario', 'Mixedwood Plains', 'Large', 4.0),
+    ('Niagara Falls', 'Ontario', 'Mixedwood Plains', 'Small', 0.9),
+    ('Ottawa', 'Ontario', 'Mixedwood Plains', 'Large', 5.0),
+    ('Peterborough', 'Ontario', 'Mixedwood Plains', 'Small', 1.0),
+    ('St. Catharines', 'Ontario', 'Mixedwood Plains', 'Small', 1.0),
+    ('Toronto', 'Ontario', 'Mixedwood Plains', 'Large', 10.0),
+    ('Waterloo', 'Ontario', 'Mixedwood Plains', 'Small', 1.1),
+    ('Welland', 'Ontario', 'Mixedwood Plains', 'Small', 0.5),
+    ('Whitby', 'Ontario', 'Mixedwood Plains', 'Small', 1.4),
+    ('Windsor', 'Ontario', 'Mixedwood Plains', 'Medium', 2.5),
+    ('Longueuil', 'Quebec', 'Mixedwood Plains', 'Medium', 2.2),
+    ('Montreal', 'Quebec', 'Mixedwood Plains', 'Large', 9.0),
+    ('Quebec City', 'Quebec', 'Mixedwood Plains', 'Large', 4.3),
+    ('Fredericton', 'New Brunswick', 'Atlantic Maritime', 'Small', 0.7),
+    ('Moncton', 'New Brunswick', 'Atlantic Maritime', 'Small', 0.4),
+    ('Halifax', 'Nova Scotia', 'Atlantic Maritime', 'Medium', 2.3),
+]
+
+# First two digits of the census codes of each province
+province_codes = {'Newfoundland': 10, 'Prince Edward Island': 11, 'Nova Scotia': 12, 'New Brunswick': 13, 'Quebec': 24,
+                  'Ontario': 35, 'Manitoba': 46, 'Saskatchewan': 47, 'Alberta': 48, 'British Columbia': 59}
+
+# Common street tree species with their family and the provinces they are native to
+species_pool = [
+    ('acer platanoides', 'Sapindaceae', []),
+    ('acer saccharinum', 'Sapindaceae', ['Manitoba', 'Ontario', 'Quebec', 'New Brunswick', 'Nova Scotia']),
+    ('acer saccharum', 'Sapindaceae', ['Manitoba', 'Ontario', 'Quebec', 'New Brunswick', 'Nova Scotia',
+                                       'Prince Edward Island']),
+    ('acer rubrum', 'Sapindaceae', ['Manitoba', 'Ontario', 'Quebec', 'New Brunswick', 'Nova Scotia',
+                                    'Prince Edward Island', 'Newfoundland']),
+    ('acer freemanii', 'Sapindaceae', []),
+    ('acer negundo', 'Sapindaceae', ['Alberta', 'Saskatchewan', 'Manitoba', 'Ontario', 'Quebec']),
+    ('acer ginnala', 'Sapindaceae', []),
+    ('acer pseudoplatanus', 'Sapindaceae', []),
+    ('acer macrophyllum', 'Sapindaceae', ['British Columbia']),
+    ('fraxinus pennsylvanica', 'Oleaceae', ['Alberta', 'Saskatchewan', 'Manitoba', 'Ontario', 'Quebec',
+                                            'New Brunswick', 'Nova Scotia']),
+    ('fraxinus americana', 'Oleaceae', ['Ontario', 'Quebec', 'New Brunswick', 'Nova Scotia']),
+    ('fraxinus excelsior', 'Oleaceae', []),
+    ('tilia cordata', 'Malvaceae', []),
+    ('tilia americana', 'Malvaceae', ['Manitoba', 'Ontario', 'Quebec', 'New Brunswick']),
+    ('gleditsia triacanthos', 'Fabaceae', []),
+    ('ulmus americana', 'Ulmaceae', ['Saskatchewan', 'Manitoba', 'Ontario', 'Quebec', 'New Brunswick',
+                                     'Nova Scotia']),
+    ('ulmus pumila', 'Ulmaceae', []),
+    ('quercus rubra', 'Fagaceae', ['Ontario', 'Quebec', 'New Brunswick', 'Nova Scotia', 'Prince Edward Island']),
+    ('quercus macrocarpa', 'Fagaceae', ['Saskatchewan', 'Manitoba', 'Ontario', 'Quebec', 'New Brunswick']),
+    ('quercus palustris', 'Fagaceae', ['Ontario']),
+    ('quercus garryana', 'Fagaceae', ['British Columbia']),
+    ('picea pungens', 'Pinaceae', []),
+    ('picea glauca', 'Pinaceae', ['British Columbia', 'Alberta', 'Saskatchewan', 'Manitoba', 'Ontario', 'Quebec',
+                                  'Newfoundland', 'Labrador', 'New Brunswick', 'Nova Scotia']),
+    ('picea abies', 'Pinaceae', []),
+    ('pinus nigra', 'Pinaceae', []),
+    ('pinus sylvestris', 'Pinaceae', []),
+    ('pinus strobus', 'Pinaceae', ['Manitoba', 'Ontario', 'Quebec', 'New Brunswick', 'Nova Scotia']),
+    ('pinus contorta', 'Pinaceae', ['British Columbia', 'Alberta']),
+    ('thuja occidentalis', 'Cupressaceae', ['Manitoba', 'Ontario', 'Quebec', 'New Brunswick', 'Nova Scotia']),
+    ('thuja plicata', 'Cupressaceae', ['British Columbia', 'Alberta']),
+    ('pseudotsuga menziesii', 'Pinaceae', ['British Columbia', 'Alberta']),
+    ('betula papyrifera', 'Betulaceae', ['British Columbia', 'Alberta', 'Saskatchewan', 'Manitoba', 'Ontario',
+                                         'Quebec', 'Newfoundland', 'Labrador', 'New Brunswick', 'Nova Scotia']),
+    ('betula pendula', 'Betulaceae', []),
+    ('populus tremuloides', 'Salicaceae', ['British Columbia', 'Alberta', 'Saskatchewan', 'Manitoba', 'Ontario',
+                                           'Quebec', 'Newfoundland', 'Labrador', 'New Brunswick', 'Nova Scotia']),
+    ('populus deltoides', 'Salicaceae', ['Alberta', 'Saskatchewan', 'Manitoba', 'Ontario', 'Quebec']),
+    ('salix babylonica', 'Salicaceae', []),
+    ('malus pumila', 'Rosaceae', []),
+    ('malus baccata', 'Rosaceae', []),
+    ('prunus serrulata', 'Rosaceae', []),
+    ('prunus virginiana', 'Rosaceae', ['British Columbia', 'Alberta', 'Saskatchewan', 'Manitoba', 'Ontario', 'Quebec',
+                                       'New Brunswick', 'Nova Scotia']),
+    ('prunus cerasifera', 'Rosaceae', []),
+    ('pyrus calleryana', 'Rosaceae', []),
+    ('sorbus aucuparia', 'Rosaceae', []),
+    ('amelanchier laevis', 'Rosaceae', ['Ontario', 'Quebec', 'New Brunswick', 'Nova Scotia']),
+    ('crataegus crus-galli', 'Rosaceae', ['Ontario', 'Quebec']),
+    ('syringa reticulata', 'Oleaceae', []),
+    ('celtis occidentalis', 'Cannabaceae', ['Manitoba', 'Ontario', 'Quebec']),
+    ('ginkgo biloba', 'Ginkgoaceae', []),
+    ('gymnocladus dioicus', 'Fabaceae', ['Ontario']),
+    ('robinia pseudoacacia', 'Fabaceae', []),
+    ('catalpa speciosa', 'Bignoniaceae', []),
+    ('aesculus hippocastanum', 'Sapindaceae', []),
+    ('platanus acerifolia', 'Platanaceae', []),
+    ('liriodendron tulipifera', 'Magnoliaceae', ['Ontario']),
+    ('magnolia kobus', 'Magnoliaceae', []),
+    ('cercidiphyllum japonicum', 'Cercidiphyllaceae', []),
+    ('cornus kousa', 'Cornaceae', []),
+    ('carpinus betulus', 'Betulaceae', []),
+    ('ostrya virginiana', 'Betulaceae', ['Manitoba', 'Ontario', 'Quebec', 'New Brunswick', 'Nova Scotia']),
+    ('juglans nigra', 'Juglandaceae', ['Ontario']),
+    ('morus alba', 'Moraceae', []),
+    ('styrax japonicus', 'Styracaceae', []),
+    ('parrotia persica', 'Hamamelidaceae', []),
+    ('zelkova serrata', 'Ulmaceae', []),
+]
+
+cultivar_names = ['crimson king', 'autumn blaze', 'red sunset', 'deborah', 'skyline', 'shademaster', 'greenspire',
+                  'columnare', 'emerald queen', 'valley forge', 'kwanzan', 'chanticleer', 'schubert', 'fastigiata',
+                  'princeton', 'cumulus', 'imperial', 'marmo', 'ivory silk', 'prairie spire']
+
+# Find and Replace rules whose Find text is inserted into some names, as in the real exports
+generic_fixes = [('species', 'spp.'), ('undefined', 'spp.'), ('unknown spp.', 'missing'), ('to be determined', 'missing'),
+                 ('stump retained', 'stump'), ('wildlife snag', 'dead'), ('acre', 'acer')]
+
+non_living_entries = ['Dead', 'Stump', 'STUMP', 'Vacant', 'Shrub', 'Vines', 'Hedge', 'Stump retained', 'Wildlife snag']
+
+
+# Misspell a species by dropping one letter of its epithet, so the misspelling stays a plausible word
+def misspell(species, rng):
+    genus, epithet = species.split(' ', 1)
+    position = rng.integers(1, len(epithet) - 1)
+    return f'{genus} {epithet[:position]}{epithet[position + 1:]}'
+
+
+# Every raw spelling that can appear in an inventory, with its relative frequency
+def raw_name_table(rng, misspellings):
+    n_species = len(species_pool)
+    # Zipf-like abundance: a handful of species make up most street trees
+    abundance = 1 / np.arange(1, n_species + 1) ** 1.1
+    abundance = abundance[rng.permutation(n_species)]
+
+    names = []
+    weights = []
+    for (species, _, _), weight in zip(species_pool, abundance):
+        genus = species.split()[0]
+        variants = [(species.capitalize(), 0.45), (species.upper(), 0.15), (species.upper() + ' ', 0.05),
+                    (species.title(), 0.05), (genus.capitalize(), 0.04), (f'{genus.capitalize()} species', 0.01),
+                    (misspellings[species].capitalize(), 0.02)]
+        for cultivar in rng.choice(cultivar_names, size=3, replace=False):
+            variants.append((f"{species.capitalize()} '{cultivar.title()}'", 0.05))
+            variants.append((f'{species.upper()}   X {cultivar.upper()}', 0.01))
+        variants.append((f"{species.capitalize()} â€˜{cultivar.title()}â€™", 0.005))
+        variants.append((f'{species.capitalize()}_x000D_', 0.005))
+        for name, share in variants:
+            names.append(name)
+            weights.append(weight * share)
+
+    # Non-living and unidentified entries
+    for name in non_living_entries + ['Unknown spp.', 'To be determined', 'Acre platanoides']:
+        names.append(name)
+        weights.append(abundance.mean() * 0.02)
+
+    weights = np.asarray(weights)
+    return np.asarray(names, dtype=object), weights / weights.sum()
+
+
+# Census areas of a city: DAUIDs grouped into census tracts, about 45 trees per DA and 6 DAs per tract
+def census_areas(rng, province, city_number, n_trees):
+    n_das = max(10, n_trees // 45)
+    n_tracts = max(2, n_das // 6)
+    province_code = province_codes[province]
+    dauids = province_code * 1_000_000 + city_number * 100_000 + np.arange(n_das)
+    tract_numbers = rng.integers(0, n_tracts, size=n_das)
+    # Some tracts are split and carry two decimals, e.g. 5350210.04
+    ctuids = (province_code * 100_000 + city_number * 10_000 + tract_numbers) * 1.0
+    split = rng.random(n_das) < 0.3
+    ctuids[split] += rng.integers(1, 10, size=split.sum()) / 100
+    return dauids, np.round(ctuids, 2)
+
+
+# Generate the city inventories (a dict of DataFrames keyed by city) and every reference table the pipeline reads
+def generate_dataset(n_trees, seed=0, cities=None):
+    rng = np.random.default_rng(seed)
+    city_table = [row for row in synthetic_cities if cities is None or row[0] in cities]
+
+    misspellings = {species: misspell(species, rng) for species, _, _ in species_pool}
+    names, name_weights = raw_name_table(rng, misspellings)
+
+    # Code dictionaries: one code per species and cultivar spelling, e.g. ACPL
+    code_names = [name for name in names if name[:1].isupper() and name[1:2].islower() and 'â€' not in name
+                  and '_x000' not in name and name not in non_living_entries]
+    codes = [''.join(word[:2] for word in name.replace("'", '').split()).upper() + str(number)
+             for number, name in enumerate(code_names)]
+    code_table = pd.DataFrame({'Code': codes, 'Botanical Name': code_names})
+    code_lookup = dict(zip(code_names, codes))
+
+    city_weights = np.array([row[4] for row in city_table])
+    city_sizes = rng.multinomial(n_trees, city_weights / city_weights.sum())
+
+    inventories = {}
+    downtown_tables = []
+    for city_number, ((city, province, _, _, _), size) in enumerate(zip(city_table, city_sizes)):
+        botanical_names = rng.choice(names, size=size, p=name_weights)
+
+        # Lognormal DBH in cm, with zeros, impossible values and text ranges like the real exports
+        dbh = np.round(rng.lognormal(np.log(20), 0.75, size=size), 1).astype(object)
+        problem = rng.random(size)
+        dbh[problem < 0.004] = 0
+        dbh[(problem >= 0.004) & (problem < 0.005)] = 9999
+        dbh[(problem >= 0.005) & (problem < 0.035)] = np.nan
+        # Vancouver records numbers only, since its inches are converted to cm by multiplying the column
+        ranges = (problem >= 0.035) & (problem < 0.036) & (city != 'Vancouver')
+        dbh[ranges] = [f'{low}-{low + 3}' for low in rng.integers(5, 60, size=ranges.sum())]
+        if city == 'Vancouver':
+            numeric = np.array([isinstance(value, float) for value in dbh])
+            dbh[numeric] = np.round(dbh[numeric].astype(float) / 2.54, 1)
+
+        dauids, ctuids = census_areas(rng, province, city_number, size)
+        area = rng.integers(0, len(dauids), size=size)
+        dauid = dauids[area].astype(float)
+        ctuid = ctuids[area]
+        city_column = np.full(size, city, dtype=object)
+
+        # About 1% of trees fall outside the census areas and 1% have a DAUID without a CTUID
+        location_problem = rng.random(size)
+        outside = location_problem < 0.012
+        dauid[outside] = np.nan
+        ctuid[outside] = np.nan
+        city_column[outside] = np.nan
+        ctuid[(location_problem >= 0.012) & (location_problem < 0.022)] = np.nan
+
+        df = pd.DataFrame({'Botanical Name': botanical_names, 'DBH': dbh, 'DAUID': dauid, 'CTUID': ctuid,
+                           'City': city_column})
+
+        # Code-dictionary cities record codes, with a few codes missing from the dictionary
+        if city in code_cities:
+            coded = df['Botanical Name'].map(code_lookup)
+            unknown = rng.random(size) < 0.02
+            coded[unknown] = 'UNK' + pd.Series(rng.integers(0, 40, size=unknown.sum())).astype(str).to_numpy()
+            df['Botanical Name'] = coded.fillna(df['Botanical Name'])
+
+        inventories[city] = df
+
+        # The first 5% of each city's DAs make up its downtown
+        n_downtown = max(1, len(dauids) // 20)
+        downtown_tables.append(pd.DataFrame({'DAUID': dauids, 'DOWNTOWN': np.where(np.arange(len(dauids)) < n_downtown,
+                                                                                   'Downtown', None)}))
+
+    reference_tables = {
+        'species_codes': code_table,
+        'find_and_replace': pd.DataFrame(
+            [(misspelled.split(' ', 1)[1], species.split(' ', 1)[1]) for species, misspelled in misspellings.items()]
+            + generic_fixes, columns=['Find', 'Replace']),
+        'find_and_replace_2': pd.DataFrame({'Species': ['acer platanoids'], 'Fix': ['acer platanoides']}),
+        'family_index': pd.DataFrame(sorted({(species.split()[0], family) for species, family, _ in species_pool}),
+                                     columns=['Genus', 'Family']),
+        'introduced_trees_index': pd.DataFrame(
+            [[species, family] + [0.0 if province in native else 1.0 for province in province_columns]
+             for species, family, native in species_pool],
+            columns=['Botanical Name', 'family'] + province_columns),
+        'location_index': pd.DataFrame(
+            [(city, province, ecozone, city_size, 'x') for city, province, ecozone, city_size, _ in city_table],
+            columns=['City', 'Province', 'Ecozone', 'City Size', 'Downtown Core']),
+        'downtown_areas': pd.concat(downtown_tables, ignore_index=True)
+    }
+    return inventories, reference_tables
+
+
+# Write a generated dataset in the folder layout the numbered scripts read (workbooks are limited to 1,048,575 trees)
+def write_dataset(inventories, reference_tables, file_path):
+    non_inventory = os.path.join(file_path, 'Non-Inventory Datasets')
+    os.makedirs(os.path.join(file_path, 'Inventories'), exist_ok=True)
+    os.makedirs(os.path.join(non_inventory, 'Tree Codes'), exist_ok=True)
+    os.makedirs(os.path.join(non_inventory, 'Tree Nativity and Families'), exist_ok=True)
+
+    for city, df in inventories.items():
+        df.to_excel(os.path.join(file_path, 'Inventories', f'{city}.xlsx'), index=False)
+    for city in code_cities:
+        reference_tables['species_codes'].to_csv(os.path.join(non_inventory, 'Tree Codes', f'{city}.csv'), index=False)
+
+    reference_tables['find_and_replace'].to_csv(os.path.join(non_inventory, 'Find and Replace.csv'), index=False)
+    reference_tables['find_and_replace_2'].to_csv(os.path.join(non_inventory, 'Find and Replace 2.csv'), index=False)
+    reference_tables['family_index'].to_csv(os.path.join(non_inventory, 'Families Index.csv'), index=False)
+    reference_tables['location_index'].to_csv(os.path.join(non_inventory, 'Location Index.csv'), index=False)
+    reference_tables['downtown_areas'].to_csv(os.path.join(non_inventory, 'Downtown Areas.csv'), index=False)
+    reference_tables['introduced_trees_index'].to_csv(
+        os.path.join(non_inventory, 'Tree Nativity and Families', 'Pivoted Family and Distribution Data.csv'),
+        index=False)
@@ -0,0 +1,156 @@
+# This code is based on the work of Ma et al. (2020) (DOI: 10.1016/j.ufug.2020.126826)
+# Shared taxonomy resolution for the Taxonomic Diversity scripts.
+# Species, Genus, Family and Nativity only depend on a tree's Botanical Name and Province, so they are resolved once per
+# distinct (Botanical Name, Province) pair, stored in a lookup table on disk and attached to the trees with one join.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+province_columns = ['British Columbia', 'Alberta', 'Saskatchewan', 'Manitoba', 'Ontario', 'Quebec', 'Newfoundland',
+                    'Labrador', 'Nova Scotia', 'New Brunswick', 'Prince Edward Island']
+
+# Species values that are not living trees
+excluded_species = ["missing", "private", "not known", "vacant"]
+
+# Bit of each province in the native masks
+province_bits = {province: 1 << bit for bit, province in enumerate(province_columns)}
+
+# Bump when the resolution rules change so old lookup tables are rebuilt
+taxonomy_version = 2
+
+
+# Reduce a botanical name to its species, applying the Find and Replace 2 fixes twice
+def clean_species(name, replace_dict):
+    species = ' '.join(name.split()[:2])
+    for _ in range(2):  # Run a second time - do NOT remove this loop
+        species = replace_dict.get(species, species)
+        species = species.lower() if isinstance(species, str) else None
+
+    # Deal with blank (missing) species ID, then make all species names lowercase and trim spaces
+    if species is None or species.strip() == '':
+        return 'missing'
+    species = species.lower().strip()
+
+    # Standardize cultivars and species
+    return species.replace(" x ", " ").replace("'", "")
+
+
+# Function to split, check, and replace 'x' with 'spp.'
+def process_species(species):
+    words = species.split()[:2]  # Split and keep the first two words
+    if len(words) > 1 and words[1] == 'x':  # If the second word is 'x'
+        words[1] = 'spp.'  # Replace 'x' with 'spp.'
+    return ' '.join(words)  # Join the words back together
+
+
+# Function to extract the genus
+def get_genus(species):
+    words = species.split()
+    if words[0] == 'x' and len(words) > 1:
+        return words[1]  # Take the second word if the first is 'x'
+    return words[0]  # Otherwise, take the first word
+
+
+# Combine per-province flags (one column per province) into integer bitmasks
+def flags_to_masks(flags_df):
+    bits = np.array([province_bits[province] for province in flags_df.columns], dtype=np.uint16)
+    return (flags_df.to_numpy(dtype=bool) * bits).sum(axis=1).astype(np.uint16)
+
+
+# Native province bitmask of each species
+# Takes the nativity index written by (A) Add Family and Distribution Data.py, or the pivoted distribution table, whose
+# province columns are collapsed per species: a province is native when some taxon of the species has a value of 0
+def build_native_masks(introduced_trees_index):
+    if 'Native Mask' in introduced_trees_index.columns:
+        return introduced_trees_index[['Species', 'Native Mask']]
+
+    species = introduced_trees_index['Botanical Name'].str.split().str[:2].str.join(' ')
+    native = (introduced_trees_index[province_columns] == 0).groupby(species).any()
+    return pd.DataFrame({'Species': native.index, 'Native Mask': flags_to_masks(native)})
+
+
+# 'M' for species missing from the distribution data, 'N' if the bit of the tree's province is set in the species'
+# native mask, otherwise 'I' (including trees without a known province)
+def classify_nativity(provinces, native_masks):
+    province_mask = provinces.astype(object).map(province_bits).fillna(0).to_numpy(dtype=np.uint16)
+    missing = native_masks.isna().to_numpy()
+    native = native_masks.fillna(0).to_numpy(dtype=np.uint16) & province_mask != 0
+    return pd.Series(np.where(missing, 'M', np.where(native, 'N', 'I')), index=provinces.index)
+
+
+# Resolve Species, Genus, Family and Nativity for each distinct (Botanical Name, Province) pair
+def build_taxonomy_table(pairs, find_and_replace, family_index, introduced_trees_index):
+    replace_dict = dict(zip(find_and_replace['Species'], find_and_replace['Fix']))
+
+    table = pairs[['Botanical Name', 'Province']].drop_duplicates(ignore_index=True)
+    table['Species'] = [clean_species(name, replace_dict) for name in table['Botanical Name']]
+    table['Excluded'] = table['Species'].isin(excluded_species)
+
+    included = ~table['Excluded']
+    table.loc[included, 'Species'] = table.loc[included, 'Species'].map(process_species)
+    table['Genus'] = None
+    table.loc[included, 'Genus'] = table.loc[included, 'Species'].map(get_genus)
+
+    # Get Family
+    table = table.merge(family_index, how='left', on='Genus')
+
+    # Get Nativity from the native province bitmask of each species with one bitwise AND
+    table = table.merge(build_native_masks(introduced_trees_index), how='left', on='Species')
+    table['Native Mask'] = table['Native Mask'].astype('UInt16')
+    table['Nativity'] = classify_nativity(table['Province'], table['Native Mask'])
+
+    return table
+
+
+# Fingerprint the reference tables so the stored lookup table is rebuilt when any of them change
+def reference_fingerprint(find_and_replace, family_index, introduced_trees_index):
+    sha256 = hashlib.sha256(str(taxonomy_version).encode())
+    for reference_df in [find_and_replace, family_index, introduced_trees_index]:
+        sha256.update(','.join(map(str, reference_df.columns)).encode())
+        sha256.update(pd.util.hash_pandas_object(reference_df, index=False).to_numpy().tobytes())
+    return sha256.hexdigest()
+
+
+# Load the stored lookup table, resolving and saving any (Botanical Name, Province) pairs it does not cover yet
+# Only Master Cleaning extends the stored table; the analysis scripts, which run in parallel, open it read_only and
+# resolve any pairs it lacks (or the whole table, if the reference tables changed since) in memory without saving them
+def load_taxonomy_table(df, cache_file, find_and_replace, family_index, introduced_trees_index, read_only=False):
+    fingerprint_file = os.path.splitext(cache_file)[0] + '.json'
+    fingerprint = reference_fingerprint(find_and_replace, family_index, introduced_trees_index)
+
+    table = None
+    if os.path.exists(cache_file) and os.path.exists(fingerprint_file):
+        with open(fingerprint_file) as f:
+            if json.load(f).get('fingerprint') == fingerprint:
+                table = pd.read_parquet(cache_file)
+
+    pairs = df[['Botanical Name', 'Province']].drop_duplicates()
+    if table is not None:
+        known = pairs.merge(table[['Botanical Name', 'Province']].drop_duplicates(), how='left',
+                            on=['Botanical Name', 'Province'], indicator=True)['_merge'] == 'both'
+        pairs = pairs[~known.to_numpy()]
+
+    if table is None or not pairs.empty:
+        new_rows = build_taxonomy_table(pairs, find_and_replace, family_index, introduced_trees_index)
+        table = new_rows if table is None else pd.concat([table, new_rows], ignore_index=True)
+
+        if not read_only:
+            table.to_parquet(cache_file, index=False)
+            with open(fingerprint_file, 'w') as f:
+                json.dump({'fingerprint': fingerprint}, f)
+
+    return table
+
+
+# Attach Species, Genus, Family and Nativity to the trees with one join
+# Non-living trees are dropped unless drop_excluded is False, in which case the Excluded column marks them
+def attach_taxonomy(df, taxonomy_table, drop_excluded=True):
+    df = df.merge(taxonomy_table, how='left', on=['Botanical Name', 'Province'])
+    if not drop_excluded:
+        return df
+    df = df[~df['Excluded'].astype(bool)]
+    return df.drop(columns=['Excluded'])
@@ -0,0 +1,59 @@
+# Checks of the DBH unit inference and outlier fence on the synthetic inventories (see synthetic_inventories.py), in
+# which Vancouver records DBH in inches and every other city in cm. Run with: python -m pytest test_dbh_quality.py
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from dbh_quality import dbh_quality_table, apply_dbh_quality, max_dbh, min_trees
+from synthetic_inventories import generate_dataset
+
+
+def synthetic_dbh():
+    inventories = generate_dataset(20_000, seed=0)[0]
+    return pd.concat([df[['City', 'DBH']] for df in inventories.values()], ignore_index=True)
+
+
+# Vancouver is inferred as inches and every cm city as cm, without warnings (cities with too few trees are kept in cm)
+def test_synthetic_vancouver_in_inches():
+    dbh_df = synthetic_dbh()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        table = dbh_quality_table(dbh_df).set_index('City')
+
+    assert table.loc['Vancouver', 'Unit'] == 'in'
+    assert table.loc['Vancouver', 'Unit Basis'] == 'inferred'
+    assert (table.drop(index='Vancouver')['Unit'] == 'cm').all()
+    assert (table.loc[table['Trees'] >= min_trees, 'Unit Basis'] == 'inferred').all()
+
+    # Converted to cm, Vancouver's trees have the same median as the other cities'
+    dbh, counts = apply_dbh_quality(dbh_df['DBH'], dbh_df['City'], table.reset_index())
+    vancouver = dbh_df['City'] == 'Vancouver'
+    assert counts['num_dbh_converted'] == int(pd.to_numeric(dbh_df.loc[vancouver, 'DBH'], errors='coerce').notna().sum())
+    assert abs(dbh[vancouver].median() - dbh[~vancouver].median()) < 1
+
+
+# An override replaces the inferred unit
+def test_override():
+    table = dbh_quality_table(synthetic_dbh(), {'Vancouver': 'cm'}).set_index('City')
+    assert table.loc['Vancouver', 'Unit'] == 'cm'
+    assert table.loc['Vancouver', 'Unit Basis'] == 'override'
+
+
+# An inventory fitting both cm and inches (small trees) is kept in cm and recorded as ambiguous
+def test_ambiguous_city_kept_in_cm():
+    dbh = np.exp(np.random.default_rng(0).normal(np.log(10), 0.8, size=5000))
+    table = dbh_quality_table(pd.DataFrame({'City': 'Small Trees', 'DBH': dbh}))
+    assert table.loc[0, 'Unit'] == 'cm'
+    assert table.loc[0, 'Unit Basis'] == 'ambiguous, cm assumed'
+    assert table.loc[0, 'Plausible Units'] == 'cm/in'
+
+
+# A class-coded inventory (most trees share one value, so its MAD is 0) is only capped, not fenced at its median
+def test_class_coded_city_only_capped():
+    dbh = np.r_[np.full(3000, 10.0), np.random.default_rng(0).uniform(20, 60, size=2000)]
+    table = dbh_quality_table(pd.DataFrame({'City': 'Classes', 'DBH': dbh}))
+    assert table.loc[0, 'Upper Fence (cm)'] == max_dbh
+    cleaned, counts = apply_dbh_quality(pd.Series(dbh), 'Classes', table)
+    assert counts['num_dbh_above_fence'] == 0
@@ -0,0 +1,244 @@
+# Compact in-memory store of the trees for the analysis scripts.
+# Every text column (City, Botanical Name, Species, Genus, Family, Nativity, ...) is dictionary-encoded: each distinct
+# value is held once in the column's vocabulary and every tree only holds an int16 code (int32 once a column has more
+# than 32,767 distinct values), so a national table costs a few bytes per tree instead of a Python string per cell.
+# Vocabularies can be passed on to the next store (e.g. the next city or chunk), which then shares their codes, so
+# stores built separately are concatenated without decoding.
+# A subset of the trees (a city, its downtown, an ecozone) is a view: the same columns and vocabularies with an array of
+# row positions, so grouping or filtering never copies the table. Counts are taken with bincount on the codes, and
+# diversity.py and prevalence.py accept a store wherever they accept a tree table.
+# Only the analysis scripts that hold the national table (the (4) National Level and Downtown Comparison scripts) use
+# it. Merge and Master Cleaning never hold more than one city (or one chunk of a city) at a time, since they stream the
+# per-city partitions (city_partitions.py), so a store would not lower their peak memory.
+
+import numpy as np
+import pandas as pd
+
+from analysis_dataset import float32_columns
+
+
+# Smallest code type holding a vocabulary of n values (and -1 for missing)
+def code_dtype(n):
+    return np.int16 if n < 2 ** 15 else np.int32
+
+
+# Codes of a column of values in a vocabulary, which is extended with the values it does not hold yet
+# A new vocabulary is sorted (or in category order for categorical values), so codes sort as the values do; values
+# added to an existing vocabulary are appended after it
+# Missing values get the code -1; returns the codes and the (extended) vocabulary
+def encode_column(values, vocabulary=None):
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        value_codes, uniques = values.cat.codes.to_numpy(), pd.Index(values.cat.categories)
+    else:
+        value_codes, uniques = pd.factorize(values, sort=True)
+        uniques = pd.Index(uniques)
+    vocabulary = uniques if vocabulary is None else vocabulary.append(uniques[~uniques.isin(vocabulary)])
+
+    # The extra -1 at the end of the lookup keeps missing values missing
+    lookup = np.append(vocabulary.get_indexer(uniques), -1)
+    return lookup[value_codes].astype(code_dtype(len(vocabulary))), vocabulary
+
+
+# Numbers in their most compact exact type: int32 when whole numbers fit, float32 for the DBH columns
+def compact_numbers(name, values):
+    values = pd.Series(values)
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return values.to_numpy(dtype=bool)
+    if pd.api.types.is_integer_dtype(values.dtype) and not values.isna().any():
+        values = values.to_numpy(dtype=np.int64)
+        fits = len(values) == 0 or (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max)
+        return values.astype(np.int32) if fits else values
+    return values.to_numpy(dtype=np.float32 if name in float32_columns else np.float64, na_value=np.nan)
+
+
+# Store of a tree table: text columns dictionary-encoded (with the given vocabularies, extended as needed), numeric
+# columns as compact arrays
+def build_tree_store(df, vocabularies=None):
+    vocabularies = dict(vocabularies or {})
+    columns = {}
+    for name in df.columns:
+        values = df[name]
+        if pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+            columns[name] = compact_numbers(name, values)
+        else:
+            columns[name], vocabularies[name] = encode_column(values, vocabularies.get(name))
+    return {'columns': columns, 'vocabularies': {name: vocabularies[name] for name in columns if name in vocabularies},
+            'rows': None}
+
+
+def is_tree_store(data):
+    return isinstance(data, dict) and 'vocabularies' in data
+
+
+def store_length(store):
+    if store['rows'] is not None:
+        return len(store['rows'])
+    return len(next(iter(store['columns'].values()))) if store['columns'] else 0
+
+
+# Codes (text columns) or numbers (numeric columns) of a column for the trees of a store or view
+def column_data(store, column):
+    data = store['columns'][column]
+    return data if store['rows'] is None else data[store['rows']]
+
+
+# Values of a column for the trees of a store or view; text columns come back as a Categorical over the vocabulary
+def column_values(store, column):
+    if column in store['vocabularies']:
+        return pd.Categorical.from_codes(column_data(store, column), categories=store['vocabularies'][column])
+    return column_data(store, column)
+
+
+# Tree table of the given columns (all when None), with the text columns as categories
+def to_frame(store, columns=None):
+    columns = list(store['columns']) if columns is None else list(columns)
+    return pd.DataFrame({column: column_values(store, column) for column in columns})
+
+
+## Views
+# View of the trees at the given positions of a store or view, sharing its columns and vocabularies
+def take(store, rows):
+    rows = np.asarray(rows, dtype=np.int64)
+    return {**store, 'rows': rows if store['rows'] is None else store['rows'][rows]}
+
+
+# View of the trees whose columns hold one of the given values, e.g. select(store, City=['Guelph', 'Windsor'])
+def select(store, **filters):
+    keep = np.ones(store_length(store), dtype=bool)
+    for column, values in filters.items():
+        values = list(values) if isinstance(values, (list, tuple, set, pd.Index, pd.Series, np.ndarray)) else [values]
+        if column in store['vocabularies']:
+            codes = store['vocabularies'][column].get_indexer(values)
+            keep &= np.isin(column_data(store, column), codes[codes >= 0])
+        else:
+            keep &= np.isin(column_data(store, column), values)
+    return take(store, np.flatnonzero(keep))
+
+
+# Group number of every tree from its values of the key columns (-1 when one is missing), the key values of every
+# group and the order of the groups by their codes; groups are numbered in order of first appearance
+def group_codes(store, keys):
+    key_codes, key_values = [], []
+    for key in keys:
+        if key in store['vocabularies']:
+            codes = column_data(store, key).astype(np.int64)
+            key_codes.append(codes)
+            key_values.append(store['vocabularies'][key])
+        else:
+            codes, uniques = pd.factorize(column_data(store, key), sort=True)
+            key_codes.append(codes.astype(np.int64))
+            key_values.append(pd.Index(uniques))
+
+    missing = np.zeros(store_length(store), dtype=bool)
+    for codes in key_codes:
+        missing |= codes < 0
+    sizes = [max(len(values), 1) for values in key_values]
+    combined = np.ravel_multi_index([np.maximum(codes, 0) for codes in key_codes], sizes)
+    group_ids, group_keys = pd.factorize(np.where(missing, -1, combined), use_na_sentinel=False)
+    group_ids[missing] = -1
+
+    present = np.asarray(group_keys) >= 0
+    positions = np.unravel_index(np.asarray(group_keys)[present], sizes)
+    labels = [values.take(position) for values, position in zip(key_values, positions)]
+    group_numbers = np.full(len(group_keys), -1)
+    group_numbers[present] = np.arange(present.sum())
+    code_order = np.argsort(np.asarray(group_keys)[present], kind='stable')
+    return np.where(group_ids >= 0, group_numbers[np.maximum(group_ids, 0)], -1), labels, code_order
+
+
+# View of every group of trees with the same key values, in order of first appearance; trees missing a key are left out
+# Keys are single values for one key column and tuples for several
+def group_views(store, keys):
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    groups, labels, _ = group_codes(store, keys)
+    order = np.argsort(groups, kind='stable')
+    order = order[groups[order] >= 0]
+    bounds = np.cumsum(np.bincount(groups[groups >= 0], minlength=len(labels[0])))[:-1]
+    names = labels[0] if len(keys) == 1 else list(zip(*labels))
+    return {name: take(store, rows) for name, rows in zip(names, np.split(order, bounds))}
+
+
+## Counts
+# Number of trees of every combination of the key columns, as groupby(keys, observed=True).size() gave
+# Groups are in the order of their codes, i.e. sorted by value (or category) as groupby sorts them
+def group_counts(store, keys):
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    groups, labels, code_order = group_codes(store, keys)
+    counts = np.bincount(groups[groups >= 0], minlength=len(labels[0]))
+    labels = [values[code_order] for values in labels]
+    index = pd.Index(labels[0], name=keys[0]) if len(keys) == 1 else pd.MultiIndex.from_arrays(labels, names=keys)
+    return pd.Series(counts[code_order], index=index)
+
+
+# Number of trees of each value of a column, most common first, as value_counts gave
+def value_counts(store, column, normalize=False):
+    codes = column_data(store, column)
+    counts = pd.Series(np.bincount(codes[codes >= 0], minlength=len(store['vocabularies'][column])),
+                       index=store['vocabularies'][column].rename(column), name='count')
+    counts = counts[counts > 0].sort_values(ascending=False, kind='stable')
+    return (counts / counts.sum()).rename('proportion') if normalize else counts
+
+
+# Distinct values of a column held by the trees in order of first appearance, as unique gave; missing values left out
+def unique_values(store, column):
+    data = column_data(store, column)
+    if column in store['vocabularies']:
+        return store['vocabularies'][column].take(pd.unique(data[data >= 0]))
+    return pd.Index(pd.unique(data[~pd.isna(data)]))
+
+
+def nunique(store, column):
+    return len(unique_values(store, column))
+
+
+## Building stores
+# Store with a column added (or replaced), given for every tree of the store (not of a view)
+def add_column(store, name, values, vocabulary=None):
+    extra = build_tree_store(pd.DataFrame({name: values}),
+                             None if vocabulary is None else {name: vocabulary})
+    vocabularies = {**store['vocabularies'], **extra['vocabularies']}
+    if name not in extra['vocabularies']:
+        vocabularies.pop(name, None)
+    return {'columns': {**store['columns'], name: extra['columns'][name]}, 'vocabularies': vocabularies,
+            'rows': store['rows']}
+
+
+# One store of the trees of several stores or views (e.g. one per city), with the vocabularies merged
+def concat_stores(stores):
+    columns, vocabularies = {}, {}
+    for name in stores[0]['columns']:
+        if name in stores[0]['vocabularies']:
+            vocabulary = stores[0]['vocabularies'][name]
+            for store in stores[1:]:
+                other = store['vocabularies'][name]
+                vocabulary = vocabulary.append(other[~other.isin(vocabulary)])
+            parts = []
+            for store in stores:
+                lookup = np.append(vocabulary.get_indexer(store['vocabularies'][name]), -1)
+                parts.append(lookup[column_data(store, name)])
+            columns[name] = np.concatenate(parts).astype(code_dtype(len(vocabulary)))
+            vocabularies[name] = vocabulary
+        else:
+            columns[name] = np.concatenate([column_data(store, name) for store in stores])
+    return {'columns': columns, 'vocabularies': vocabularies, 'rows': None}
+
+
+# Bytes held by the store: its column arrays, row positions and vocabularies
+def memory_usage(store):
+    arrays = sum(data.nbytes for data in store['columns'].values())
+    rows = 0 if store['rows'] is None else store['rows'].nbytes
+    return arrays + rows + sum(vocabulary.memory_usage(deep=True) for vocabulary in store['vocabularies'].values())
+
+
+# Type, number of distinct values and bytes of every column of the store
+def store_summary(store):
+    rows = []
+    for name, data in store['columns'].items():
+        vocabulary = store['vocabularies'].get(name)
+        rows.append({'Column': name, 'Type': data.dtype.name,
+                     'Values': len(vocabulary) if vocabulary is not None else None,
+                     'MB': (data.nbytes + (0 if vocabulary is None else vocabulary.memory_usage(deep=True))) / 2 ** 20})
+    summary_df = pd.DataFrame(rows)
+    summary_df['MB'] = summary_df['MB'].round(2)
+    return summary_df
@@ -0,0 +1,131 @@
+# Canadian nativity index built from the WCVP Names.csv and Distribution.csv files
+# From the Royal Botanical Gardens (https://sftp.kew.org/pub/data-repositories/WCVP/)
+# Both files are streamed in blocks. Distribution is reduced to the Canadian areas before anything is joined, so only
+# the plant_name_ids with a Canadian record are kept from Names. The result is one row per species with its family and
+# a province bitmask, stored as an uncompressed Arrow file sorted by species that can be memory-mapped.
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+from name_normalizer import map_unique
+from taxonomy import province_bits, flags_to_masks
+
+## Area Code Level 3: Three letter botanical area code (TDWG Level 3)
+provincial_codes = {'MAN': 'Manitoba', 'ONT': 'Ontario', 'SAS': 'Saskatchewan', 'ABT': 'Alberta',
+                    'BRC': 'British Columbia', 'QUE': 'Quebec', 'PEI': 'Prince Edward Island', 'NBR': 'New Brunswick',
+                    'NSC': 'Nova Scotia', 'NFL': 'Newfoundland', 'LAB': 'Labrador'}
+
+# Columns of the pivoted table written by (A) Add Family and Distribution Data.py
+columns_to_keep = ['plant_name_id', 'taxon_rank', 'family', 'genus_hybrid', 'genus', 'species_hybrid', 'species',
+                   'taxon_name', 'area_code_l3', 'introduced']
+
+
+# Stream a pipe-delimited WCVP file as record batches of the requested columns (no quoting, blanks kept as text)
+def read_wcvp_batches(file_name, columns, block_size=1 << 24):
+    column_types = {column: pa.int64() if column == 'introduced' else pa.string() for column in columns}
+    return pa_csv.open_csv(
+        file_name,
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        parse_options=pa_csv.ParseOptions(delimiter='|', quote_char=False),
+        convert_options=pa_csv.ConvertOptions(include_columns=columns, column_types=column_types,
+                                              strings_can_be_null=False))
+
+
+# Distribution records in the Canadian areas, filtered block by block
+def read_canadian_distribution(distribution_file):
+    canadian_codes = pa.array(list(provincial_codes))
+    batches = []
+    for batch in read_wcvp_batches(distribution_file, ['plant_name_id', 'area_code_l3', 'introduced']):
+        batches.append(batch.filter(pc.is_in(batch.column('area_code_l3'), value_set=canadian_codes)))
+    return pa.Table.from_batches(batches).to_pandas()
+
+
+# Names rows of the given plant_name_ids, filtered block by block
+def read_names(names_file, plant_name_ids, columns):
+    plant_name_ids = pa.array(pd.unique(plant_name_ids), type=pa.string())
+    batches = []
+    for batch in read_wcvp_batches(names_file, columns):
+        batches.append(batch.filter(pc.is_in(batch.column('plant_name_id'), value_set=plant_name_ids)))
+    return pa.Table.from_batches(batches).to_pandas()
+
+
+# Canadian WCVP records with their names, the same rows the inner join of the full files gave after filtering
+def read_canadian_records(names_file, distribution_file):
+    distribution_df = read_canadian_distribution(distribution_file)
+    name_columns = [column for column in columns_to_keep if column not in ['area_code_l3', 'introduced']]
+    names_df = read_names(names_file, distribution_df['plant_name_id'], name_columns)
+    return names_df.merge(distribution_df, on='plant_name_id', how='inner')[columns_to_keep]
+
+
+# Normalize a WCVP taxon name the way (A) always has
+def normalize_wcvp_name(name):
+    # Make all species names lowercase and trim spaces
+    name = name.lower().strip().replace(" x ", " ").replace("'", "").replace("xxxx ", "")
+
+    # Add spp. to genus-only identification, trimming spaces in any case
+    if len(name.strip().split()) == 1:
+        name = name.strip() + " spp."
+    name = name.strip()
+
+    # Remove any incorrect letters
+    return name.replace("Ã—", "").replace("Ã", "")
+
+
+# Pivot the records to one column per province code, as in Pivoted Family and Distribution Data.csv
+def pivot_distribution(records_df):
+    WCVP_df = records_df.rename(columns={'area_code_l3': 'Province', 'taxon_name': 'Botanical Name'})
+    df_pivot = WCVP_df.pivot_table(index=['Botanical Name', 'family'], columns='Province', values='introduced',
+                                   fill_value=0)
+    df_pivot = df_pivot.reset_index()
+    df_pivot.columns.name = None
+    df_pivot['Botanical Name'] = map_unique(df_pivot['Botanical Name'], normalize_wcvp_name)
+    return df_pivot
+
+
+# One row per species (the first two words of the name) with its family and two province bitmasks, using the bits of
+# taxonomy.province_bits
+# Recorded Mask: provinces with a WCVP record for the species
+# Native Mask: provinces where the species counts as native in the pivoted table, i.e. where some taxon of the
+# species is not recorded as introduced (a province without a record has a pivoted value of 0, as before)
+# df_pivot can be passed when the pivoted table has already been built from the same records
+def build_nativity_index(records_df, df_pivot=None):
+    if df_pivot is None:
+        df_pivot = pivot_distribution(records_df)
+    df_pivot = df_pivot.reindex(columns=['Botanical Name', 'family'] + list(provincial_codes), fill_value=0)
+    species = df_pivot['Botanical Name'].str.split().str[:2].str.join(' ')
+
+    native_df = (df_pivot[list(provincial_codes)] == 0).rename(columns=provincial_codes)
+    native_df = native_df.groupby(species).any()
+
+    records_species = map_unique(records_df['taxon_name'],
+                                 lambda name: ' '.join(normalize_wcvp_name(name).split()[:2]))
+    recorded_df = pd.DataFrame({province: (records_df['area_code_l3'] == code).to_numpy()
+                                for code, province in provincial_codes.items()})
+    recorded_df = recorded_df.groupby(records_species.to_numpy()).any().reindex(native_df.index, fill_value=False)
+
+    return pd.DataFrame({
+        'Species': native_df.index,
+        'Family': df_pivot.groupby(species)['family'].first().reindex(native_df.index).to_numpy(),
+        'Native Mask': flags_to_masks(native_df),
+        'Recorded Mask': flags_to_masks(recorded_df)
+    })
+
+
+# Write the index as an uncompressed Arrow file so readers can memory-map it
+def write_nativity_index(index_df, file_name):
+    table = pa.Table.from_pandas(index_df, preserve_index=False)
+    with pa.OSFile(file_name, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+# Memory-map the index; rows are sorted by Species
+def read_nativity_index(file_name):
+    with pa.memory_map(file_name) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+# Space-joined province names of a mask, in the form of the Province Nativity column ("None" when empty)
+def mask_to_provinces(mask):
+    return ' '.join(province for province, bit in province_bits.items() if mask & bit) or "None"